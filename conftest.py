@@ -4,8 +4,9 @@ from pgscatalog_utils.download.download_scorefile import download_scorefile
 import os
 import requests as req
 from pgscatalog_utils.scorefile.combine_scorefiles import combine_scorefiles
+from pgscatalog_utils.match.match_variants import match_variants
 from pysqlar import SQLiteArchive
-import pandas as pd
+import polars as pl
 import glob
 
 
@@ -122,24 +123,40 @@ def lifted_scorefiles(scorefiles, chain_files, tmp_path_factory):
     return str(out_path.resolve())
 
 
+@pytest.fixture
+def run_match(tmp_path, monkeypatch):
+    """ Run match_variants with extra flags, returning the output directory """
+    monkeypatch.chdir(tmp_path)  # log is written to the working directory
+
+    def run(scorefile: str, target: str, *flags: str, out_dir: str = 'out') -> str:
+        out_path: str = str((tmp_path / out_dir).resolve())
+        args: list[str] = ['match_variants', '-s', scorefile, '-t', target, '-m', '0', '-d', 'test',
+                           '--outdir', out_path, *flags]
+        with patch('sys.argv', args):
+            match_variants()
+        return out_path
+
+    return run
+
+
 @pytest.fixture(scope="session")
 def hg38_coords(tmp_path_factory):
     out_path = tmp_path_factory.mktemp("dummy") / "hg38.txt"
     d = {'rsid': ['rs11903757', 'rs6061231'], 'chr_name': ['2', '20'], 'chr_position': [191722478, 62381861]}
-    df = pd.DataFrame(d)
+    df = pl.DataFrame(d).with_column(pl.col('chr_position').cast(pl.UInt64))
     with open(out_path, 'w') as f:
         f.write('#genome_build=GRCh38\n')
-    df.to_csv(out_path, mode='a', index=False)
-    df['filename'] = str(out_path.resolve())
-    df['accession'] = 'dummy'
-    return df
+    with open(out_path, 'ab') as f:  # polars writes bytes
+        df.write_csv(f)
+    return df.with_columns([pl.lit(str(out_path.resolve())).alias('filename'),
+                            pl.lit('dummy').alias('accession')]).lazy()
 
 
 @pytest.fixture(scope="session")
 def hg19_coords(hg38_coords):
     # hg38_coords in GRCh37, from dbSNP
     d = {'lifted_chr': ['2', '20'], 'lifted_pos': [192587204, 60956917], 'liftover': [True, True]}
-    return pd.DataFrame(d)
+    return pl.DataFrame(d).with_column(pl.col('lifted_pos').cast(pl.UInt64))
 
 
 def _get_timeout(url):
@@ -0,0 +1,22 @@
+import contextlib
+import os
+import tempfile
+from typing import Iterator
+
+
+@contextlib.contextmanager
+def atomic_write(path: str) -> Iterator[str]:
+    """ Get a unique temporary path to write instead of path, which replaces path when the block finishes
+
+    The file is renamed atomically, so readers (and concurrent writers, in other threads or processes) never see a
+    partial file. The temporary file is removed if writing fails.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.',
+                                    suffix='.tmp')
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
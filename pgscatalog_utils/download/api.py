@@ -0,0 +1,90 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, TypeVar
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from pgscatalog_utils.atomic_write import atomic_write
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+_MAX_CONNECTIONS: int = 8  # concurrent queries to the PGS Catalog API
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+_cache_dir: str | None = None  # responses are only cached if set_cache is called
+_cache_ttl: float = 0
+
+
+def set_cache(cache_dir: str | None, ttl: float) -> None:
+    """ Cache JSON responses from the PGS Catalog API on disk for ttl seconds """
+    global _cache_dir, _cache_ttl
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        logger.debug(f"Caching API responses in {cache_dir} for {ttl} seconds")
+    _cache_dir, _cache_ttl = cache_dir, ttl
+
+
+def get_json(url: str) -> dict:
+    """ Query the PGS Catalog API with a shared, pooled connection and return the JSON response """
+    cached: dict | None = _read_cache(url)
+    if cached is not None:
+        logger.debug(f"Using cached response for {url}")
+        return cached
+
+    r: requests.models.Response = _get_session().get(url, timeout=60)
+    if not r.ok:  # error pages aren't always JSON
+        logger.critical(f"PGS Catalog API request failed (HTTP {r.status_code}): {url}")
+        raise Exception
+
+    response: dict = r.json()
+    _write_cache(url, response)
+    return response
+
+
+def thread_map(func: Callable[[T], R], items: Iterable[T]) -> list[R]:
+    """ Apply a query function to each item concurrently. Results are in the same order as items """
+    with ThreadPoolExecutor(max_workers=_MAX_CONNECTIONS) as executor:
+        return list(executor.map(func, items))
+
+
+def _get_session() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=_MAX_CONNECTIONS))
+        return _session
+
+
+def _cache_path(url: str) -> str:
+    return os.path.join(_cache_dir, hashlib.sha256(url.encode()).hexdigest() + '.json')
+
+
+def _read_cache(url: str) -> dict | None:
+    if _cache_dir is None:
+        return None
+    path: str = _cache_path(url)
+    try:
+        if time.time() - os.path.getmtime(path) > _cache_ttl:
+            logger.debug(f"Cached response for {url} expired")
+            return None
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _write_cache(url: str, response: dict) -> None:
+    if _cache_dir is None:
+        return
+    with atomic_write(_cache_path(url)) as tmp_path, open(tmp_path, 'w') as f:
+        json.dump(response, f)  # concurrent launches never read a partial response
@@ -1,15 +1,14 @@
 import argparse
 import logging
 import os
-import shutil
 import textwrap
-from contextlib import closing
 from functools import reduce
-from urllib import request as request
 
+from pgscatalog_utils.download.api import set_cache, thread_map
 from pgscatalog_utils.download.publication import query_publication
 from pgscatalog_utils.download.score import get_url
 from pgscatalog_utils.download.trait import query_trait
+from pgscatalog_utils.download.transfer import download_files
 from pgscatalog_utils.log_config import set_logging_level
 
 logger = logging.getLogger(__name__)
@@ -20,6 +19,7 @@ def download_scorefile() -> None:
     set_logging_level(args.verbose)
     _check_args(args)
     _mkdir(args.outdir)
+    set_cache(args.api_cache_dir, ttl=args.api_cache_ttl * 3600)
 
     if args.build is None:
         logger.critical(f'Downloading scoring file(s) in the author-reported genome build')
@@ -33,11 +33,11 @@ def download_scorefile() -> None:
 
     if args.efo:
         logger.debug("--trait set, querying traits")
-        pgs_lst = pgs_lst + [query_trait(x) for x in args.efo]
+        pgs_lst = pgs_lst + thread_map(query_trait, args.efo)
 
     if args.pgp:
         logger.debug("--pgp set, querying publications")
-        pgs_lst = pgs_lst + [query_publication(x) for x in args.pgp]
+        pgs_lst = pgs_lst + thread_map(query_publication, args.pgp)
 
     if args.pgs:
         logger.debug("--id set, querying scores")
@@ -47,13 +47,16 @@ def download_scorefile() -> None:
 
     urls: dict[str, str] = get_url(pgs_id, args.build)
 
+    paths: dict[str, str] = {}
     for pgsid, url in urls.items():
         logger.debug(f"Downloading {pgsid} from {url}")
         if args.build is None:
             path: str = os.path.join(args.outdir, pgsid + '.txt.gz')
         else:
             path: str = os.path.join(args.outdir, pgsid + f'_hmPOS_{args.build}.txt.gz')
-        _download_ftp(url, path)
+        paths[path] = url
+
+    download_files(paths, workers=args.workers, retries=args.retries)
 
 
 def _mkdir(outdir: str) -> None:
@@ -62,16 +65,6 @@ def _mkdir(outdir: str) -> None:
         os.makedirs(outdir)
 
 
-def _download_ftp(url: str, path: str) -> None:
-    if os.path.exists(path):
-        logger.warning(f"File already exists at {path}, skipping download")
-        return
-    else:
-        with closing(request.urlopen(url)) as r:
-            with open(path, 'wb') as f:
-                shutil.copyfileobj(r, f)
-
-
 def _check_args(args):
     if not args.efo:
         if not args.pgp:
@@ -105,7 +98,9 @@ def _epilog_text() -> str:
     download_scorefiles will skip downloading a scoring file if it
     already exists in the download directory. This can be useful if
     the download process is interrupted and needs to be restarted
-    later. You can track download progress with the verbose flag.    
+    later. Scoring files are downloaded to a temporary .part file
+    first, and partial downloads are resumed when possible. You can
+    track download progress with the verbose flag.    
    ''')
 
 
@@ -121,6 +116,15 @@ def _parse_args(args=None) -> argparse.Namespace:
     parser.add_argument('-o', '--outdir', dest='outdir', required=True,
                         default='scores/',
                         help='<Required> Output directory to store downloaded files')
+    parser.add_argument('--api_cache_dir', dest='api_cache_dir', default=None,
+                        help='<Optional> Directory to cache PGS Catalog API responses, so repeated queries for the '
+                             'same IDs are answered locally')
+    parser.add_argument('--api_cache_ttl', dest='api_cache_ttl', type=float, default=24,
+                        help='<Optional> Hours before a cached API response expires (default: 24)')
+    parser.add_argument('--workers', dest='workers', type=int, default=4,
+                        help='<Optional> Number of scoring files to download at the same time')
+    parser.add_argument('--retries', dest='retries', type=int, default=5,
+                        help='<Optional> Number of times to retry a failed download, waiting longer each time')
     parser.add_argument('-v', '--verbose', dest='verbose', action='store_true',
                         help='<Optional> Extra logging information')
     return parser.parse_args(args)
@@ -1,8 +1,9 @@
-import requests
 import logging
 import jq
 import sys
 
+from pgscatalog_utils.download.api import get_json, thread_map
+
 logger = logging.getLogger(__name__)
 
 
@@ -10,9 +11,9 @@ def get_url(pgs: list[str], build: str) -> dict[str, str]:
     pgs_result: list[str] = []
     url_result: list[str] = []
 
-    for chunk in _chunker(pgs):
+    for json in thread_map(query_score, _chunker(pgs)):  # chunks are queried concurrently
         try:
-            response = _parse_json_query(query_score(chunk), build)
+            response = _parse_json_query(json, build)
             pgs_result = pgs_result + list(response.keys())
             url_result = url_result + list(response.values())
         except TypeError:
@@ -30,8 +31,7 @@ def get_url(pgs: list[str], build: str) -> dict[str, str]:
 def query_score(pgs_id: list[str]) -> dict:
     pgs: str = ','.join(pgs_id)
     api: str = f'https://www.pgscatalog.org/rest/score/search?pgs_ids={pgs}'
-    r: requests.models.Response = requests.get(api)
-    return r.json()
+    return get_json(api)
 
 
 def _chunker(pgs: list[str]):
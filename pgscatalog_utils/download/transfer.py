@@ -0,0 +1,120 @@
+import ftplib
+import http.client
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from urllib import request as request
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+_RETRY_HTTP_CODES: frozenset[int] = frozenset({408, 416, 429})  # client errors that can succeed if retried
+
+
+def download_files(urls: dict[str, str], workers: int = 4, retries: int = 5, backoff: float = 1.0) -> None:
+    """ Download many files concurrently with a bounded pool of threads
+
+    urls is a dict of {path: url}. Every download is attempted before failures are reported together.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {path: executor.submit(download_file, url, path, retries, backoff) for path, url in urls.items()}
+
+    failed: dict[str, BaseException] = {path: f.exception() for path, f in futures.items() if f.exception()}
+    for path, error in failed.items():
+        logger.critical(f"Couldn't download {urls[path]} to {path}: {error}")
+
+    if failed:
+        raise Exception(f"{len(failed)} download(s) failed")
+
+
+def download_file(url: str, path: str, retries: int = 5, backoff: float = 1.0) -> None:
+    """ Download a file over FTP or HTTP(S)
+
+    Data are written to a temporary .part file that is renamed when the download is complete, so an
+    interrupted download is never mistaken for a complete file. Interrupted downloads are resumed from the
+    end of the .part file, and failed attempts are retried with exponential backoff. Client errors (e.g. HTTP 404)
+    aren't retried.
+    """
+    if os.path.exists(path):
+        logger.warning(f"File already exists at {path}, skipping download")
+        return
+
+    part: str = path + '.part'
+    for attempt in range(retries + 1):
+        try:
+            offset: int = os.path.getsize(part) if os.path.exists(part) else 0
+            if offset:
+                logger.debug(f"Resuming download of {url} from byte {offset}")
+
+            match urlparse(url).scheme:
+                case 'ftp':
+                    _download_ftp(url, part, offset)
+                case 'http' | 'https':
+                    _download_http(url, part, offset)
+                case _:
+                    logger.critical(f"Unsupported URL: {url}")
+                    raise Exception
+
+            os.replace(part, path)
+            logger.debug(f"Downloaded {url} to {path}")
+            return
+        except (OSError, EOFError, ftplib.Error, http.client.HTTPException) as e:
+            if attempt == retries or not _is_transient(e):
+                raise
+            delay: float = backoff * 2 ** attempt
+            logger.warning(f"Download of {url} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def _is_transient(error: BaseException) -> bool:
+    """ HTTP client errors fail again if retried, except timeouts, rate limits and bad ranges (.part is removed) """
+    return not (isinstance(error, HTTPError) and 400 <= error.code < 500 and error.code not in _RETRY_HTTP_CODES)
+
+
+def _download_ftp(url: str, part: str, offset: int) -> None:
+    parsed = urlparse(url)
+    with ftplib.FTP(timeout=60) as ftp:
+        ftp.connect(parsed.hostname, parsed.port or 21)
+        ftp.login(parsed.username or 'anonymous', parsed.password or '')
+        ftp.voidcmd('TYPE I')  # binary mode is needed for SIZE and REST
+        size: int = ftp.size(parsed.path)
+
+        if offset > size:
+            logger.warning(f"Partial download is bigger than {url}, restarting")
+            offset = 0
+        if offset < size:
+            with open(part, 'ab' if offset else 'wb') as f:
+                ftp.retrbinary(f'RETR {parsed.path}', f.write, rest=offset or None)
+
+    _check_size(part, size)
+
+
+def _download_http(url: str, part: str, offset: int) -> None:
+    headers: dict[str, str] = {'Range': f'bytes={offset}-'} if offset else {}
+    try:
+        r = request.urlopen(request.Request(url, headers=headers), timeout=60)
+    except HTTPError as e:
+        if e.code == 416:  # range not satisfiable: the partial download is unusable, so start again
+            os.remove(part)
+        raise
+
+    with closing(r):
+        if offset and r.status != 206:
+            logger.debug(f"Server doesn't support resuming downloads, restarting {url}")
+            offset = 0
+        with open(part, 'ab' if offset else 'wb') as f:
+            shutil.copyfileobj(r, f)
+        length: str | None = r.headers.get('Content-Length')
+
+    if length is not None:
+        _check_size(part, offset + int(length))
+
+
+def _check_size(part: str, size: int) -> None:
+    """ Connections can close early without an error, so check the download is complete """
+    if os.path.getsize(part) != size:
+        raise OSError(f"Incomplete download ({os.path.getsize(part)} of {size} bytes)")
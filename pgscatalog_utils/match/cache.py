@@ -0,0 +1,89 @@
+import hashlib
+import io
+import logging
+import os
+
+import polars as pl
+
+from pgscatalog_utils.atomic_write import atomic_write
+
+logger = logging.getLogger(__name__)
+
+_MATCH_CACHE_VERSION: int = 1  # increment when the format of matches changes
+
+
+def cache_path(path: str, cache_dir: str, content_hash: bool = False) -> str:
+    """ Get the path to the cached copy of a target genome. The cache is reused while the fingerprint matches """
+    return os.path.join(cache_dir, f"{_fingerprint(path, content_hash)}.arrow")
+
+
+def write_cache(df: pl.DataFrame, path: str) -> None:
+    """ Write a normalised target genome (or matches) to the cache in Arrow IPC format """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    logger.debug(f"Writing target cache to {path}")
+    with atomic_write(path) as tmp_path:  # an interrupted (or concurrent) write never looks like a valid cache
+        df.write_ipc(tmp_path)
+
+
+def scan_cache(path: str) -> pl.LazyFrame:
+    """ Lazily read a cached target genome (or matches). The file is memory mapped, so filters are cheap """
+    logger.debug(f"Reading cache {path}")
+    return pl.scan_ipc(path)
+
+
+def match_cache_keys(scorefile: pl.DataFrame, target_paths: list[str], settings: dict[str, bool],
+                     content_hash: bool = False) -> dict[str, str]:
+    """ Key the cached matches of each accession, in scorefile order
+
+    A key depends on the variants of the accession, the fingerprint of each target genome, and match settings, so
+    cached matches are only reused when matching again would give the same result
+    """
+    targets: str = ':'.join(_fingerprint(x, content_hash) for x in sorted(target_paths))
+    run: str = f"{_MATCH_CACHE_VERSION}:{targets}:{sorted(settings.items())}"
+
+    keys: dict[str, str] = {}
+    for accession in scorefile['accession'].unique(maintain_order=True).to_list():  # partition order isn't stable
+        variants = io.BytesIO()
+        scorefile.filter(pl.col('accession') == accession).write_csv(variants)
+        keys[accession] = hashlib.sha256(run.encode() + variants.getvalue()).hexdigest()
+    return keys
+
+
+def read_match_cache(keys: dict[str, str], cache_dir: str) -> dict[str, pl.DataFrame]:
+    """ Read cached matches of each accession. Accessions without cached matches are missing """
+    cached: dict[str, pl.DataFrame] = {}
+    for accession, key in keys.items():
+        path: str = _match_cache_path(key, cache_dir)
+        if os.path.exists(path):
+            logger.debug(f"Match cache hit for {accession}")
+            cached[accession] = scan_cache(path).collect()
+    return cached
+
+
+def write_match_cache(matches: pl.DataFrame, keys: dict[str, str], cache_dir: str) -> dict[str, pl.DataFrame]:
+    """ Cache the matches of each accession, including accessions that didn't match any variants """
+    partitions: dict[str, pl.DataFrame] = {df['accession'][0]: df for df in matches.partition_by('accession')}
+
+    for accession, key in keys.items():
+        partitions[accession] = partitions.get(accession, matches.head(0))
+        write_cache(partitions[accession], _match_cache_path(key, cache_dir))
+
+    return {x: partitions[x] for x in keys}
+
+
+def _match_cache_path(key: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, f"matches_{key}.arrow")
+
+
+def _fingerprint(path: str, content_hash: bool) -> str:
+    """ Fingerprint a file from its path, size, and modification time (cheap) or its content (slow but robust) """
+    h = hashlib.sha256()
+    if content_hash:
+        logger.debug(f"Hashing content of {path}")
+        with open(path, 'rb') as f:
+            while block := f.read(2 ** 20):
+                h.update(block)
+    else:
+        stat: os.stat_result = os.stat(path)
+        h.update(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return h.hexdigest()
@@ -0,0 +1,66 @@
+import logging
+
+import numpy as np
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+_POSITION_BITS: int = 32  # the longest human chromosome is ~250 Mb, so positions fit in the low 32 bits
+
+
+def using_string_cache() -> bool:
+    """ Check if the global string cache is enabled, so categorical codes are the same in different dataframes """
+    a: pl.Series = pl.Series(['pgscatalog_utils_a']).cast(pl.Categorical)
+    b: pl.Series = pl.Series(['pgscatalog_utils_b', 'pgscatalog_utils_a']).cast(pl.Categorical)
+    return a.to_physical()[0] == b.to_physical()[1]
+
+
+def can_encode_positions(*positions: pl.Series) -> bool:
+    """ Check that all positions fit in a packed variant key """
+    return all((x.max() or 0) < 2 ** _POSITION_BITS for x in positions)
+
+
+def chrom_codes(chrom: pl.Series) -> pl.DataFrame:
+    """ Number each chromosome name, so variant keys don't depend on global categorical codes
+
+    The global string cache holds every categorical string (e.g. all target variant IDs), so categorical codes of
+    chromosomes can be too big to pack into a variant key. Local codes only count chromosome names.
+    """
+    names: pl.Series = chrom.cast(str).drop_nulls().unique().sort()
+    return pl.DataFrame([names.alias('_chrom'), pl.Series('_chrom_code', range(len(names)), dtype=pl.UInt64)])
+
+
+def key_chrom_codes(df: pl.DataFrame, chrom: str) -> pl.DataFrame:
+    """ Get the chromosome codes that the variant_key column of a dataframe was made with (see chrom_codes)
+
+    A slice of a dataframe with keys keeps the codes of the whole dataframe, which chrom_codes can't recover.
+    """
+    first: pl.DataFrame = df.select([chrom, 'variant_key']).unique(subset=chrom)  # one key for each chromosome
+    keys: pl.Series = first['variant_key']
+    codes: np.ndarray = np.right_shift(keys.to_numpy(), np.uint64(_POSITION_BITS))
+    return pl.DataFrame([first[chrom].cast(str).alias('_chrom'), pl.Series('_chrom_code', codes, dtype=pl.UInt64)])
+
+def add_variant_key(df: pl.DataFrame, chrom: str, pos: str, codes: pl.DataFrame) -> pl.DataFrame:
+    """ Add a variant_key column, packing a chromosome and position into one 64 bit integer key
+
+    Chromosomes are numbered with codes (see chrom_codes), so keys from different dataframes are only comparable if
+    they're made with the same codes. Variants on other chromosomes or without a position can't match a key, so
+    they're dropped. Check positions are small enough with can_encode_positions.
+    """
+    key: pl.Expr = (pl.col('_chrom_code') * pl.lit(2 ** _POSITION_BITS, dtype=pl.UInt64)) + pl.col(pos).cast(pl.UInt64)
+    df = (df.filter(pl.col(pos).is_not_null())
+          .with_column(pl.col(chrom).cast(str).alias('_chrom'))
+          .join(codes, on='_chrom', how='inner')
+          .with_column(key.alias('variant_key'))
+          .drop(['_chrom', '_chrom_code']))
+
+    if df['variant_key'].dtype != pl.UInt64:  # polars promotes mixed integer arithmetic to float, which isn't exact
+        logger.critical(f"Variant keys must be 64 bit integers, not {df['variant_key'].dtype}")
+        raise Exception
+
+    return df
+
+
+def allele_code(col: str) -> pl.Expr:
+    """ Integer code of a categorical allele. Alleles of any length have a code, so long indels aren't special """
+    return pl.col(col).to_physical()
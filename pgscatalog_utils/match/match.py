@@ -2,6 +2,8 @@ import logging
 
 import polars as pl
 
+from pgscatalog_utils.match.encode import using_string_cache, can_encode_positions, chrom_codes, add_variant_key, allele_code
+from pgscatalog_utils.match.merge import merge_candidates
 from pgscatalog_utils.match.postprocess import postprocess_matches
 from pgscatalog_utils.match.write import write_log
 
@@ -9,124 +11,159 @@ logger = logging.getLogger(__name__)
 
 
 def get_all_matches(scorefile: pl.DataFrame, target: pl.DataFrame, remove_ambiguous: bool,
-                    skip_flip: bool) -> pl.DataFrame:
-    scorefile_cat, target_cat = _cast_categorical(scorefile, target)
-    scorefile_oa = scorefile_cat.filter(pl.col("other_allele") != None)
-    scorefile_no_oa = scorefile_cat.filter(pl.col("other_allele") == None)
-
-    matches: list[pl.DataFrame] = []
-    col_order = ['chr_name', 'chr_position', 'effect_allele', 'other_allele', 'effect_weight', 'effect_type',
-                 'accession', 'effect_allele_FLIP', 'other_allele_FLIP',
-                 'ID', 'REF', 'ALT', 'is_multiallelic', 'matched_effect_allele', 'match_type']
-
-    if scorefile_oa:
-        logger.debug("Getting matches for scores with effect allele and other allele")
-        matches.append(_match_variants(scorefile_cat, target_cat, match_type="refalt").select(col_order))
-        matches.append(_match_variants(scorefile_cat, target_cat, match_type="altref").select(col_order))
-        if skip_flip is False:
-            matches.append(_match_variants(scorefile_cat, target_cat, match_type="refalt_flip").select(col_order))
-            matches.append(_match_variants(scorefile_cat, target_cat, match_type="altref_flip").select(col_order))
+                    skip_flip: bool, merge: bool = False) -> pl.DataFrame:
+    return get_candidate_matches(scorefile, target, skip_flip, merge).pipe(postprocess_matches, remove_ambiguous)
 
-    if scorefile_no_oa:
-        logger.debug("Getting matches for scores with effect allele only")
-        matches.append(_match_variants(scorefile_no_oa, target_cat, match_type="no_oa_ref").select(col_order))
-        matches.append(_match_variants(scorefile_no_oa, target_cat, match_type="no_oa_alt").select(col_order))
-        if skip_flip is False:
-            matches.append(_match_variants(scorefile_no_oa, target_cat, match_type="no_oa_ref_flip").select(col_order))
-            matches.append(_match_variants(scorefile_no_oa, target_cat, match_type="no_oa_alt_flip").select(col_order))
 
-    return pl.concat(matches).pipe(postprocess_matches, remove_ambiguous)
+def get_candidate_matches(scorefile: pl.DataFrame, target: pl.DataFrame, skip_flip: bool,
+                          merge: bool = False) -> pl.DataFrame:
+    """ Get all matches without postprocessing, e.g. to combine matches from target batches before choosing
+    the best match for each variant """
+    scorefile_cat, target_cat = _cast_categorical(scorefile, target)
+    match_types: list[str] = _match_strategies(skip_flip)
+    logger.debug(f"Getting matches for strategies {match_types}")
+    return _match_variants(scorefile_cat, target_cat, match_types, merge)
 
 
 def check_match_rate(scorefile: pl.DataFrame, matches: pl.DataFrame, min_overlap: float, dataset: str) -> pl.DataFrame:
     scorefile: pl.DataFrame = scorefile.with_columns([
         pl.col('effect_type').cast(pl.Categorical),
         pl.col('accession').cast(pl.Categorical)])  # same dtypes for join
-    match_log: pl.DataFrame = _join_matches(matches, scorefile, dataset)
-    fail_rates: pl.DataFrame = (match_log.groupby('accession')
-                                .agg([pl.count(), (pl.col('match_type') == None).sum().alias('no_match')])
-                                .with_column((pl.col('no_match') / pl.col('count')).alias('fail_rate'))
-                                )
-    pass_df: pl.DataFrame = pl.DataFrame()
-    for accession, rate in zip(fail_rates['accession'].to_list(), fail_rates['fail_rate'].to_list()):
-        if rate < (1 - min_overlap):
-            df = pl.DataFrame({'accession': [accession], 'match_pass': [True], 'match_rate': [1 - rate]})
-            pass_df = pl.concat([pass_df, df])
-            logger.debug(f"Score {accession} passes minimum matching threshold ({1 - rate:.2%}  variants match)")
+    # match statistics are window expressions over each accession, so the log is joined and collected once, instead
+    # of joining the log again to a grouped copy of itself
+    no_match: pl.Expr = (pl.col('match_type').is_null().cast(pl.UInt32).sum().over('accession') /
+                         pl.col('accession').count().over('accession'))
+    # alleles of columnar scorefiles are categorical, but matches are postprocessed as strings
+    match_alleles: list[pl.Expr] = [pl.col(x).cast(scorefile[x].dtype) for x in ['effect_allele', 'other_allele']]
+    match_log: pl.DataFrame = (_join_matches(matches.lazy().with_columns(match_alleles), scorefile.lazy(), dataset)
+                               .with_columns([(no_match < 1 - min_overlap).alias('match_pass'),
+                                              (1 - no_match).alias('match_rate')])
+                               .with_column(pl.col('accession').cast(str))
+                               .collect())
+    pass_df: pl.DataFrame = match_log.select(['accession', 'match_pass', 'match_rate']).unique(maintain_order=True)
+
+    for accession, match_pass, rate in pass_df.rows():
+        if match_pass:
+            logger.debug(f"Score {accession} passes minimum matching threshold ({rate:.2%}  variants match)")
         else:
-            df = pl.DataFrame({'accession': [accession], 'match_pass': [False], 'match_rate': [1 - rate]})
-            pass_df = pl.concat([pass_df, df])
-            logger.error(f"Score {accession} fails minimum matching threshold ({1 - rate:.2%} variants match)")
+            logger.error(f"Score {accession} fails minimum matching threshold ({rate:.2%} variants match)")
 
-    # add match statistics to log and matches
-    write_log((match_log.with_column(pl.col('accession').cast(str))
-               .join(pass_df, on='accession', how='left')), dataset)
+    write_log(match_log, dataset)  # with match statistics
 
     return (matches.with_column(pl.col('accession').cast(str))
             .join(pass_df, on='accession', how='left'))
 
 
-
 def _match_keys():
     return ['chr_name', 'chr_position', 'effect_allele', 'other_allele',
             'accession', 'effect_type', 'effect_weight']
 
 
-def _join_matches(matches: pl.DataFrame, scorefile: pl.DataFrame, dataset: str):
+def _join_matches(matches: pl.LazyFrame, scorefile: pl.LazyFrame, dataset: str) -> pl.LazyFrame:
     return scorefile.join(matches, on=_match_keys(), how='left').with_column(pl.lit(dataset).alias('dataset'))
 
 
-def _match_variants(scorefile: pl.DataFrame, target: pl.DataFrame, match_type: str) -> pl.DataFrame:
-    logger.debug(f"Matching strategy: {match_type}")
+def _match_strategies(skip_flip: bool) -> list[str]:
+    """ Match types in priority order (see postprocess._prioritise_match_type) """
+    match_types: list[str] = ['refalt', 'altref', 'refalt_flip', 'altref_flip',
+                              'no_oa_ref', 'no_oa_alt', 'no_oa_ref_flip', 'no_oa_alt_flip']
+    if skip_flip:
+        return [x for x in match_types if not x.endswith('flip')]
+    else:
+        return match_types
+
+
+def _match_condition(match_type: str, encoded: bool = False) -> pl.Expr:
+    """ Boolean expression that is true when a scorefile variant matches a target variant
+
+    Encoded alleles are compared with their categorical codes, otherwise alleles are compared as strings
+    """
     match match_type:
         case 'refalt':
-            score_keys = ["chr_name", "chr_position", "effect_allele", "other_allele"]
-            target_keys = ["#CHROM", "POS", "REF", "ALT"]
-            effect_allele_column = "effect_allele"
+            score_keys = ["effect_allele", "other_allele"]
+            target_keys = ["REF", "ALT"]
         case 'altref':
-            score_keys = ["chr_name", "chr_position", "effect_allele", "other_allele"]
-            target_keys = ["#CHROM", "POS", "ALT", "REF"]
-            effect_allele_column = "effect_allele"
+            score_keys = ["effect_allele", "other_allele"]
+            target_keys = ["ALT", "REF"]
         case 'refalt_flip':
-            score_keys = ["chr_name", "chr_position", "effect_allele_FLIP", "other_allele_FLIP"]
-            target_keys = ["#CHROM", "POS", "REF", "ALT"]
-            effect_allele_column = "effect_allele_FLIP"
+            score_keys = ["effect_allele_FLIP", "other_allele_FLIP"]
+            target_keys = ["REF", "ALT"]
         case 'altref_flip':
-            score_keys = ["chr_name", "chr_position", "effect_allele_FLIP", "other_allele_FLIP"]
-            target_keys = ["#CHROM", "POS", "ALT", "REF"]
-            effect_allele_column = "effect_allele_FLIP"
+            score_keys = ["effect_allele_FLIP", "other_allele_FLIP"]
+            target_keys = ["ALT", "REF"]
         case 'no_oa_ref':
-            score_keys = ["chr_name", "chr_position", "effect_allele"]
-            target_keys = ["#CHROM", "POS", "REF"]
-            effect_allele_column = "effect_allele"
+            score_keys = ["effect_allele"]
+            target_keys = ["REF"]
         case 'no_oa_alt':
-            score_keys = ["chr_name", "chr_position", "effect_allele"]
-            target_keys = ["#CHROM", "POS", "ALT"]
-            effect_allele_column = "effect_allele"
+            score_keys = ["effect_allele"]
+            target_keys = ["ALT"]
         case 'no_oa_ref_flip':
-            score_keys = ["chr_name", "chr_position", "effect_allele_FLIP"]
-            target_keys = ["#CHROM", "POS", "REF"]
-            effect_allele_column = "effect_allele_FLIP"
+            score_keys = ["effect_allele_FLIP"]
+            target_keys = ["REF"]
         case 'no_oa_alt_flip':
-            score_keys = ["chr_name", "chr_position", "effect_allele_FLIP"]
-            target_keys = ["#CHROM", "POS", "ALT"]
-            effect_allele_column = "effect_allele_FLIP"
+            score_keys = ["effect_allele_FLIP"]
+            target_keys = ["ALT"]
         case _:
             logger.critical(f"Invalid match strategy: {match_type}")
             raise Exception
 
-    missing_cols = ['REF', 'ALT']
     if match_type.startswith('no_oa'):
-        if match_type.startswith('no_oa_ref'):
-            missing_cols = ['REF']
+        condition: pl.Expr = pl.col("other_allele").is_null()
+    else:
+        condition: pl.Expr = pl.col("other_allele").is_not_null()
+
+    for score_key, target_key in zip(score_keys, target_keys):
+        if encoded:
+            condition = condition & (allele_code(score_key) == allele_code(target_key))
         else:
-            missing_cols = ['ALT']
-    join_cols = ['ID'] + missing_cols
-    return (scorefile.join(target, score_keys, target_keys, how='inner')
-            .with_columns([pl.col("*"),
-                           pl.col(effect_allele_column).alias("matched_effect_allele"),
-                           pl.lit(match_type).alias("match_type")])
-            .join(target.select(join_cols), on="ID", how="inner"))  # get REF / ALT back after first join
+            condition = condition & (pl.col(score_key).cast(str) == pl.col(target_key).cast(str))
+
+    return condition.fill_null(False)
+
+
+def _match_variants(scorefile: pl.DataFrame, target: pl.DataFrame, match_types: list[str],
+                    merge: bool = False) -> pl.DataFrame:
+    """ Match scorefile variants against target variants with all strategies in a single pass
+
+    The scorefile is joined once to the target on position, then each candidate pair is tested
+    against every allele orientation (and strand flip). Candidates that satisfy more than one
+    strategy (e.g. ambiguous variants) produce one row per matching strategy, like separate joins.
+    The join is a hash join, or a binary search of the sorted scorefile if merge is set (see merge_candidates).
+    """
+    col_order: list[str] = ['chr_name', 'chr_position', 'effect_allele', 'other_allele', 'effect_weight',
+                            'effect_type', 'accession', 'effect_allele_FLIP', 'other_allele_FLIP',
+                            'ID', 'REF', 'ALT', 'is_multiallelic', 'matched_effect_allele', 'match_type']
+    # categorical alleles are encoded as integers, if every dataframe uses the same categorical codes
+    dtypes: list = (scorefile.select(['effect_allele', 'other_allele', 'effect_allele_FLIP',
+                                      'other_allele_FLIP']).dtypes + target.select(['REF', 'ALT']).dtypes)
+    encoded: bool = all(x == pl.Categorical for x in dtypes) and using_string_cache()
+
+    if merge and encoded and can_encode_positions(scorefile['chr_position'], target['POS']):
+        logger.debug("Searching sorted scorefile for packed target variant keys")
+        candidates: pl.DataFrame = merge_candidates(scorefile, target)
+    elif encoded and can_encode_positions(scorefile['chr_position'], target['POS']):
+        logger.debug("Joining scorefile and target on packed variant keys")
+        codes: pl.DataFrame = chrom_codes(scorefile['chr_name'])
+        candidates: pl.DataFrame = (add_variant_key(scorefile, 'chr_name', 'chr_position', codes)
+                                    .join(add_variant_key(target, '#CHROM', 'POS', codes).drop(['#CHROM', 'POS']),
+                                          on='variant_key', how='inner')
+                                    .drop('variant_key'))
+    else:
+        if merge:
+            logger.warning("Can't encode variant keys to search the sorted scorefile, using a hash join")
+        candidates: pl.DataFrame = scorefile.join(target, left_on=["chr_name", "chr_position"],
+                                                  right_on=["#CHROM", "POS"], how='inner')
+
+    candidates = candidates.with_columns([_match_condition(x, encoded).alias(x) for x in match_types])
+
+    return (candidates.melt(id_vars=[x for x in candidates.columns if x not in match_types],
+                            value_vars=match_types, variable_name='match_type', value_name='is_match')
+            .filter(pl.col('is_match'))
+            .with_column(pl.when(pl.col('match_type').str.contains('flip'))
+                         .then(pl.col('effect_allele_FLIP'))
+                         .otherwise(pl.col('effect_allele'))
+                         .alias('matched_effect_allele'))
+            .select(col_order))
 
 
 def _cast_categorical(scorefile, target) -> tuple[pl.DataFrame, pl.DataFrame]:
@@ -1,14 +1,21 @@
 import argparse
 import logging
+import multiprocessing
 import textwrap
+from concurrent.futures import ProcessPoolExecutor
 from glob import glob
 
 import polars as pl
 
 from pgscatalog_utils.log_config import set_logging_level
-from pgscatalog_utils.match.match import get_all_matches, check_match_rate
-from pgscatalog_utils.match.read import read_target, read_scorefile
+from pgscatalog_utils.match.cache import match_cache_keys, read_match_cache, write_match_cache
+from pgscatalog_utils.match.match import get_all_matches, check_match_rate, get_candidate_matches, _cast_categorical
+from pgscatalog_utils.match.merge import sort_scorefile
+from pgscatalog_utils.match.postprocess import postprocess_matches
+from pgscatalog_utils.match.read import read_target, read_scorefile, read_target_batches, read_target_chroms
 from pgscatalog_utils.match.write import write_out
+from pgscatalog_utils.score.score import score_genotypes, write_scores
+from pgscatalog_utils.scorefile.partition import read_chrom_index
 
 logger = logging.getLogger(__name__)
 
@@ -18,35 +25,23 @@ def match_variants():
 
     set_logging_level(args.verbose)
 
+    if args.incremental and args.cache_dir is None:
+        logger.critical("--incremental needs a --cache_dir to store matches")
+        raise Exception
+
     logger.debug(f"polars n_threads: {pl.threadpool_size()}")
-    scorefile: pl.DataFrame = read_scorefile(path=args.scorefile)
 
-    with pl.StringCache():
-        n_target_files = len(glob(args.target))
-        matches: pl.DataFrame
-
-        if n_target_files == 1 and not args.fast:
-            match_mode: str = 'single'
-        elif n_target_files > 1 and not args.fast:
-            match_mode: str = 'multi'
-        elif args.fast:
-            match_mode: str = 'fast'
-
-        match match_mode:
-            case "single":
-                logger.debug(f"Match mode: {match_mode}")
-                matches = _match_single_target(args.target, scorefile, args.remove_multiallelic, args.remove_ambiguous, args.skip_flip)
-            case "multi":
-                logger.debug(f"Match mode: {match_mode}")
-                matches = _match_multiple_targets(args.target, scorefile, args.remove_multiallelic,
-                                                  args.remove_ambiguous, args.skip_flip)
-            case "fast":
-                logger.debug(f"Match mode: {match_mode}")
-                matches = _fast_match(args.target, scorefile, args.remove_multiallelic,
-                                      args.remove_ambiguous, args.skip_flip)
-            case _:
-                logger.critical(f"Invalid match mode: {match_mode}")
-                raise Exception
+    with pl.StringCache():  # categoricals of columnar scorefiles are read with the same codes as target alleles
+        scorefile: pl.DataFrame = read_scorefile(path=args.scorefile)
+        if scorefile.is_empty():
+            logger.critical(f"No variants in scorefile {args.scorefile}")
+            raise Exception
+        chrom_index: dict[str, tuple[int, int]] | None = read_chrom_index(args.scorefile, scorefile.shape[0])
+
+        if args.incremental:
+            matches: pl.DataFrame = _incremental_match(args, scorefile, chrom_index)
+        else:
+            matches: pl.DataFrame = _match_scorefile(args, scorefile, chrom_index)
 
         dataset = args.dataset.replace('_', '-')  # underscores are delimiters in pgs catalog calculator
         valid_matches: pl.DataFrame = (check_match_rate(scorefile, matches, args.min_overlap, dataset)
@@ -56,7 +51,89 @@ def match_variants():
         logger.error("Error: no target variants match any variants in scoring files")
         raise Exception
 
-    write_out(valid_matches, args.split, args.outdir, dataset)
+    write_out(valid_matches, args.split, args.outdir, dataset, compress=args.compress, workers=args.workers,
+              sparse=args.sparse)
+
+    if args.genotypes is not None:
+        write_scores(score_genotypes(valid_matches, args.genotypes, workers=args.workers), args.outdir, dataset)
+
+
+def _match_scorefile(args: argparse.Namespace, scorefile: pl.DataFrame,
+                     chrom_index: dict[str, tuple[int, int]] | None) -> pl.DataFrame:
+    n_target_files = len(glob(args.target))
+    matches: pl.DataFrame
+
+    if args.merge:
+        # sort once, not for every chromosome, target or batch. Chromosomes of the sorted scorefile are contiguous
+        scorefile = sort_scorefile(scorefile)
+        chrom_index = _sorted_chrom_index(scorefile)
+
+    if args.stream:
+        match_mode: str = 'stream'
+    elif n_target_files == 1 and not args.fast:
+        match_mode: str = 'single'
+    elif n_target_files > 1 and not args.fast:
+        match_mode: str = 'multi'
+    elif args.fast:
+        match_mode: str = 'fast'
+
+    match match_mode:
+        case "single":
+            logger.debug(f"Match mode: {match_mode}")
+            matches = _match_single_target(args.target, scorefile, args.remove_multiallelic, args.remove_ambiguous,
+                                           args.skip_flip, cache_dir=args.cache_dir, cache_hash=args.cache_hash,
+                                           chrom_index=chrom_index, merge=args.merge)
+        case "multi":
+            logger.debug(f"Match mode: {match_mode}")
+            matches = _match_multiple_targets(args.target, scorefile, args.remove_multiallelic,
+                                              args.remove_ambiguous, args.skip_flip, cache_dir=args.cache_dir,
+                                              cache_hash=args.cache_hash, workers=args.workers,
+                                              chrom_index=chrom_index, merge=args.merge)
+        case "fast":
+            logger.debug(f"Match mode: {match_mode}")
+            matches = _fast_match(args.target, scorefile, args.remove_multiallelic,
+                                  args.remove_ambiguous, args.skip_flip, cache_dir=args.cache_dir,
+                                  cache_hash=args.cache_hash, merge=args.merge)
+        case "stream":
+            logger.debug(f"Match mode: {match_mode}")
+            matches = _stream_match(args.target, scorefile, args.remove_multiallelic,
+                                    args.remove_ambiguous, args.skip_flip, args.batch_size, merge=args.merge)
+        case _:
+            logger.critical(f"Invalid match mode: {match_mode}")
+            raise Exception
+
+    return matches
+
+
+def _incremental_match(args: argparse.Namespace, scorefile: pl.DataFrame,
+                       chrom_index: dict[str, tuple[int, int]] | None) -> pl.DataFrame:
+    """ Only match accessions without cached matches, and merge them with the cached matches of other accessions
+
+    Matches are cached for each accession, so adding a scorefile to a set that was matched before only matches the
+    new scorefile. Cached matches are reused while the accession's variants, the target, and match settings are
+    the same
+    """
+    settings: dict[str, bool] = {'remove_multiallelic': args.remove_multiallelic,
+                                 'remove_ambiguous': args.remove_ambiguous, 'skip_flip': args.skip_flip}
+    keys: dict[str, str] = match_cache_keys(scorefile, glob(args.target), settings, args.cache_hash)
+    cached: dict[str, pl.DataFrame] = read_match_cache(keys, args.cache_dir)
+    missing: list[str] = [x for x in keys if x not in cached]
+    logger.debug(f"Cached matches found for {len(cached)} of {len(keys)} accessions")
+
+    if missing:
+        logger.debug(f"Matching accessions: {missing}")
+        if cached:
+            # a partial scorefile doesn't fit the chromosome index
+            scorefile, chrom_index = scorefile.filter(pl.col('accession').is_in(missing)), None
+        new_matches: pl.DataFrame = _match_scorefile(args, scorefile, chrom_index)
+        cached |= write_match_cache(new_matches, {x: keys[x] for x in missing}, args.cache_dir)
+
+    # every accession now has matches (the scorefile isn't empty), so merge them in the same format, in the order
+    # of the scorefile
+    template: pl.DataFrame = cached[next(iter(keys))]
+    return pl.concat([cached[x].select([pl.col(col).cast(dtype) for col, dtype in zip(template.columns,
+                                                                                      template.dtypes)])
+                      for x in keys])
 
 
 def _check_target_chroms(target) -> None:
@@ -68,38 +145,147 @@ def _check_target_chroms(target) -> None:
         logger.debug("Split target genome contains one chromosome (good)")
 
 
+def _chrom_scorefile(scorefile: pl.DataFrame, chrom: str,
+                     chrom_index: dict[str, tuple[int, int]] | None) -> pl.DataFrame:
+    """ Get scorefile variants on a chromosome, because only these variants can match a target chromosome
+
+    Partitioned scorefiles are sliced using the chromosome index (zero copy), otherwise the scorefile is filtered
+    """
+    if chrom_index is None:
+        return scorefile.filter(pl.col('chr_name') == chrom)
+    else:
+        offset, n = chrom_index.get(chrom, (0, 0))
+        return scorefile.slice(offset, n)
+
+
+def _sorted_chrom_index(scorefile: pl.DataFrame) -> dict[str, tuple[int, int]]:
+    """ Index the chromosomes of a scorefile sorted by sort_scorefile, like a partitioned scorefile """
+    chroms: pl.DataFrame = (scorefile.select('chr_name').with_row_count('offset')
+                            .groupby('chr_name', maintain_order=True)
+                            .agg([pl.col('offset').first(), pl.count().alias('n')]))
+    return {chrom: (offset, n) for chrom, offset, n in chroms.rows()}
+
+
+def _target_scorefile(scorefile: pl.DataFrame, target: pl.DataFrame,
+                      chrom_index: dict[str, tuple[int, int]] | None) -> pl.DataFrame:
+    """ Get scorefile variants on the chromosome of a split target genome """
+    chroms: list[str] = target['#CHROM'].unique().to_list()
+    if len(chroms) == 1:
+        return _chrom_scorefile(scorefile, chroms[0], chrom_index)
+    else:
+        return scorefile
+
+
 def _fast_match(target_path: str, scorefile: pl.DataFrame, remove_multiallelic: bool,
-                remove_ambiguous: bool, skip_filp: bool) -> pl.DataFrame:
+                remove_ambiguous: bool, skip_filp: bool, cache_dir: str | None = None,
+                cache_hash: bool = False, merge: bool = False) -> pl.DataFrame:
     # fast match is fast because:
     #   1) all target files are read into memory
     #   2) matching occurs without iterating through chromosomes
     target: pl.DataFrame = read_target(path=target_path,
-                                       remove_multiallelic=remove_multiallelic)
+                                       remove_multiallelic=remove_multiallelic,
+                                       cache_dir=cache_dir, cache_hash=cache_hash)
     logger.debug("Split target chromosomes not checked with fast match mode")
-    return get_all_matches(scorefile, target, remove_ambiguous, skip_filp)
+    return get_all_matches(scorefile, target, remove_ambiguous, skip_filp, merge)
 
 
 def _match_multiple_targets(target_path: str, scorefile: pl.DataFrame, remove_multiallelic: bool,
-                            remove_ambiguous: bool, skip_filp: bool) -> pl.DataFrame:
+                            remove_ambiguous: bool, skip_filp: bool, cache_dir: str | None = None,
+                            cache_hash: bool = False, workers: int = 1,
+                            chrom_index: dict[str, tuple[int, int]] | None = None,
+                            merge: bool = False) -> pl.DataFrame:
+    target_paths: list[str] = sorted(glob(target_path))  # sorted so matches are always merged in the same order
+
+    if workers > 1:
+        return _match_multiple_targets_parallel(target_paths, scorefile, remove_multiallelic, remove_ambiguous,
+                                                skip_filp, cache_dir, cache_hash, workers, chrom_index, merge)
+
     matches = []
-    for i, loc_target_current in enumerate(glob(target_path)):
+    for i, loc_target_current in enumerate(target_paths):
         logger.debug(f'Matching scorefile(s) against target: {loc_target_current}')
         target: pl.DataFrame = read_target(path=loc_target_current,
-                                           remove_multiallelic=remove_multiallelic)  #
+                                           remove_multiallelic=remove_multiallelic,
+                                           cache_dir=cache_dir, cache_hash=cache_hash)
         _check_target_chroms(target)
-        matches.append(get_all_matches(scorefile, target, remove_ambiguous, skip_filp))
+        matches.append(get_all_matches(_target_scorefile(scorefile, target, chrom_index), target, remove_ambiguous,
+                                       skip_filp, merge))
     return pl.concat(matches)
 
 
+def _match_multiple_targets_parallel(target_paths: list[str], scorefile: pl.DataFrame, remove_multiallelic: bool,
+                                     remove_ambiguous: bool, skip_flip: bool, cache_dir: str | None,
+                                     cache_hash: bool, workers: int,
+                                     chrom_index: dict[str, tuple[int, int]] | None,
+                                     merge: bool = False) -> pl.DataFrame:
+    # each worker reads and matches one split target at a time, so peak memory depends on the number of workers
+    # categorical columns can't be shared across processes (each process has a different string cache), so
+    # workers return plain strings which are cast back to categorical in the parent's string cache
+    logger.debug(f"Matching {len(target_paths)} split targets with {workers} workers")
+    # polars uses a thread pool that isn't safe to fork
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(scorefile, chrom_index)) as executor:
+        results: list[tuple[pl.DataFrame, list[str]]] = list(
+            executor.map(_match_target_worker, target_paths, [remove_multiallelic] * len(target_paths),
+                         [remove_ambiguous] * len(target_paths), [skip_flip] * len(target_paths),
+                         [cache_dir] * len(target_paths), [cache_hash] * len(target_paths),
+                         [merge] * len(target_paths)))
+
+    return pl.concat([df.with_columns([pl.col(x).cast(pl.Categorical) for x in categorical])
+                      for df, categorical in results])
+
+
+_worker_scorefile: pl.DataFrame | None = None  # set once per worker process by _init_worker
+_worker_chrom_index: dict[str, tuple[int, int]] | None = None
+
+
+def _init_worker(scorefile: pl.DataFrame, chrom_index: dict[str, tuple[int, int]] | None) -> None:
+    global _worker_scorefile, _worker_chrom_index
+    _worker_scorefile, _worker_chrom_index = scorefile, chrom_index
+
+
+def _match_target_worker(target_path: str, remove_multiallelic: bool, remove_ambiguous: bool, skip_flip: bool,
+                         cache_dir: str | None, cache_hash: bool,
+                         merge: bool = False) -> tuple[pl.DataFrame, list[str]]:
+    """ Read and match a split target in a worker process. Returns matches and the names of categorical columns """
+    logger.debug(f'Matching scorefile(s) against target: {target_path}')
+    with pl.StringCache():
+        target: pl.DataFrame = read_target(path=target_path, remove_multiallelic=remove_multiallelic,
+                                           cache_dir=cache_dir, cache_hash=cache_hash)
+        _check_target_chroms(target)
+        matches: pl.DataFrame = get_all_matches(_target_scorefile(_worker_scorefile, target, _worker_chrom_index),
+                                                target, remove_ambiguous, skip_flip, merge)
+        categorical: list[str] = [x for x, dtype in zip(matches.columns, matches.dtypes) if dtype == pl.Categorical]
+        return matches.with_columns([pl.col(x).cast(str) for x in categorical]), categorical
+
+
+def _stream_match(target_path: str, scorefile: pl.DataFrame, remove_multiallelic: bool,
+                  remove_ambiguous: bool, skip_flip: bool, batch_size: int, merge: bool = False) -> pl.DataFrame:
+    # stream match reads each target file once, in batches of batch_size MB. matches from each batch
+    # are accumulated and postprocessed together, because a variant may match target records in different batches
+    # cast once, so casting the scorefile again for each batch is a no-op
+    scorefile, _ = _cast_categorical(scorefile, None)
+
+    matches = []
+    for loc_target_current in sorted(glob(target_path)):
+        logger.debug(f'Streaming target: {loc_target_current}')
+        for target in read_target_batches(loc_target_current, remove_multiallelic=remove_multiallelic,
+                                          batch_size=batch_size * 1024 ** 2):
+            matches.append(get_candidate_matches(scorefile, target, skip_flip, merge))
+    return pl.concat(matches).pipe(postprocess_matches, remove_ambiguous)
+
+
 def _match_single_target(target_path: str, scorefile: pl.DataFrame, remove_multiallelic: bool,
-                         remove_ambiguous: bool, skip_filp: bool) -> pl.DataFrame:
+                         remove_ambiguous: bool, skip_filp: bool, cache_dir: str | None = None,
+                         cache_hash: bool = False,
+                         chrom_index: dict[str, tuple[int, int]] | None = None,
+                         merge: bool = False) -> pl.DataFrame:
     matches = []
-    for chrom in scorefile['chr_name'].unique().to_list():
-        target = read_target(target_path, remove_multiallelic=remove_multiallelic,
-                             single_file=True, chrom=chrom)  # scans and filters
+    chroms: list[str] = list(chrom_index) if chrom_index is not None else scorefile['chr_name'].unique().to_list()
+    for chrom, target in read_target_chroms(target_path, remove_multiallelic, chroms, cache_dir, cache_hash):
         if target:
             logger.debug(f"Matching chromosome {chrom}")
-            matches.append(get_all_matches(scorefile, target, remove_ambiguous, skip_filp))
+            matches.append(get_all_matches(_chrom_scorefile(scorefile, chrom, chrom_index), target, remove_ambiguous,
+                                           skip_filp, merge))
 
     return pl.concat(matches)
 
@@ -123,7 +309,8 @@ def _description_text() -> str:
     makes matching faster and simpler.
     
     Target genomes can be in plink1 bim format or plink2 pvar
-    format. Variant IDs should be unique so that they can be specified
+    format, optionally compressed with gzip (.gz) or zstd (.zst,
+    needs the zstandard package). Variant IDs should be unique so that they can be specified
     in the scoring file as: variant_id|effect_allele|[effect_weight column(s)...] 
     
     Only one set of target genomes should be matched at a time. Don't
@@ -142,12 +329,27 @@ def _epilog_text() -> str:
 
         {dataset}_{chromosome}_{effect_type}_{n}.scorefile.
 
+    With --compress, scoring files are gzip compressed (.scorefile.gz),
+    which plink2 --score reads directly.
+
+    With --sparse, the weights of each scoring file are also written
+    as a sparse variant x accession matrix:
+
+        {dataset}_{chromosome}_{effect_type}_{n}.weights.npz
+
+    which can be loaded with pgscatalog_utils.match.sparse.read_sparse_weights.
+
     If multiple chromosomes are combined into a single file (i.e. not
     --split), then {chromosome} is replaced with 'ALL'. Once the
     scorefiles are used to calculate a score with plink2, the .sscore
     files will need to be aggregated to calculate a single polygenic
     score for each dataset, sample, and accession (scoring file). The
     PGS Catalog Calculator does this automatically.
+
+    Alternatively, --genotypes calculates every score in one pass from
+    plink1 .bed or plink2 .pgen genotypes (.pgen needs the pgenlib
+    package), and writes the sum of each score for each sample to
+    {dataset}.sscore. Missing genotypes are mean imputed.
     ''')
 
 
@@ -157,13 +359,42 @@ def _parse_args(args=None):
     parser.add_argument('-d', '--dataset', dest='dataset', required=True,
                         help='<Required> Label for target genomic dataset')
     parser.add_argument('-s', '--scorefiles', dest='scorefile', required=True,
-                        help='<Required> Combined scorefile path (output of read_scorefiles.py)')
+                        help='<Required> Combined scorefile path (output of read_scorefiles.py). '
+                             'Text, Parquet (.parquet), or Arrow IPC (.arrow) format')
     parser.add_argument('-t', '--target', dest='target', required=True,
-                        help='<Required> A table of target genomic variants (.bim format)')
+                        help='<Required> A table of target genomic variants (.bim or .pvar format, optionally .gz or .zst)')
     parser.add_argument('-f', '--fast', dest='fast', action='store_true',
                         help='<Optional> Enable faster matching at the cost of increased RAM usage')
+    parser.add_argument('--workers', dest='workers', type=int, default=1,
+                        help='<Optional> Number of processes used to match split target genomes in parallel. '
+                             'Each process reads one target file at a time. Also the number of output scorefiles '
+                             'written in parallel')
+    parser.add_argument('--stream', dest='stream', action='store_true',
+                        help='<Optional> Read target genomes once in batches, to limit RAM usage on big files')
+    parser.add_argument('--batch_size', dest='batch_size', type=int, default=256,
+                        help='<Optional> Approximate size (MB) of each target batch read in --stream mode. Peak '
+                             'memory usage scales with this value instead of the size of the target genome')
+    parser.add_argument('--merge', dest='merge', action='store_true',
+                        help='<Optional> Match by binary search of the scorefile, sorted once by position, instead '
+                             'of a hash join, which uses less memory')
+    parser.add_argument('--cache_dir', dest='cache_dir', default=None,
+                        help='<Optional> Directory to store a parsed copy of target genomes, which is reused when '
+                             'the same target is matched again (not used with --stream)')
+    parser.add_argument('--incremental', dest='incremental', action='store_true',
+                        help='<Optional> Cache matches of each accession in --cache_dir, and only match accessions '
+                             'that are new or changed since the last run against the same target')
+    parser.add_argument('--cache_hash', dest='cache_hash', action='store_true',
+                        help='<Optional> Identify cached targets by hashing file contents, instead of using path, '
+                             'size, and modification time')
     parser.add_argument('--split', dest='split', default=False, action='store_true',
                         help='<Optional> Split scorefile per chromosome?')
+    parser.add_argument('--compress', dest='compress', action='store_true',
+                        help='<Optional> Compress output scorefiles with gzip (.scorefile.gz)')
+    parser.add_argument('--sparse', dest='sparse', action='store_true',
+                        help='<Optional> Also write the weights of each scorefile as a sparse matrix (.weights.npz)')
+    parser.add_argument('--genotypes', dest='genotypes', default=None,
+                        help='<Optional> Path to genotypes (.bed or .pgen, can be a glob of split files) to '
+                             'calculate scores from the matched variants')
     parser.add_argument('--outdir', dest='outdir', required=True,
                         help='<Required> Output directory')
     parser.add_argument('-m', '--min_overlap', dest='min_overlap', required=True,
@@ -0,0 +1,59 @@
+import logging
+
+import numpy as np
+import polars as pl
+
+from pgscatalog_utils.match.encode import chrom_codes, add_variant_key, key_chrom_codes
+
+logger = logging.getLogger(__name__)
+
+
+def sort_scorefile(scorefile: pl.DataFrame) -> pl.DataFrame:
+    """ Sort a scorefile by packed variant key, ready for merge_candidates
+
+    Sorting once means each target (or target batch) can be merged without sorting the scorefile again: a scorefile
+    that already has sorted keys is returned as it is. Variants without a chromosome or position can't match, so
+    they're dropped.
+    """
+    if 'variant_key' in scorefile.columns:
+        keys: np.ndarray = scorefile['variant_key'].to_numpy()
+        if np.all(keys[1:] >= keys[:-1]):
+            return scorefile
+        scorefile = scorefile.drop('variant_key')
+
+    logger.debug("Sorting scorefile by variant key")
+    scorefile = scorefile.filter(pl.col('chr_name').is_not_null() & pl.col('chr_position').is_not_null())
+    codes: pl.DataFrame = chrom_codes(scorefile['chr_name'])
+    return add_variant_key(scorefile, 'chr_name', 'chr_position', codes).sort('variant_key')
+
+
+def merge_candidates(scorefile: pl.DataFrame, target: pl.DataFrame) -> pl.DataFrame:
+    """ Join scorefile variants to target variants at the same position
+
+    Each target variant is found in the sorted scorefile with a binary search (see merge_join), so no hash table is
+    built and extra memory only depends on the number of candidate pairs. The target doesn't need to be sorted.
+    """
+    scorefile = sort_scorefile(scorefile)
+    score_keys: np.ndarray = scorefile['variant_key'].to_numpy()
+    # chromosomes are numbered like the scorefile keys (maybe a slice of a bigger sorted scorefile), so target keys
+    # are comparable to scorefile keys
+    target = add_variant_key(target, '#CHROM', 'POS', key_chrom_codes(scorefile, 'chr_name'))
+    target_keys: np.ndarray = target['variant_key'].to_numpy()
+
+    # polars can't index with an empty numpy array, but can with an empty series
+    score_idx, target_idx = (pl.Series(x, dtype=pl.UInt32) for x in merge_join(score_keys, target_keys))
+    return (scorefile[score_idx].drop('variant_key')
+            .hstack(target[target_idx].drop(['#CHROM', 'POS', 'variant_key']).get_columns()))
+
+
+def merge_join(sorted_keys: np.ndarray, keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """ Find every pair of equal keys, returning the row indexes of each pair
+
+    Each key is binary searched in sorted_keys, which must be sorted. keys can be in any order.
+    """
+    start: np.ndarray = np.searchsorted(sorted_keys, keys, side='left')
+    n: np.ndarray = np.searchsorted(sorted_keys, keys, side='right') - start  # equal keys for each key
+
+    key_idx: np.ndarray = np.repeat(np.arange(len(keys)), n)
+    sorted_idx: np.ndarray = np.repeat(start, n) + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    return sorted_idx, key_idx
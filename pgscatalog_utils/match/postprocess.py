@@ -1,4 +1,3 @@
-from functools import reduce
 import polars as pl
 import logging
 
@@ -34,53 +33,35 @@ def _label_biallelic_ambiguous(df: pl.DataFrame) -> pl.DataFrame:
 
 
 def _get_distinct_weights(df: pl.DataFrame) -> pl.DataFrame:
-    """ Select single matched variant in target for each variant in the scoring file (e.g. per accession) """
-    count: pl.DataFrame = df.groupby(['accession', 'chr_name', 'chr_position', 'effect_allele']).count()
-    singletons: pl.DataFrame = (count.filter(pl.col('count') == 1)[:, "accession":"effect_allele"]
-                                .join(df, on=['accession', 'chr_name', 'chr_position', 'effect_allele'], how='left'))
+    """ Select single matched variant in target for each variant in the scoring file (e.g. per accession)
 
-    dups: pl.DataFrame = (count.filter(pl.col('count') > 1)[:, "accession":"effect_allele"]
-                          .join(df, on=['accession', 'chr_name', 'chr_position', 'effect_allele'], how='left'))
+    Variants that match more than one target variant keep their best match type (see _match_priority). A variant
+    can still match more than one target variant with the same match type (e.g. target variants with the same
+    position and alleles but different IDs), and these are all kept.
+    """
+    variant: list[str] = ['accession', 'chr_name', 'chr_position', 'effect_allele']
+    logger.debug("Prioritising duplicate matches by match type")
+    distinct: pl.DataFrame = (df.with_column(_match_priority().alias('priority'))
+                              .filter((pl.count().over(variant) == 1) |
+                                      (pl.col('priority') == pl.col('priority').min().over(variant + ['other_allele'])))
+                              .drop('priority'))
 
-    if dups:
-        distinct: pl.DataFrame = pl.concat([singletons, _prioritise_match_type(dups)])
-    else:
-        distinct: pl.DataFrame = singletons
-
-    assert all(distinct.groupby(['accession', 'ID']).count()['count'] == 1), "Duplicate effect weights for a variant"
+    assert not distinct.select(['accession', 'ID']).is_duplicated().any(), "Duplicate effect weights for a variant"
 
     return distinct
 
 
-def _prioritise_match_type(duplicates: pl.DataFrame) -> pl.DataFrame:
-    dup_oa: pl.DataFrame = duplicates.filter(pl.col("other_allele") != None)
-    dup_no_oa: pl.DataFrame = duplicates.filter(pl.col("other_allele") == None)
-    best_matches: list[pl.DataFrame] = []
-
-    if dup_oa:
-        match_priority: list[str] = ['refalt', 'altref', 'refalt_flip', 'altref_flip']
-        logger.debug(f"Prioritising matches in order {match_priority}")
-        best_matches.append(_get_best_match(dup_oa, match_priority))
-
-    if dup_no_oa:
-        match_priority: list[str] = ['no_oa_ref', 'no_oa_alt', 'no_oa_ref_flip', 'no_oa_alt_flip']
-        logger.debug(f"Prioritising matches in order {match_priority}")
-        best_matches.append(_get_best_match(dup_no_oa, match_priority))
-
-    return pl.concat(best_matches)
-
-
-def _get_best_match(df: pl.DataFrame, match_priority: list[str]) -> pl.DataFrame:
-    match: list[pl.DataFrame] = []
-    for match_type in match_priority:
-        match.append(df.filter(pl.col("match_type") == match_type))
-    logger.debug("Filtering best match types")
-    return reduce(lambda x, y: _join_best_match(x, y), match)
-
-
-def _join_best_match(x: pl.DataFrame, y: pl.DataFrame) -> pl.DataFrame:
-    # variants in dataframe x have a higher priority than dataframe y
-    # when concatenating the two dataframes, use an anti join to first remove variants in y that are in x
-    not_in: pl.DataFrame = y.join(x, how='anti',
-                                  on=['accession', 'chr_name', 'chr_position', 'effect_allele', 'other_allele'])
-    return pl.concat([x, not_in])
+def _match_priority() -> pl.Expr:
+    """ Rank match types, lower is better. Match types that don't fit the variant (e.g. other allele is missing) are
+    null, so they're never the best match """
+    priority: dict[bool, list[str]] = {True: ['refalt', 'altref', 'refalt_flip', 'altref_flip'],
+                                       False: ['no_oa_ref', 'no_oa_alt', 'no_oa_ref_flip', 'no_oa_alt_flip']}
+    ranks: list[tuple[pl.Expr, int]] = [((pl.col('other_allele').is_not_null() == has_oa) &
+                                         (pl.col('match_type') == match_type), rank)
+                                        for has_oa, match_types in priority.items()
+                                        for rank, match_type in enumerate(match_types)]
+
+    expr = pl.when(ranks[0][0]).then(pl.lit(ranks[0][1]))
+    for condition, rank in ranks[1:]:
+        expr = expr.when(condition).then(pl.lit(rank))
+    return expr.otherwise(pl.lit(None))
@@ -6,26 +6,52 @@ logger = logging.getLogger(__name__)
 
 def complement_valid_alleles(df: pl.DataFrame, flip_cols: list[str]) -> pl.DataFrame:
     """ Improved function to complement alleles. Will only complement sequences that are valid DNA.
+
+    Most alleles are repeated single bases, so each unique allele is complemented once and then looked up. Categorical
+    columns are complemented through their categories (see _complement_categories), without casting to strings.
     """
+    text_cols: list[str] = [x for x in flip_cols if df[x].dtype != pl.Categorical]
+    alleles: list[str] = (pl.concat([df.select(pl.col(col).unique().cast(str).alias('allele')) for col in text_cols])
+                          ['allele'].drop_nulls().unique().to_list()) if text_cols else []
+    logger.debug(f"Complementing {len(alleles)} unique alleles in columns {text_cols}")
+    # typed explicitly, so a lookup without alleles can still be joined
+    lookup: pl.DataFrame = pl.DataFrame([pl.Series('allele', alleles, dtype=pl.Utf8),
+                                         pl.Series('flip', [_complement(x) for x in alleles], dtype=pl.Utf8)])
+
     for col in flip_cols:
-        logger.debug(f"Complementing column {col}")
-        new_col = col + '_FLIP'
-        df = df.with_column(
-            pl.when(pl.col(col).str.contains('^[ACGT]+$'))
-                .then(pl.col(col).str.replace_all("A", "V")
-                           .str.replace_all("T", "X")
-                           .str.replace_all("C", "Y")
-                           .str.replace_all("G", "Z")
-                           .str.replace_all("V", "T")
-                           .str.replace_all("X", "A")
-                           .str.replace_all("Y", "G")
-                           .str.replace_all("Z", "C"))
-                .otherwise(pl.col(col))
-                .alias(new_col)
-        )
+        if col in text_cols:
+            df = df.join(lookup.rename({'allele': col, 'flip': col + '_FLIP'}), on=col, how='left')
+        else:
+            df = _complement_categories(df, col)
     return df
 
 
+def _complement_categories(df: pl.DataFrame, col: str) -> pl.DataFrame:
+    """ Complement each category of a categorical column once, then look complements up by categorical code
+
+    Complements are categorical too. Codes are only compared within the column, so the global string cache isn't
+    needed, but complements only share codes with other categoricals if it's enabled.
+    """
+    categories: pl.Series = df[col].unique().drop_nulls()
+    logger.debug(f"Complementing {len(categories)} categories of column {col}")
+    flips: list[str] = [_complement(x) for x in categories.cast(str).to_list()]
+    lookup: pl.DataFrame = pl.DataFrame([categories.to_physical().alias('_code'),
+                                         pl.Series(col + '_FLIP', flips, dtype=pl.Utf8).cast(pl.Categorical)])
+    return (df.with_column(pl.col(col).to_physical().alias('_code'))
+            .join(lookup, on='_code', how='left')
+            .drop('_code'))
+
+
+_COMPLEMENT: dict[int, int] = str.maketrans('ACGT', 'TGCA')
+
+
+def _complement(allele: str) -> str:
+    if allele and allele.strip('ACGT') == '':
+        return allele.translate(_COMPLEMENT)
+    else:
+        return allele
+
+
 def handle_multiallelic(df: pl.DataFrame, remove_multiallelic: bool, pvar: bool) -> pl.DataFrame:
     # plink2 pvar multi-alleles are comma-separated
     df: pl.DataFrame = (df.with_column(
@@ -53,9 +79,11 @@ def handle_multiallelic(df: pl.DataFrame, remove_multiallelic: bool, pvar: bool)
 
 def check_weights(df: pl.DataFrame) -> None:
     """ Checks weights for scoring file variants that could be matched (e.g. have a chr & pos) """
-    weight_count = df.filter(pl.col('chr_name').is_not_null() & pl.col('chr_position').is_not_null()).groupby(['accession', 'chr_name', 'chr_position', 'effect_allele']).count()
-    if any(weight_count['count'] > 1):
-        logger.error("Multiple effect weights per variant per accession detected in files: {}".format(list(weight_count.filter(pl.col('count') > 1)['accession'].unique())))
+    variants: pl.DataFrame = (df.filter(pl.col('chr_name').is_not_null() & pl.col('chr_position').is_not_null())
+                              .select(['accession', 'chr_name', 'chr_position', 'effect_allele']))
+    duplicated: pl.Series = variants.is_duplicated()
+    if duplicated.any():
+        logger.error("Multiple effect weights per variant per accession detected in files: {}".format(list(variants.filter(duplicated)['accession'].unique())))
         raise Exception
 
 
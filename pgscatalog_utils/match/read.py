@@ -1,25 +1,43 @@
 import glob
+import gzip
+import io
 import logging
-from typing import NamedTuple
+import os
+from typing import NamedTuple, Iterator, BinaryIO
 
 import polars as pl
 
+from pgscatalog_utils.match.cache import cache_path, write_cache, scan_cache
 from pgscatalog_utils.match.preprocess import handle_multiallelic, check_weights, complement_valid_alleles
+from pgscatalog_utils.scorefile.write import scorefile_format
 
 logger = logging.getLogger(__name__)
 
+_DECOMPRESSED_BATCH_SIZE: int = 64 * 1024 ** 2  # bytes of a compressed target parsed at once
+
 
 def read_target(path: str, remove_multiallelic: bool, single_file: bool = False,
-                chrom: str = "") -> pl.DataFrame:
+                chrom: str = "", cache_dir: str | None = None, cache_hash: bool = False) -> pl.DataFrame:
+    if cache_dir is not None:
+        # a glob of split targets (--fast) can't be fingerprinted, so each file is cached separately
+        return pl.concat([_read_cached_target(x, remove_multiallelic, single_file, chrom, cache_dir, cache_hash)
+                          for x in _expand_target(path)])
+
     target: Target = _detect_target_format(path)
     d = {'column_1': str}  # column_1 is always CHROM. CHROM must always be a string
+    projection: dict[str, str] = _target_projection(target)
+
+    if _is_compressed(path):
+        return _read_compressed_target(path, target, remove_multiallelic, [chrom] if single_file else None)
 
+    # uncompressed targets are read from the path, so polars memory maps the file instead of copying it
     if single_file:
         logger.debug(f"Scanning target genome for chromosome {chrom}")
         # scan target and filter to reduce memory usage on big files
         df: pl.DataFrame = (
             pl.scan_csv(path, sep='\t', has_header=False, comment_char='#', dtype=d)
             .filter(pl.col('column_1') == chrom)
+            .select(list(projection))
             .collect())
 
         if df.is_empty():
@@ -27,30 +45,98 @@ def read_target(path: str, remove_multiallelic: bool, single_file: bool = False,
             return df
     else:
         logger.debug(f"Reading target {path}")
-        df: pl.DataFrame = pl.read_csv(path, sep='\t', has_header=False, comment_char='#', dtype=d)
+        df: pl.DataFrame = pl.read_csv(path, sep='\t', has_header=False, comment_char='#', dtype=d,
+                                       columns=list(projection))
 
-    df.columns = target.header
+    return _format_target(df.rename(projection), target, remove_multiallelic)
+
+
+def read_target_batches(path: str, remove_multiallelic: bool, batch_size: int) -> Iterator[pl.DataFrame]:
+    """ Read a target genome once, in batches of complete records of approximately batch_size bytes
+
+    Peak memory depends on the batch size instead of the size of the target genome
+    """
+    target: Target = _detect_target_format(path)
+    for df in _parse_target_batches(path, target, batch_size):
+        yield _format_target(df, target, remove_multiallelic)
+
+
+def read_target_chroms(path: str, remove_multiallelic: bool, chroms: list[str], cache_dir: str | None = None,
+                       cache_hash: bool = False) -> Iterator[tuple[str, pl.DataFrame]]:
+    """ Read the variants of each chromosome in a single target genome, one chromosome at a time
+
+    Uncompressed and cached targets are scanned and filtered once per chromosome. Decompressing is slow, so a
+    compressed target is decompressed once and split into chromosomes instead
+    """
+    if cache_dir is None and _is_compressed(path):
+        target: pl.DataFrame = _read_compressed_target(path, _detect_target_format(path), remove_multiallelic, chroms)
+        partitions: dict[str, pl.DataFrame] = target.partition_by('#CHROM', as_dict=True)
+        for chrom in chroms:
+            if chrom not in partitions:
+                logger.warning(f"Chromosome missing from target genome: {chrom}")
+            yield chrom, partitions.pop(chrom, target.head(0))  # popped, so matched chromosomes can be freed
+    else:
+        for chrom in chroms:
+            yield chrom, read_target(path, remove_multiallelic=remove_multiallelic, single_file=True, chrom=chrom,
+                                     cache_dir=cache_dir, cache_hash=cache_hash)
 
-    match target.file_format:
-        case 'bim':
-            return (df[_default_cols()]
-                    .pipe(handle_multiallelic, remove_multiallelic=remove_multiallelic, pvar=False))
-        case 'pvar':
-            return (df[_default_cols()]
-                    .pipe(handle_multiallelic, remove_multiallelic=remove_multiallelic, pvar=True))
-        case _:
-            logger.error("Invalid file format detected")
-            raise Exception
+
+def read_target_variants(path: str) -> pl.DataFrame:
+    """ Read the variants of a target genome in file order, numbered by their index in the genotype file
+
+    Unlike read_target, multiallelic variants aren't split, so each row is one variant of the genotype file
+    """
+    target: Target = _detect_target_format(path)
+    d = {f'column_{target.header.index(x) + 1}': str for x in ['#CHROM', 'ID', 'REF', 'ALT']}
+    projection: dict[str, str] = _target_projection(target)
+
+    if _is_compressed(path):
+        with _open_target(path) as f:
+            first_record: bytes = _skip_header(f)
+            df: pl.DataFrame = pl.read_csv(first_record + f.read(), sep='\t', has_header=False, dtype=d,
+                                           columns=list(projection))
+    else:
+        df: pl.DataFrame = pl.read_csv(path, sep='\t', has_header=False, comment_char='#', dtype=d,
+                                       columns=list(projection))
+
+    return df.rename(projection).select(_default_cols()).with_row_count('variant_idx')
 
 
 def read_scorefile(path: str) -> pl.DataFrame:
+    """ Read every variant and column of a combined scorefile
+
+    Nothing is filtered or projected: the match log joins matches to the complete scorefile, so match_variants needs
+    the whole file even when targets are matched one chromosome at a time
+    """
     logger.debug("Reading scorefile")
-    scorefile: pl.DataFrame = (pl.read_csv(path, sep='\t', dtype={'chr_name': str})
+    scorefile: pl.DataFrame = (scan_scorefile(path)
+                               .collect()
                                .pipe(complement_valid_alleles, flip_cols=['effect_allele', 'other_allele']))
     check_weights(scorefile)
     return scorefile
 
 
+def scan_scorefile(path: str) -> pl.LazyFrame:
+    """ Lazily read a combined scorefile in text (TSV), Parquet, or Arrow IPC format
+
+    Columnar scorefiles are typed, so they're not parsed again, and filters (e.g. by chromosome) and column selection
+    are pushed down into the scan. Text scorefiles may be gzipped, which polars can't scan, so they're read eagerly.
+    Categorical columns of columnar scorefiles stay categorical, so scan them with the global string cache enabled if
+    they'll be compared with other categoricals.
+    """
+    match scorefile_format(path):
+        case 'parquet':
+            logger.debug("Scanning Parquet scorefile")
+            df: pl.LazyFrame = pl.scan_parquet(path)
+        case 'ipc':
+            logger.debug("Scanning Arrow IPC scorefile")
+            df: pl.LazyFrame = pl.scan_ipc(path)
+        case _:
+            return pl.read_csv(path, sep='\t', dtype={'chr_name': str, 'effect_weight': pl.Float64}).lazy()
+
+    return df.with_column(pl.col('chr_position').cast(pl.Int64))  # positions are joined with target positions
+
+
 class Target(NamedTuple):
     """ Important summary information about a target genome. Cheap to compute (just reads the header). """
     file_format: str
@@ -65,9 +151,9 @@ def _detect_target_format(path: str) -> Target:
         logger.debug("Detecting target file format")
         path = glob.glob(path)[0]  # guess format from first file in directory
 
-    with open(path, 'rt') as f:
+    with _open_target(path) as f:
         for line in f:
-            if line.startswith('#'):
+            if line.startswith(b'#'):
                 logger.debug("pvar format detected")
                 file_format = 'pvar'
                 header = _pvar_header(path)
@@ -81,18 +167,154 @@ def _detect_target_format(path: str) -> Target:
     return Target(file_format, header)
 
 
+def _read_compressed_target(path: str, target: Target, remove_multiallelic: bool,
+                            chroms: list[str] | None) -> pl.DataFrame:
+    """ Read a compressed target genome (or a glob of them) with streaming decompression, optionally keeping only
+    some chromosomes
+
+    Polars can't read compressed text directly, so the target is decompressed and parsed in batches and the
+    decompressed file is never held in memory. Batches are filtered before they're formatted, so multiallelic
+    variants are only handled on the kept chromosomes
+    """
+    batches: list[pl.DataFrame] = []
+    for x in _expand_target(path):
+        logger.debug(f"Reading compressed target {x}")
+        for batch in _parse_target_batches(x, target, batch_size=_DECOMPRESSED_BATCH_SIZE):
+            batches.append(batch if chroms is None else batch.filter(pl.col('#CHROM').is_in(chroms)))
+
+    df: pl.DataFrame = _format_target(pl.concat(batches), target, remove_multiallelic)
+    if chroms is not None and len(chroms) == 1 and df.is_empty():
+        logger.warning(f"Chromosome missing from target genome: {chroms[0]}")
+    return df
+
+
+def _parse_target_batches(path: str, target: Target, batch_size: int) -> Iterator[pl.DataFrame]:
+    """ Parse the important columns of a target genome in batches of complete records, without formatting them """
+    # CHROM, ID, and alleles must always be strings, even if a batch only contains numbers
+    d = {f'column_{target.header.index(x) + 1}': str for x in ['#CHROM', 'ID', 'REF', 'ALT']}
+    projection: dict[str, str] = _target_projection(target)
+
+    logger.debug(f"Streaming target {path} in batches of {batch_size} bytes")
+    with _open_target(path) as f:
+        first_record: bytes = _skip_header(f)
+        for i, chunk in enumerate(_read_chunks(f, batch_size, first_record)):
+            logger.debug(f"Reading target batch {i}")
+            df: pl.DataFrame = pl.read_csv(chunk, sep='\t', has_header=False, dtype=d, columns=list(projection))
+            yield df.rename(projection)
+
+
+def _expand_target(path: str) -> list[str]:
+    """ Expand a glob of split target genomes, in the same order as multiple target matching """
+    return sorted(glob.glob(path)) or [path]  # a missing path is reported when it's read
+
+
+def _read_cached_target(path: str, remove_multiallelic: bool, single_file: bool, chrom: str, cache_dir: str,
+                        cache_hash: bool) -> pl.DataFrame:
+    """ Read a normalised target genome from the cache, creating the cache on first use
+
+    The cache contains all multiallelic variants (exploded), so it is valid for any --keep_multiallelic setting
+    """
+    cached: str = cache_path(path, cache_dir, cache_hash)
+
+    if os.path.exists(cached):
+        logger.debug(f"Target cache hit for {path}")
+    else:
+        logger.debug(f"Target cache miss for {path}, parsing target")
+        write_cache(read_target(path, remove_multiallelic=False), cached)
+
+    target: pl.LazyFrame = scan_cache(cached)
+
+    if single_file:
+        logger.debug(f"Filtering cached target genome for chromosome {chrom}")
+        target = target.filter(pl.col('#CHROM') == chrom)
+
+    if remove_multiallelic:
+        logger.debug('Dropping multiallelic variants')
+        target = target.filter(pl.col('is_multiallelic') == False)
+
+    df: pl.DataFrame = target.collect()
+
+    if single_file and df.is_empty():
+        logger.warning(f"Chromosome missing from target genome: {chrom}")
+
+    return df
+
+
+def _format_target(df: pl.DataFrame, target: Target, remove_multiallelic: bool) -> pl.DataFrame:
+    match target.file_format:
+        case 'bim':
+            return (df[_default_cols()]
+                    .pipe(handle_multiallelic, remove_multiallelic=remove_multiallelic, pvar=False))
+        case 'pvar':
+            return (df[_default_cols()]
+                    .pipe(handle_multiallelic, remove_multiallelic=remove_multiallelic, pvar=True))
+        case _:
+            logger.error("Invalid file format detected")
+            raise Exception
+
+
+def _skip_header(f: BinaryIO) -> bytes:
+    """ Read past the comment lines (pvar header) of a file, returning the first record
+
+    Decompressing streams can't seek backwards, so the first record is returned instead of being read again
+    """
+    line: bytes = f.readline()
+    while line.startswith(b'#'):
+        line = f.readline()
+    return line
+
+
+def _read_chunks(f: BinaryIO, size: int, first_record: bytes = b'') -> Iterator[bytes]:
+    """ Read chunks of complete lines from a file, each approximately size bytes """
+    if len(first_record) >= size:
+        yield first_record
+        first_record = b''
+
+    while chunk := first_record + f.read(size - len(first_record)):
+        first_record = b''
+        yield chunk + f.readline()  # finish the last record in the chunk
+
+
+def _is_compressed(path: str) -> bool:
+    return path.endswith(('.gz', '.zst'))
+
+
+def _open_target(path: str) -> BinaryIO:
+    """ Open a target genome for reading, decompressing gzip (.gz) and zstd (.zst) files as a stream """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    elif path.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            logger.critical("Reading zstd compressed targets (.zst) needs the optional zstandard package")
+            raise Exception
+        # a buffered reader supports readline and iterating over lines, like a normal file
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True))
+    else:
+        return open(path, 'rb')
+
+
 def _default_cols() -> list[str]:
     return ['#CHROM', 'POS', 'ID', 'REF', 'ALT']  # only columns we want from a target genome
 
 
+def _target_projection(target: Target) -> dict[str, str]:
+    """ Map the raw names (column_N) of the columns we want from a target genome to their header names
+
+    Only these columns are parsed, so wide columns like INFO in pvars converted from VCF are never allocated
+    """
+    return {f'column_{target.header.index(x) + 1}': x for x in _default_cols()}
+
+
 def _pvar_header(path: str) -> list[str]:
     """ Get the column names from the pvar file (not constrained like bim, especially when converted from VCF) """
-    line: str = '#'
-    with open(path, 'rt') as f:
-        while line.startswith('#'):
-            line: str = f.readline()
-            if line.startswith('#CHROM'):
-                return line.strip().split('\t')
+    line: bytes = b'#'
+    with _open_target(path) as f:
+        while line.startswith(b'#'):
+            line: bytes = f.readline()
+            if line.startswith(b'#CHROM'):
+                return line.decode().strip().split('\t')
 
 
 def _bim_header() -> list[str]:
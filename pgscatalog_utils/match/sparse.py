@@ -0,0 +1,82 @@
+import logging
+from typing import NamedTuple
+
+import numpy as np
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+
+class SparseWeights(NamedTuple):
+    """ Effect weights of a scorefile as a sparse variant x accession matrix in CSR format
+
+    Row i of the matrix is variant i (ID and effect allele), column j is accession j. Only non-zero weights are
+    stored: the weights of row i are data[indptr[i]:indptr[i + 1]], in the columns indices[indptr[i]:indptr[i + 1]]
+    """
+    variants: pl.DataFrame
+    accessions: list[str]
+    indptr: np.ndarray
+    indices: np.ndarray
+    data: np.ndarray
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.variants.shape[0], len(self.accessions)
+
+    def to_dense(self) -> np.ndarray:
+        """ Expand to a dense numpy array, with zero for missing weights """
+        dense: np.ndarray = np.zeros(self.shape, dtype=self.data.dtype)
+        rows: np.ndarray = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        dense[rows, self.indices] = self.data
+        return dense
+
+    def to_scipy(self):
+        """ Get a scipy.sparse.csr_matrix. scipy isn't a dependency of pgscatalog_utils, so it must be installed """
+        try:
+            from scipy.sparse import csr_matrix
+        except ImportError:
+            logger.critical("Converting sparse weights to a scipy matrix needs scipy")
+            raise Exception
+        return csr_matrix((self.data, self.indices, self.indptr), shape=self.shape)
+
+
+def write_sparse_weights(df: pl.DataFrame, path: str) -> None:
+    """ Write matched variants as a sparse weight matrix (see SparseWeights) in numpy .npz format
+
+    Variants and accessions are in the same order as the rows and columns of the plink2 scorefile with the same
+    matches, and the size of the output depends on the number of non-zero weights instead of variants x accessions
+    """
+    logger.debug(f"Writing sparse weights to {path}")
+    df = (df.select(['ID', 'matched_effect_allele', 'accession', 'effect_weight'])
+          .with_columns([pl.col(['ID', 'matched_effect_allele', 'accession']).cast(str)])
+          .unique(subset=['ID', 'matched_effect_allele', 'accession'], keep='first', maintain_order=True))
+
+    variants: pl.DataFrame = (df.select(['ID', 'matched_effect_allele'])
+                              .unique(maintain_order=True)
+                              .with_row_count('row'))
+    accessions: pl.DataFrame = df.select('accession').unique(maintain_order=True).with_row_count('col')
+
+    # cast in the frame: a numpy view of a temporary cast Series would outlive the memory it points to
+    weights: pl.DataFrame = (df.with_column(pl.col('effect_weight').cast(pl.Float64))
+                             .filter(pl.col('effect_weight').is_not_null() & (pl.col('effect_weight') != 0))
+                             .join(variants, on=['ID', 'matched_effect_allele'], how='left')
+                             .join(accessions, on='accession', how='left')
+                             .sort(['row', 'col']))
+    indptr: np.ndarray = np.searchsorted(weights['row'].to_numpy(), np.arange(variants.shape[0] + 1))
+
+    with open(path, 'wb') as f:
+        np.savez_compressed(f, ID=np.array(variants['ID'].to_list(), dtype=str),
+                            effect_allele=np.array(variants['matched_effect_allele'].to_list(), dtype=str),
+                            accession=np.array(accessions['accession'].to_list(), dtype=str),
+                            indptr=indptr.astype(np.int64), indices=weights['col'].to_numpy().astype(np.int64),
+                            data=weights['effect_weight'].to_numpy())
+
+
+def read_sparse_weights(path: str) -> SparseWeights:
+    """ Read a sparse weight matrix written by match_variants --sparse """
+    logger.debug(f"Reading sparse weights from {path}")
+    with np.load(path) as npz:
+        variants: pl.DataFrame = pl.DataFrame([pl.Series('ID', npz['ID'].tolist(), dtype=pl.Utf8),
+                                               pl.Series('effect_allele', npz['effect_allele'].tolist(), dtype=pl.Utf8)])
+        return SparseWeights(variants=variants, accessions=npz['accession'].tolist(), indptr=npz['indptr'],
+                             indices=npz['indices'], data=npz['data'])
@@ -1,11 +1,21 @@
 import polars as pl
 import logging
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from pgscatalog_utils.match.sparse import write_sparse_weights
+from pgscatalog_utils.scorefile.write import open_scorefile
 
 logger = logging.getLogger(__name__)
 
+_BATCH_CELLS: int = 2 ** 22  # approximate number of weights pivoted at once when writing a scorefile
+
 
-def write_out(df: pl.DataFrame, split: bool, outdir: str, dataset: str) -> None:
+def write_out(df: pl.DataFrame, split: bool, outdir: str, dataset: str, compress: bool = False,
+              workers: int = 1, sparse: bool = False) -> None:
     if not os.path.isdir(outdir):
         os.mkdir(outdir)
 
@@ -15,51 +25,97 @@ def write_out(df: pl.DataFrame, split: bool, outdir: str, dataset: str) -> None:
     logger.debug("Deduplicating variants")
     deduplicated: dict[str, pl.DataFrame] = {k: _deduplicate_variants(k, v) for k, v in effect_types.items()}
 
-    logger.debug("Writing out scorefiles")
     ea_dict: dict[str, str] = {'is_dominant': 'dominant', 'is_recessive': 'recessive', 'additive': 'additive'}
-    [_write_scorefile(ea_dict.get(k), v, split, outdir, dataset) for k, v in deduplicated.items()]
+    outputs: list[tuple[str, pl.DataFrame]] = [x for k, v in deduplicated.items()
+                                               for x in _scorefile_outputs(ea_dict.get(k), v, split, outdir, dataset,
+                                                                           compress)]
+
+    logger.debug(f"Writing out {len(outputs)} scorefiles with {workers} threads")
+    # polars releases the GIL while pivoting and writing, so threads write scorefiles in parallel
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda x: _write_scorefile(*x, compress), outputs))
+        if sparse:
+            logger.debug("Writing out sparse weights")
+            list(executor.map(lambda x: write_sparse_weights(x[1], sparse_weights_path(x[0])), outputs))
 
 
 def write_log(df: pl.DataFrame, dataset: str) -> None:
     df.write_csv(f"{dataset}_log.csv")
 
 
-def _write_scorefile(effect_type: str, scorefiles: pl.DataFrame, split: bool, outdir: str, dataset: str) -> None:
-    """ Write a list of scorefiles with the same effect type """
+def _scorefile_outputs(effect_type: str, scorefiles: list[pl.DataFrame], split: bool, outdir: str, dataset: str,
+                       compress: bool) -> list[tuple[str, pl.DataFrame]]:
+    """ Get the output path and matched variants of each scorefile with the same effect type """
     # each list element contains a dataframe of variants
     # lists are split to ensure variants have unique ID - effect alleles
+    outputs: list[tuple[str, pl.DataFrame]] = []
     for i, scorefile in enumerate(scorefiles):
-        df_dict: dict[str, pl.DataFrame] = _format_scorefile(scorefile, split)  # may be split by chrom
+        df_dict: dict[str, pl.DataFrame] = _split_chrom(scorefile, split)
 
         for k, v in df_dict.items():
             chr = k.replace("false", "ALL")
-            path: str = os.path.join(outdir, f"{dataset}_{chr}_{effect_type}_{i}.scorefile")
-            logger.debug(f"Writing matched scorefile to {path}")
-            v.write_csv(path, sep="\t")
+            extension: str = '.scorefile.gz' if compress else '.scorefile'
+            outputs.append((os.path.join(outdir, f"{dataset}_{chr}_{effect_type}_{i}{extension}"), v))
+    return outputs
+
 
+def sparse_weights_path(path: str) -> str:
+    """ Get the path of the sparse weights written alongside a scorefile """
+    return re.sub(r'\.scorefile(\.gz)?$', '.weights.npz', path)
 
-def _format_scorefile(df: pl.DataFrame, split: bool) -> dict[str, pl.DataFrame]:
+
+def _write_scorefile(path: str, df: pl.DataFrame, compress: bool) -> None:
+    """ Write matched variants to a scorefile in plink2 --score format, optionally gzip compressed
+
+    Variants are pivoted and written in batches of rows, so the whole dense ID x accession matrix (mostly zeros
+    when scores don't overlap) is never built. The output is the same as pivoting all variants at once.
+    """
+    logger.debug(f"Writing matched scorefile to {path}")
+    accessions: list[str] = df['accession'].unique(maintain_order=True).to_list()
+    batch_size: int = max(_BATCH_CELLS // len(accessions), 1)
+
+    # number each output row (unique ID - effect allele) in order of appearance, and keep its variants together
+    rows: pl.DataFrame = (df.select(['ID', 'matched_effect_allele'])
+                          .unique(maintain_order=True)
+                          .with_row_count('output_row'))
+    df = (df.with_row_count()
+          .join(rows, on=['ID', 'matched_effect_allele'], how='left')
+          .sort(['output_row', 'row_nr'])
+          .drop('row_nr'))
+    offsets: np.ndarray = np.searchsorted(df['output_row'].to_numpy(), np.arange(0, rows.shape[0], batch_size))
+
+    with open_scorefile(path, compress) as f:
+        for i, (start, end) in enumerate(zip(offsets, list(offsets[1:]) + [df.shape[0]])):
+            batch: pl.DataFrame = _format_scorefile(df[start:end], accessions)
+            batch.write_csv(f, sep="\t", has_header=i == 0)
+
+
+def _format_scorefile(df: pl.DataFrame, accessions: list[str]) -> pl.DataFrame:
     """ Format a dataframe to plink2 --score standard
     Minimum example:
     ID | effect_allele | effect_weight
     Multiple scores are OK too:
     ID | effect_allele | weight_1 | ... | weight_n
+    Accessions without a weight in df are filled with zero, so every batch of a scorefile has the same columns
     """
-    logger.debug("Formatting scorefile to plink2 standard")
+    formatted: pl.DataFrame = (df.pivot(index=["ID", "matched_effect_allele"], values="effect_weight",
+                                        columns="accession")
+                               .rename({"matched_effect_allele": "effect_allele"})
+                               .fill_null(strategy="zero"))
+    zero: pl.Expr = pl.lit(0).cast(df['effect_weight'].dtype)
+    return formatted.select(['ID', 'effect_allele'] +
+                            [pl.col(x) if x in formatted.columns else zero.alias(x) for x in accessions])
+
+
+def _split_chrom(df: pl.DataFrame, split: bool) -> dict[str, pl.DataFrame]:
+    """ Split matched variants by chromosome, if requested """
     if split:
         logger.debug("Split output requested")
-        chroms: list[int] = df["chr_name"].unique().to_list()
-        return {x: (df.filter(pl.col("chr_name") == x)
-                    .pivot(index=["ID", "matched_effect_allele"], values="effect_weight", columns="accession")
-                    .rename({"matched_effect_allele": "effect_allele"})
-                    .fill_null(strategy="zero"))
-                for x in chroms}
+        chroms: list[str] = df["chr_name"].unique().to_list()
+        return {x: df.filter(pl.col("chr_name") == x) for x in chroms}
     else:
         logger.debug("Split output not requested")
-        formatted: pl.DataFrame = (df.pivot(index=["ID", "matched_effect_allele"], values="effect_weight", columns="accession")
-                                   .rename({"matched_effect_allele": "effect_allele"})
-                                   .fill_null(strategy="zero"))
-        return {'false': formatted}
+        return {'false': df}
 
 
 def _split_effect_type(df: pl.DataFrame) -> dict[str, pl.DataFrame]:
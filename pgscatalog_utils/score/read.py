@@ -0,0 +1,146 @@
+import logging
+import os
+from typing import NamedTuple
+
+import numpy as np
+import polars as pl
+
+from pgscatalog_utils.match.read import read_target_variants
+
+logger = logging.getLogger(__name__)
+
+_BED_MAGIC: bytes = bytes([0x6c, 0x1b, 0x01])  # plink1 .bed in variant-major mode
+# 2 bit genotype code -> dosage of the first bim allele. float32 holds every dosage (and NaN) exactly, in half the
+# memory of float64
+_BED_DOSAGE: np.ndarray = np.array([2, np.nan, 1, 0], dtype=np.float32)
+# each byte of a .bed packs four samples, first sample in the lowest bits: byte -> dosages of four samples
+_BED_LOOKUP: np.ndarray = _BED_DOSAGE[(np.arange(256)[:, np.newaxis] >> np.array([0, 2, 4, 6])) & 0b11]
+
+
+class Genotypes(NamedTuple):
+    """ A plink1 (.bed) or plink2 (.pgen) genotype file, with its variants and samples
+
+    variants has one row per variant in file order. Dosages count the allele in counted_allele: the first allele
+    of a bim file (plink1 A1), or the first ALT allele of a pvar file. Dosages of the other alleles of a pvar file
+    can be read too (see read_dosages), which needs the index of the first allele of each variant if any variant is
+    multiallelic
+    """
+    path: str
+    file_format: str
+    variants: pl.DataFrame
+    samples: pl.DataFrame
+    allele_idx_offsets: np.ndarray | None = None
+
+
+def read_genotypes(path: str) -> Genotypes:
+    """ Read the variants (.bim / .pvar) and samples (.fam / .psam) of a genotype file with the same prefix """
+    prefix, extension = os.path.splitext(path)
+    match extension:
+        case '.bed':
+            variants: pl.DataFrame = (read_target_variants(prefix + '.bim')
+                                      .rename({'REF': 'counted_allele', 'ALT': 'other_allele'}))
+            samples: pl.DataFrame = _read_fam(prefix + '.fam')
+            _check_bed(path, samples.shape[0], variants.shape[0])
+            return Genotypes(path, 'bed', variants, samples)
+        case '.pgen':
+            pvar_path: str = next((prefix + x for x in ['.pvar', '.pvar.zst', '.pvar.gz']
+                                   if os.path.exists(prefix + x)), prefix + '.pvar')
+            variants: pl.DataFrame = (read_target_variants(pvar_path)
+                                      .with_columns([pl.col('ALT').str.split(',').arr.first().alias('counted_allele'),
+                                                     pl.col('REF').alias('other_allele')]))
+            return Genotypes(path, 'pgen', variants, _read_psam(prefix + '.psam'), _allele_idx_offsets(variants))
+        case _:
+            logger.critical(f"Genotypes must be in plink1 .bed or plink2 .pgen format: {path}")
+            raise Exception
+
+
+def read_dosages(genotypes: Genotypes, variant_idx: np.ndarray, allele_idx: int = 1) -> np.ndarray:
+    """ Read float32 dosages of an allele for some variants (rows) and all samples (columns)
+
+    By default the counted allele is read. pgen files can read any allele: 0 is REF, 1 is the first ALT, 2 the
+    second ALT of a multiallelic variant, and so on. Missing is NaN
+    """
+    match genotypes.file_format:
+        case 'bed':
+            if allele_idx != 1:
+                logger.critical("Only dosages of the first allele (A1) of plink1 .bed genotypes can be read")
+                raise Exception
+            return _read_bed_dosages(genotypes.path, genotypes.samples.shape[0], genotypes.variants.shape[0],
+                                     variant_idx)
+        case 'pgen':
+            return _read_pgen_dosages(genotypes.path, genotypes.samples.shape[0], variant_idx, allele_idx,
+                                      genotypes.allele_idx_offsets)
+
+
+def read_matched_dosages(genotypes: Genotypes, matches: pl.DataFrame) -> tuple[pl.DataFrame, np.ndarray]:
+    """ Read dosages of the matched variants only (e.g. to check scores), in the order of the genotype file """
+    variants: pl.DataFrame = genotypes.variants.filter(pl.col('ID').is_in(matches['ID'].cast(str).unique()))
+    return variants, read_dosages(genotypes, variants['variant_idx'].to_numpy())
+
+
+def _read_bed_dosages(path: str, n_samples: int, n_variants: int, variant_idx: np.ndarray) -> np.ndarray:
+    """ Decode the genotypes of some variants from a memory mapped .bed file
+
+    Only the pages of the selected variants are read from disk, so the genotype matrix is never loaded into memory.
+    Each packed byte is decoded with one lookup, instead of unpacking 2 bit codes
+    """
+    bytes_per_variant: int = (n_samples + 3) // 4  # four samples are packed in each byte, the last byte is padded
+    bed: np.memmap = np.memmap(path, dtype=np.uint8, mode='r', offset=len(_BED_MAGIC),
+                               shape=(n_variants, bytes_per_variant))
+    packed: np.ndarray = bed[variant_idx]  # a copy of the selected variants only
+    return _BED_LOOKUP[packed].reshape(len(variant_idx), bytes_per_variant * 4)[:, :n_samples]
+
+
+def _read_pgen_dosages(path: str, n_samples: int, variant_idx: np.ndarray, allele_idx: int,
+                       allele_idx_offsets: np.ndarray | None) -> np.ndarray:
+    try:
+        import pgenlib
+    except ImportError:
+        logger.critical("Reading plink2 .pgen genotypes needs the optional pgenlib package")
+        raise Exception
+
+    dosages: np.ndarray = np.empty((len(variant_idx), n_samples), dtype=np.float32)
+    # without allele offsets pgenlib reads every variant as biallelic, so later ALT alleles would be wrong
+    with pgenlib.PgenReader(path.encode(), allele_idx_offsets=allele_idx_offsets) as reader:
+        reader.read_dosages_list(variant_idx.astype(np.uint32), dosages, allele_idx=allele_idx)
+    dosages[dosages == -9] = np.nan  # pgenlib missing value
+    return dosages
+
+
+def _allele_idx_offsets(variants: pl.DataFrame) -> np.ndarray | None:
+    """ Index of the first allele (REF) of each variant in a list of every allele, and the number of alleles
+
+    e.g. REF A ALT C and REF G ALT T,C -> 0, 2, 5. None if every variant is biallelic
+    """
+    n_alleles: pl.Series = variants['ALT'].str.split(',').arr.lengths() + 1
+    if (n_alleles == 2).all():
+        return None
+    return np.concatenate([[0], np.cumsum(n_alleles.to_numpy())]).astype(np.uintp)
+
+
+def _read_fam(path: str) -> pl.DataFrame:
+    """ Read family and sample IDs from a fam file, which may be space or tab separated """
+    with open(path) as f:
+        ids: list[list[str]] = [line.split()[:2] for line in f if line.strip()]
+    return pl.DataFrame([pl.Series('FID', [x[0] for x in ids], dtype=pl.Utf8),
+                         pl.Series('IID', [x[1] for x in ids], dtype=pl.Utf8)])
+
+
+def _read_psam(path: str) -> pl.DataFrame:
+    """ Read sample IDs (and family IDs, if present) from a psam file """
+    samples: pl.DataFrame = pl.read_csv(path, sep='\t', infer_schema_length=0)  # IDs are always strings
+    samples = samples.rename({x: x.lstrip('#') for x in samples.columns if x in ['#FID', '#IID']})
+    return samples.select([x for x in ['FID', 'IID'] if x in samples.columns])
+
+
+def _check_bed(path: str, n_samples: int, n_variants: int) -> None:
+    with open(path, 'rb') as f:
+        magic: bytes = f.read(len(_BED_MAGIC))
+
+    if magic != _BED_MAGIC:
+        logger.critical(f"{path} isn't a variant-major plink1 .bed file")
+        raise Exception
+
+    if os.path.getsize(path) != len(_BED_MAGIC) + n_variants * ((n_samples + 3) // 4):
+        logger.critical(f"Size of {path} doesn't match the number of variants and samples")
+        raise Exception
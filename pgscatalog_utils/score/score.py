@@ -0,0 +1,180 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+
+import numpy as np
+import polars as pl
+
+from pgscatalog_utils.score.read import Genotypes, read_genotypes, read_dosages
+
+logger = logging.getLogger(__name__)
+
+_EFFECT_TYPES: list[str] = ['additive', 'is_dominant', 'is_recessive']
+_BLOCK_BYTES: int = 128 * 1024 ** 2  # approximate size of the float64 dosages of a block, in each worker thread
+
+
+def score_genotypes(matches: pl.DataFrame, path: str, workers: int = 1,
+                    block_size: int | None = None) -> pl.DataFrame:
+    """ Calculate the sum of each score for every sample, from matched variants and plink genotypes
+
+    All scores are calculated together, in blocks of block_size variants: each block of dosages is multiplied by a
+    matrix of effect weights, so duplicated variant IDs don't need to be split into separate scorefiles. By default
+    blocks are sized by the number of samples, so memory doesn't grow with sample size. Split genotypes (e.g. one
+    file per chromosome) are matched by a glob and summed. Missing dosages are replaced with the mean dosage of the
+    variant, like plink2 --score
+    """
+    paths: list[str] = sorted(glob(path))
+    if not paths:
+        logger.critical(f"No genotypes found: {path}")
+        raise Exception
+
+    weights: pl.DataFrame = matches.select([pl.col(['ID', 'matched_effect_allele', 'effect_type', 'accession'])
+                                           .cast(str), pl.col('effect_weight').cast(pl.Float64)])
+    accessions: list[str] = weights['accession'].unique(maintain_order=True).to_list()
+
+    samples: pl.DataFrame | None = None
+    sums: np.ndarray | None = None
+    for genotype_path in paths:
+        logger.debug(f"Scoring genotypes {genotype_path}")
+        genotypes: Genotypes = read_genotypes(genotype_path)
+
+        if samples is None:
+            samples, sums = genotypes.samples, np.zeros((genotypes.samples.shape[0], len(accessions)))
+        elif not samples.frame_equal(genotypes.samples):
+            logger.critical(f"Samples in {genotype_path} are different to samples in {paths[0]}")
+            raise Exception
+
+        sums += _score_file(genotypes, weights, accessions, workers, block_size)
+
+    return samples.hstack([pl.Series(f"{x}_SUM", sums[:, i]) for i, x in enumerate(accessions)])
+
+
+def write_scores(df: pl.DataFrame, outdir: str, dataset: str) -> None:
+    path: str = os.path.join(outdir, f"{dataset}.sscore")
+    logger.debug(f"Writing scores to {path}")
+    df.write_csv(path, sep="\t")
+
+
+def _score_file(genotypes: Genotypes, weights: pl.DataFrame, accessions: list[str], workers: int,
+                block_size: int | None) -> np.ndarray:
+    """ Sum scores (samples x accessions) over the variants of one genotype file """
+    variant_weights: pl.DataFrame = _variant_weights(genotypes, weights, accessions)
+    logger.debug(f"{variant_weights.shape[0]} weights matched to genotypes in {genotypes.path}")
+    if block_size is None:
+        block_size = max(1, _BLOCK_BYTES // (8 * genotypes.samples.shape[0]))
+    logger.debug(f"Scoring blocks of {block_size} variants")
+
+    # sorted by variant, so the weights of each block of variants are a slice
+    variant_idx: np.ndarray = np.unique(variant_weights['variant_idx'].to_numpy())
+    blocks: list[np.ndarray] = [variant_idx[i:i + block_size] for i in range(0, len(variant_idx), block_size)]
+    offsets: np.ndarray = np.searchsorted(variant_weights['variant_idx'].to_numpy(),
+                                          [x[0] for x in blocks] + [variant_idx[-1] + 1 if len(variant_idx) else 0])
+
+    # numpy and file reads release the GIL, so blocks are read and multiplied in parallel
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        partial: list[np.ndarray] = list(executor.map(
+            lambda i: _score_block(genotypes, variant_weights[offsets[i]:offsets[i + 1]], len(accessions)),
+            range(len(blocks))))
+    return sum(partial, np.zeros((genotypes.samples.shape[0], len(accessions))))
+
+
+def _variant_weights(genotypes: Genotypes, weights: pl.DataFrame, accessions: list[str]) -> pl.DataFrame:
+    """ Find the genotype variant and allele of each weight
+
+    Effect alleles of a bed file are the counted allele or the other allele (flipped). Effect alleles of a pgen file
+    are read directly by their allele index, so any ALT allele of a multiallelic variant can be scored. Accessions
+    and effect types are numbered, and weights are sorted by variant index
+    """
+    effect_code: pl.DataFrame = pl.DataFrame({'effect_type': _EFFECT_TYPES,
+                                              'effect_code': list(range(len(_EFFECT_TYPES)))})
+    accession_idx: pl.DataFrame = pl.DataFrame({'accession': accessions,
+                                                'accession_idx': list(range(len(accessions)))})
+
+    match genotypes.file_format:
+        case 'pgen':
+            matched: pl.DataFrame = (weights.join(_pgen_alleles(genotypes.variants), how='inner',
+                                                  left_on=['ID', 'matched_effect_allele'], right_on=['ID', 'allele'])
+                                     .with_column(pl.lit(0).cast(pl.UInt8).alias('flip')))
+        case _:
+            matched: pl.DataFrame = (weights.join(genotypes.variants.select(['ID', 'variant_idx', 'counted_allele',
+                                                                             'other_allele']), on='ID', how='inner')
+                                     .filter((pl.col('matched_effect_allele') == pl.col('counted_allele')) |
+                                             (pl.col('matched_effect_allele') == pl.col('other_allele')))
+                                     .with_columns([(pl.col('matched_effect_allele') != pl.col('counted_allele'))
+                                                   .cast(pl.UInt8).alias('flip'),
+                                                    pl.lit(1).cast(pl.UInt8).alias('allele_idx')]))
+    _check_unmatched_alleles(genotypes, weights, matched)
+
+    variant_weights: pl.DataFrame = (matched.join(effect_code, on='effect_type', how='left')
+                                     .join(accession_idx, on='accession', how='left'))
+
+    if variant_weights['effect_code'].null_count() > 0:
+        logger.critical(f"Unknown effect type, effect types must be one of {_EFFECT_TYPES}")
+        raise Exception
+
+    return (variant_weights.select(['variant_idx', 'allele_idx', 'flip', 'effect_code', 'accession_idx',
+                                    'effect_weight'])
+            .sort('variant_idx'))
+
+
+def _pgen_alleles(variants: pl.DataFrame) -> pl.DataFrame:
+    """ One row for each allele of each variant, numbered like pgenlib: 0 is REF, 1 the first ALT, and so on """
+    return (variants.select(['ID', 'variant_idx', (pl.col('REF') + ',' + pl.col('ALT')).str.split(',').alias('allele')])
+            .explode('allele')
+            .with_row_count('allele_idx')
+            .with_column((pl.col('allele_idx') - pl.col('allele_idx').min().over('variant_idx'))
+                         .cast(pl.UInt8).alias('allele_idx')))
+
+
+def _check_unmatched_alleles(genotypes: Genotypes, weights: pl.DataFrame, matched: pl.DataFrame) -> None:
+    """ Warn about weights of genotype variants that can't be scored, because the effect allele isn't an allele of
+    the variant """
+    unmatched: pl.DataFrame = (weights.join(genotypes.variants.select('ID'), on='ID', how='semi')
+                               .join(matched, on=['ID', 'matched_effect_allele', 'accession'], how='anti')
+                               .groupby('accession', maintain_order=True)
+                               .agg(pl.count()))
+    for accession, n in unmatched.rows():
+        logger.warning(f"{n} weights of {accession} dropped: effect allele isn't an allele of the variant in "
+                       f"{genotypes.path}")
+
+
+def _score_block(genotypes: Genotypes, block: pl.DataFrame, n_accessions: int) -> np.ndarray:
+    """ Sum scores (samples x accessions) over a block of variants, with the weights of the block """
+    # one dosage row for each variant, allele, orientation, and effect type, and one weight matrix row for each
+    block_idx: np.ndarray = block['variant_idx'].to_numpy().astype(np.int64)
+    allele_idx: np.ndarray = block['allele_idx'].to_numpy().astype(np.int64)
+    flip: np.ndarray = block['flip'].to_numpy().astype(np.int64)
+    effect_code: np.ndarray = block['effect_code'].to_numpy().astype(np.int64)
+    _, first, row = np.unique(((block_idx * 256 + allele_idx) * 2 + flip) * 4 + effect_code, return_index=True,
+                              return_inverse=True)
+
+    # dosages are read as float32 to save memory, but scores are summed in float64
+    x: np.ndarray = np.empty((len(first), genotypes.samples.shape[0]))
+    for allele in np.unique(allele_idx[first]):
+        rows: np.ndarray = np.flatnonzero(allele_idx[first] == allele)
+        variant_idx: np.ndarray = np.unique(block_idx[first][rows])
+        dosages: np.ndarray = read_dosages(genotypes, variant_idx, allele_idx=int(allele))
+        x[rows] = dosages[np.searchsorted(variant_idx, block_idx[first][rows])]
+
+    x = _impute_missing(x)
+    x[flip[first] == 1] = 2 - x[flip[first] == 1]
+    dominant: np.ndarray = effect_code[first] == _EFFECT_TYPES.index('is_dominant')
+    recessive: np.ndarray = effect_code[first] == _EFFECT_TYPES.index('is_recessive')
+    x[dominant] = np.minimum(x[dominant], 1)
+    x[recessive] = np.maximum(x[recessive] - 1, 0)
+
+    w: np.ndarray = np.zeros((len(first), n_accessions))
+    np.add.at(w, (row, block['accession_idx'].to_numpy().astype(np.int64)), block['effect_weight'].to_numpy())
+    return x.T @ w
+
+
+def _impute_missing(dosages: np.ndarray) -> np.ndarray:
+    """ Replace missing dosages with the mean dosage of each variant (zero if every dosage is missing) """
+    missing: np.ndarray = np.isnan(dosages)
+    if missing.any():
+        n: np.ndarray = (~missing).sum(axis=1)
+        mean: np.ndarray = np.divide(np.where(missing, 0, dosages).sum(axis=1), n, out=np.zeros(len(n)),
+                                     where=n > 0)
+        dosages = np.where(missing, mean[:, np.newaxis], dosages)
+    return dosages
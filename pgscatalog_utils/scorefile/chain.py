@@ -0,0 +1,197 @@
+import gzip
+import hashlib
+import logging
+import os
+import zipfile
+from typing import NamedTuple
+
+import numpy as np
+
+from pgscatalog_utils.atomic_write import atomic_write
+
+logger = logging.getLogger(__name__)
+
+_INDEX_VERSION: int = 1  # increment when the ChainIndex layout changes
+
+
+class ChainIndex(NamedTuple):
+    """ Sorted interval arrays built from a UCSC chain file, used to liftover many positions at once
+
+    Aligned blocks are split into non-overlapping segments that start at each breakpoint. Each segment
+    stores the best block covering it (highest chain score, like pyliftover), so a position is mapped with a
+    single binary search. Segments for each source chromosome are stored contiguously:
+    breakpoints[offsets[i]:offsets[i + 1]] belong to source_names[i].
+    """
+    source_names: list[str]
+    offsets: np.ndarray  # int64, segment offset of each source chromosome
+    breakpoints: np.ndarray  # int64, 0-based start of each segment (sorted within a chromosome)
+    shift: np.ndarray  # int64, target position = source position + shift (before strand correction)
+    target_size: np.ndarray  # int64, used to reverse coordinates on the negative strand
+    minus: np.ndarray  # bool, target strand is '-'
+    target: np.ndarray  # int32, index of the target chromosome name (-1 for unmapped segments)
+    target_names: list[str]
+
+
+def load_chain_index(path: str) -> ChainIndex:
+    """ Load the index of a chain file, building and saving it next to the chain file if it's missing or stale
+
+    The saved index records a checksum of the chain file, so it's rebuilt automatically if the chain file changes.
+    An unreadable index (e.g. truncated) is treated as stale
+    """
+    index_path: str = path + '.idx.npz'
+    checksum: str = _checksum(path)
+
+    if os.path.exists(index_path):
+        try:
+            with np.load(index_path, allow_pickle=False) as npz:
+                if str(npz['checksum']) == checksum and int(npz['version']) == _INDEX_VERSION:
+                    logger.debug(f"Loading chain index {index_path}")
+                    return ChainIndex(**{k: (npz[k].tolist() if k.endswith('names') else npz[k])
+                                         for k in ChainIndex._fields})
+            logger.warning(f"Chain index {index_path} doesn't match chain file, rebuilding")
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile) as e:
+            logger.warning(f"Can't read chain index {index_path} ({e}), rebuilding")
+
+    index: ChainIndex = read_chain_file(path)
+    _save_chain_index(index, index_path, checksum)
+    return index
+
+
+def read_chain_file(path: str) -> ChainIndex:
+    """ Parse a (gzipped) UCSC chain file and index it """
+    logger.debug(f"Reading chain file {path}")
+    opener = gzip.open if path.endswith('.gz') else open
+    source, source_start, source_end, target_start = [], [], [], []
+    chain, score, target, target_size, minus = [], [], [], [], []  # per chain
+    target_names: dict[str, int] = {}
+
+    with opener(path, 'rt') as f:
+        for line in f:
+            fields: list[str] = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            elif fields[0] == 'chain':
+                # chain score tName tSize tStrand tStart tEnd qName qSize qStrand qStart qEnd id
+                score.append(int(fields[1]))
+                target.append(target_names.setdefault(fields[7], len(target_names)))
+                target_size.append(int(fields[8]))
+                minus.append(fields[9] == '-')
+                sfrom, tfrom = int(fields[5]), int(fields[10])
+                chain_source: str = fields[2]
+            else:
+                # size [dt dq]: an aligned block, then the gaps to the next block
+                size: int = int(fields[0])
+                source.append(chain_source)
+                source_start.append(sfrom)
+                source_end.append(sfrom + size)
+                target_start.append(tfrom)
+                chain.append(len(score) - 1)
+                if len(fields) == 3:
+                    sfrom += size + int(fields[1])
+                    tfrom += size + int(fields[2])
+
+    chain = np.array(chain, dtype=np.int64)
+    return _index_blocks(np.array(source), np.array(source_start, dtype=np.int64),
+                         np.array(source_end, dtype=np.int64), np.array(target_start, dtype=np.int64),
+                         chain, np.array(score, dtype=np.int64)[chain], np.array(target, dtype=np.int32)[chain],
+                         np.array(target_size, dtype=np.int64)[chain], np.array(minus, dtype=bool)[chain],
+                         list(target_names))
+
+
+def convert_coordinates(index: ChainIndex, chrom: np.ndarray, pos: np.ndarray,
+                        names: list[str] | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """ Convert 0-based positions to a different build
+
+    chrom is the chromosome name of each position or, if names are given, the index of its name in names (-1 if
+    missing). Returns the index of the lifted chromosome name (see ChainIndex.target_names, -1 if unmapped) and the
+    0-based lifted position for each input position.
+    """
+    lifted_chrom: np.ndarray = np.full(len(pos), -1, dtype=np.int32)
+    lifted_pos: np.ndarray = np.zeros(len(pos), dtype=np.int64)
+
+    if names is None:
+        names, chrom = np.unique(chrom, return_inverse=True)
+    # group positions by chromosome once, then only look up chromosomes that are present
+    order: np.ndarray = np.argsort(chrom, kind='stable')
+    bounds: np.ndarray = np.searchsorted(chrom[order], np.arange(len(names) + 1))
+    source: dict[str, int] = {name: i for i, name in enumerate(index.source_names)}
+
+    for j, name in enumerate(names):
+        i: int | None = source.get(name)
+        if i is None or bounds[j] == bounds[j + 1]:
+            continue
+        rows: np.ndarray = order[bounds[j]:bounds[j + 1]]
+        start, end = index.offsets[i], index.offsets[i + 1]
+        segment: np.ndarray = np.searchsorted(index.breakpoints[start:end], pos[rows], side='right') - 1
+        mapped: np.ndarray = segment >= 0
+        rows, segment = rows[mapped], segment[mapped] + start
+        lifted: np.ndarray = pos[rows] + index.shift[segment]
+        lifted_chrom[rows] = index.target[segment]
+        lifted_pos[rows] = np.where(index.minus[segment], index.target_size[segment] - 1 - lifted, lifted)
+
+    return lifted_chrom, lifted_pos
+
+
+def _save_chain_index(index: ChainIndex, path: str, checksum: str) -> None:
+    try:
+        # concurrent jobs never read a partial index
+        with atomic_write(path) as tmp_path, open(tmp_path, 'wb') as f:
+            np.savez(f, checksum=np.array(checksum), version=np.array(_INDEX_VERSION),
+                     **{k: np.array(v) for k, v in index._asdict().items()})
+        logger.debug(f"Saved chain index {path}")
+    except OSError as e:
+        logger.warning(f"Couldn't save chain index {path} ({e}), the chain file will be parsed again next time")
+
+
+def _checksum(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while block := f.read(2 ** 20):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _index_blocks(source: np.ndarray, source_start: np.ndarray, source_end: np.ndarray, target_start: np.ndarray,
+                  chain: np.ndarray, score: np.ndarray, target: np.ndarray, target_size: np.ndarray,
+                  minus: np.ndarray, target_names: list[str]) -> ChainIndex:
+    """ Split aligned blocks into segments and keep the best block for each segment """
+    # a higher priority block wins: highest chain score, then the chain that appears first in the file
+    priority: np.ndarray = np.empty(len(chain), dtype=np.int64)
+    priority[np.lexsort((-chain, score))] = np.arange(len(chain))
+
+    source_names: list[str] = sorted(set(source.tolist()))
+    offsets: list[int] = [0]
+    breakpoints, best_block = [], []
+
+    for name in source_names:
+        blocks: np.ndarray = np.flatnonzero(source == name)
+        bp: np.ndarray = np.unique(np.concatenate([source_start[blocks], source_end[blocks]]))
+        first: np.ndarray = np.searchsorted(bp, source_start[blocks])
+        n: np.ndarray = np.searchsorted(bp, source_end[blocks]) - first  # segments covered by each block
+
+        # expand each block to the segments it covers, then keep the highest priority block per segment
+        block: np.ndarray = np.repeat(blocks, n)
+        segment: np.ndarray = np.repeat(first, n) + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        order: np.ndarray = np.lexsort((priority[block], segment))
+        block, segment = block[order], segment[order]
+        last: np.ndarray = np.append(segment[1:] != segment[:-1], True)
+
+        seg_block: np.ndarray = np.full(len(bp), -1, dtype=np.int64)  # -1: gap, not covered by a block
+        seg_block[segment[last]] = block[last]
+        breakpoints.append(bp)
+        best_block.append(seg_block)
+        offsets.append(offsets[-1] + len(bp))
+
+    seg_block = np.concatenate(best_block) if best_block else np.array([], dtype=np.int64)
+    covered: np.ndarray = seg_block >= 0
+    safe_block: np.ndarray = np.where(covered, seg_block, 0)
+
+    logger.debug(f"Indexed {len(chain)} aligned blocks for {len(source_names)} chromosomes")
+    return ChainIndex(source_names=source_names,
+                      offsets=np.array(offsets, dtype=np.int64),
+                      breakpoints=np.concatenate(breakpoints) if breakpoints else np.array([], dtype=np.int64),
+                      shift=np.where(covered, target_start[safe_block] - source_start[safe_block], 0),
+                      target_size=np.where(covered, target_size[safe_block], 0),
+                      minus=np.where(covered, minus[safe_block], False),
+                      target=np.where(covered, target[safe_block], -1).astype(np.int32),
+                      target_names=target_names)
@@ -1,40 +1,115 @@
 import argparse
 import logging
+import os
 import sys
 import textwrap
+from concurrent.futures import ThreadPoolExecutor
 
-import pandas as pd
+import polars as pl
 
 from pgscatalog_utils.log_config import set_logging_level
 from pgscatalog_utils.scorefile.read import load_scorefile
 from pgscatalog_utils.scorefile.effect_type import set_effect_type
 from pgscatalog_utils.scorefile.effect_weight import melt_effect_weights
 from pgscatalog_utils.scorefile.liftover import liftover
-from pgscatalog_utils.scorefile.write import write_scorefile
+from pgscatalog_utils.scorefile.write import write_scorefile, append_scorefile, open_scorefile, scorefile_format
+
+logger = logging.getLogger(__name__)
 
 
 def combine_scorefiles():
     args = _parse_args()
 
-    logger = logging.getLogger(__name__)
     set_logging_level(args.verbose)
 
     paths: list[str] = list(set(args.scorefiles))  # unique paths only
     logger.debug(f"Input scorefiles: {paths}")
-    scorefiles: pd.DataFrame = pd.concat([_read_and_melt(x, drop_missing=args.drop_missing) for x in paths])
+
+    if args.stream:
+        _stream_combine(paths, args)
+        return
+
+    scorefiles: pl.LazyFrame = _read_scorefiles(paths, drop_missing=args.drop_missing, workers=args.workers)
 
     if args.liftover:
         logger.debug("Annotating scorefiles with liftover parameters")
         scorefiles = liftover(scorefiles, args.chain_dir, args.min_lift, args.target_build)
 
-    write_scorefile(scorefiles, args.outfile)
+    write_scorefile(scorefiles, args.outfile, partition=args.partition)
+
+
+def _stream_combine(paths: list[str], args: argparse.Namespace) -> None:
+    """ Combine scorefiles one at a time, appending each to the output, so only one scorefile is held in memory
+
+    The output is written to a temporary file that's renamed when every scorefile has been combined
+    """
+    if scorefile_format(args.outfile) != 'text':
+        logger.critical("Streaming mode can only write text scorefiles (optionally gzip compressed)")
+        raise Exception
+    if args.partition:
+        logger.critical("Streaming mode can't partition scorefiles by chromosome")
+        raise Exception
+
+    logger.debug("Streaming scorefiles to output")
+    part: str = args.outfile + '.part'
+    n_variants: int = 0
+    try:
+        with open_scorefile(part, compress=args.outfile.endswith('.gz')) as f:
+            for i, path in enumerate(paths):
+                scorefile: pl.LazyFrame = _read_and_melt(path, drop_missing=args.drop_missing)
+                if args.liftover:
+                    # minimum liftover is checked for each scorefile
+                    scorefile = liftover(scorefile, args.chain_dir, args.min_lift, args.target_build)
+                n_variants += append_scorefile(scorefile, f, header=i == 0)
+                logger.debug(f"Combined scorefile {i + 1} of {len(paths)} ({n_variants} variants written)")
+
+        if n_variants == 0:
+            logger.error("Empty scorefile output! Please check the input data")
+            raise Exception
+    except BaseException:
+        os.remove(part)
+        raise
+
+    os.replace(part, args.outfile)
 
 
-def _read_and_melt(path, drop_missing: bool = False):
+def _read_scorefiles(paths: list[str], drop_missing: bool = False, workers: int = 1) -> pl.LazyFrame:
+    """ Load, QC, and melt scorefiles concurrently, then concatenate them once
+
+    Every scorefile is read before errors are reported together. polars releases the GIL while parsing, so
+    threads are enough to read files in parallel.
+    """
+    logger.debug(f"Reading {len(paths)} scorefiles with {workers} workers")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {path: executor.submit(lambda x: _read_and_melt(x, drop_missing=drop_missing).collect(), path)
+                   for path in paths}
+
+    failed: dict[str, BaseException] = {path: f.exception() for path, f in futures.items() if f.exception()}
+    for path, error in failed.items():
+        logger.critical(f"Couldn't read scorefile {path}: {error!r}")
+
+    if failed:
+        raise Exception(f"{len(failed)} scorefile(s) couldn't be read")
+
+    return pl.concat([futures[path].result() for path in paths]).lazy()
+
+
+def _read_and_melt(path, drop_missing: bool = False) -> pl.LazyFrame:
     """ Load a scorefile, melt it, and set the effect types"""
     return (load_scorefile(path, drop_missing=drop_missing)
             .pipe(melt_effect_weights)
-            .pipe(set_effect_type))
+            .pipe(set_effect_type)
+            .pipe(_select_columns))
+
+
+def _select_columns(df: pl.LazyFrame) -> pl.LazyFrame:
+    """ Select the same columns from each scorefile, so they can be concatenated """
+    if 'other_allele' not in df.columns:
+        logger.warning("No other allele information detected, writing out as missing data")
+        df = df.with_column(pl.lit(None).cast(pl.Utf8).alias('other_allele'))
+
+    return df.select(['chr_name', 'chr_position', 'effect_allele', 'other_allele', 'effect_weight', 'effect_type',
+                      'accession', 'filename'])
 
 
 if __name__ == "__main__":
@@ -76,9 +151,20 @@ def _parse_args(args=None) -> argparse.Namespace:
     parser.add_argument('--drop_missing', dest='drop_missing', action='store_true',
                         help='Drop variants with missing information (chr/pos) and '
                              'non-standard alleles from the output file.')
+    parser.add_argument('--workers', dest='workers', type=int, default=1,
+                        help='<Optional> Number of scorefiles to read at the same time')
+    parser.add_argument('--stream', dest='stream', action='store_true',
+                        help='<Optional> Combine one scorefile at a time, appending to the output file. '
+                             'Uses much less memory when combining many scorefiles')
+    parser.add_argument('--partition', dest='partition', action='store_true',
+                        help='<Optional> Sort the combined scorefile by chromosome and position, and write an index '
+                             'of each chromosome (<outfile>.idx.json). match_variants uses the index to match one '
+                             'chromosome at a time cheaply')
     parser.add_argument('-o', '--outfile', dest='outfile', required=True,
                         default='combined.txt',
-                        help='<Required> Output path to combined long scorefile')
+                        help='<Required> Output path to combined long scorefile. '
+                             'Compressed with gzip if the path ends with .gz. Paths ending with .parquet or .arrow '
+                             'are written in a typed columnar format, which match_variants reads faster')
     parser.add_argument('-v', '--verbose', dest='verbose', action='store_true',
                         help='<Optional> Extra logging information')
     return parser.parse_args(args)
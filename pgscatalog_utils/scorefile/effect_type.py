@@ -1,21 +1,28 @@
-import pandas as pd
+import polars as pl
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-def set_effect_type(df: pd.DataFrame) -> pd.DataFrame:
+def set_effect_type(df: pl.LazyFrame) -> pl.LazyFrame:
     if {'is_recessive', 'is_dominant'}.issubset(df.columns):
         _check_effect_types(df)
-        return (df.assign(additive=lambda x: ~x["is_recessive"] & ~x["is_dominant"])
-                .assign(effect_type=lambda x: x[["is_recessive", "is_dominant", "additive"]].idxmax(1)))
+        return df.with_column(pl.when(_is_true('is_recessive')).then(pl.lit('is_recessive'))
+                              .when(_is_true('is_dominant')).then(pl.lit('is_dominant'))
+                              .otherwise(pl.lit('additive'))
+                              .alias('effect_type'))
     else:
         return _set_default_effect_type(df)
 
 
-def _check_effect_types(df: pd.DataFrame):
+def _is_true(col: str) -> pl.Expr:
+    """ Effect type columns are read as strings (e.g. True, FALSE) """
+    return (pl.col(col).str.to_lowercase() == 'true').fill_null(False)
+
+
+def _check_effect_types(df: pl.LazyFrame):
     """ Check that only one effect type is set per variant """
-    bad_rows: pd.DataFrame = df[['is_dominant', 'is_recessive']].all(axis=1).any()
+    bad_rows: bool = df.select((_is_true('is_dominant') & _is_true('is_recessive')).any()).collect()[0, 0]
 
     error = ''' ERROR: Bad variants in scorefile
     is_recessive and is_dominant columns are both TRUE for a variant
@@ -28,6 +35,6 @@ def _check_effect_types(df: pd.DataFrame):
         raise Exception
 
 
-def _set_default_effect_type(df: pd.DataFrame, effect_type: str = "additive") -> pd.DataFrame:
+def _set_default_effect_type(df: pl.LazyFrame, effect_type: str = "additive") -> pl.LazyFrame:
     logger.debug(f'No effect types set, using default ({effect_type})')
-    return df.assign(effect_type=effect_type)
+    return df.with_column(pl.lit(effect_type).alias('effect_type'))
@@ -1,11 +1,11 @@
 import re
 import logging
-import pandas as pd
+import polars as pl
 
 logger = logging.getLogger(__name__)
 
 
-def melt_effect_weights(df: pd.DataFrame) -> pd.DataFrame:
+def melt_effect_weights(df: pl.LazyFrame) -> pl.LazyFrame:
     """ Ensure all dataframes are in long format, with one effect weight column and a score accession column """
     elongate = _detect_multiple_weight_columns(df)
 
@@ -14,11 +14,10 @@ def melt_effect_weights(df: pd.DataFrame) -> pd.DataFrame:
         return _melt(df)
     else:
         logger.debug("Skipping melt")
-        df['accession'] = df['filename']
-        return df
+        return df.with_column(pl.col('filename_prefix').alias('accession'))
 
 
-def _detect_multiple_weight_columns(df: pd.DataFrame) -> bool:
+def _detect_multiple_weight_columns(df: pl.LazyFrame) -> bool:
     """ Detect if multiple effect weight columns are present
 
     Single weight format:
@@ -27,9 +26,8 @@ def _detect_multiple_weight_columns(df: pd.DataFrame) -> bool:
     Multiple weight format:
     | chr_name | chr_pos | effect_allele | effect_weight_score_1 | ... | effect_weight_score_n
     """
-    columns: list[re.match | None] = [re.search("^effect_weight$", x) for x in df.columns.to_list()]
-    columns_suffix: list[re.match | None] = [re.search("^effect_weight_[A-Za-z0-9]+$", x) for x
-                                             in df.columns.to_list()]
+    columns: list[re.match | None] = [re.search("^effect_weight$", x) for x in df.columns]
+    columns_suffix: list[re.match | None] = [re.search("^effect_weight_[A-Za-z0-9]+$", x) for x in df.columns]
 
     if any([col for col in columns]):
         logger.debug("Single effect weight column detected")
@@ -42,9 +40,9 @@ def _detect_multiple_weight_columns(df: pd.DataFrame) -> bool:
         raise Exception("Bad effect weights")
 
 
-def _melt(df: pd.DataFrame) -> pd.DataFrame:
-    """ Melt a multiple effect weight format """
-    ew_cols: list[str] = df.filter(regex="effect_weight_*").columns.to_list()
-    return df.melt(value_vars=ew_cols, value_name="effect_weight", var_name="accession")
-
-
+def _melt(df: pl.LazyFrame) -> pl.LazyFrame:
+    """ Melt a multiple effect weight format. The accession is the suffix of each effect weight column """
+    ew_cols: list[str] = [x for x in df.columns if x.startswith('effect_weight_')]
+    return (df.melt(id_vars=[x for x in df.columns if x not in ew_cols], value_vars=ew_cols,
+                    value_name="effect_weight", variable_name="accession")
+            .with_column(pl.col('accession').str.replace('^effect_weight_', '')))
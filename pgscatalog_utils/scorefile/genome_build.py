@@ -3,20 +3,21 @@ import io
 import logging
 import re
 from typing import TextIO
-import pandas as pd
+import polars as pl
 
 logger = logging.getLogger(__name__)
 
 
-def annotate_build(df: pd.DataFrame, target_build: str) -> pd.DataFrame:
+def annotate_build(df: pl.DataFrame, target_build: str) -> pl.DataFrame:
     """ Annotate the dataframe with genome build data """
     logger.debug(f"Annotating target build: {target_build}")
     build_dict: dict = {'GRCh37': 'hg19', 'GRCh38': 'hg38', 'hg19': 'hg19', 'hg38': 'hg38'}  # standardise build names
-    df['target_build'] = build_dict[target_build]
 
-    builds: pd.DataFrame = _get_builds(df['filename'].drop_duplicates())
-    builds['genome_build'] = builds.apply(lambda x: build_dict[x.genome_build], axis=1)
-    return df.merge(builds, how="left", on="filename")
+    filenames: list[str] = df['filename'].unique().to_list()
+    builds: pl.DataFrame = (_get_builds(filenames)
+                            .with_column(pl.col('genome_build').apply(lambda x: build_dict[x])))
+    return (df.with_column(pl.lit(build_dict[target_build]).alias('target_build'))
+            .join(builds, how="left", on="filename"))
 
 
 def _read_header(f: TextIO) -> str:
@@ -47,9 +48,9 @@ def _read_build(path: str) -> str:
             return _read_header(f)
 
 
-def _get_builds(s: pd.Series) -> pd.DataFrame:
-    """ Get genome builds for a series of scorefile paths
+def _get_builds(paths: list[str]) -> pl.DataFrame:
+    """ Get genome builds for a list of scorefile paths
         | filename | -> | filename | genome_build |
         | x.txt.gz |    | x.txt.gz | hg19         |
     """
-    return pd.concat([s, s.apply(_read_build).rename("genome_build")], axis=1)
+    return pl.DataFrame({'filename': paths, 'genome_build': [_read_build(x) for x in paths]})
@@ -1,11 +1,11 @@
 import re
 import logging
-import pandas as pd
+import polars as pl
 
 logger = logging.getLogger(__name__)
 
 
-def remap_harmonised(df: pd.DataFrame, use_harmonised) -> pd.DataFrame:
+def remap_harmonised(df: pl.LazyFrame, use_harmonised) -> pl.LazyFrame:
     """ Replace original columns with harmonised data, if available and appropriate """
 
     if any([re.match("hm_\\w+", x) for x in df.columns]) and use_harmonised:
@@ -13,14 +13,28 @@ def remap_harmonised(df: pd.DataFrame, use_harmonised) -> pd.DataFrame:
         hm_colnames: dict[str: str] = {'hm_chr': 'chr_name', 'hm_pos': 'chr_position',
                                        'hm_inferOtherAllele': 'other_allele'}
 
-        if 'other_allele' not in df or all(df['other_allele'].isnull()):
-            logger.debug("other_allele column contains no information, replacing with hm_inferOtherAllele")
-            return (df.drop(['chr_name', 'chr_position', 'other_allele'], axis=1, errors='ignore')
-                    .rename(hm_colnames, axis=1))
+        if 'other_allele' in df.columns and 'hm_inferOtherAllele' in df.columns:
+            # other_allele is only replaced if it contains no information
+            logger.debug("Replacing other_allele with hm_inferOtherAllele if other_allele contains no information")
+            df = df.with_column(pl.when(pl.col('other_allele').is_null().all())
+                                .then(pl.col('hm_inferOtherAllele'))
+                                .otherwise(pl.col('other_allele'))
+                                .alias('hm_inferOtherAllele'))
+
+            drop_other_allele: bool = True
+        elif 'other_allele' in df.columns:
+            # an empty other_allele column is kept (checking would read the scorefile), QC ignores it in identifiers
+            drop_other_allele: bool = False
         else:
-            logger.debug("other_allele column contains information, dropping hm_inferOtherAllele")
-            return (df.drop(['chr_name', 'chr_position', 'hm_inferOtherAllele'], axis=1, errors='ignore')
-                    .rename(hm_colnames, axis=1))
+            drop_other_allele: bool = False
+
+        drop: list[str] = [x for x in ['chr_name', 'chr_position'] if x in df.columns]
+        if drop_other_allele:
+            logger.debug("other_allele column contains no information, replacing with hm_inferOtherAllele")
+            drop.append('other_allele')
+
+        return (df.drop(drop)
+                .rename({k: v for k, v in hm_colnames.items() if k in df.columns}))
     elif any([re.match("hm_\\w+", x) for x in df.columns]) and not use_harmonised:
         logger.debug(f"Harmonised columns detected but not used (use_harmonised={use_harmonised})")
         return df
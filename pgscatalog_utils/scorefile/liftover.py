@@ -1,82 +1,108 @@
-import pandas as pd
-import pyliftover
+import functools
+import numpy as np
+import polars as pl
 import os
 import logging
+from .chain import ChainIndex, load_chain_index, convert_coordinates
 from .genome_build import annotate_build
 
 logger = logging.getLogger(__name__)
 
 
-def liftover(df: pd.DataFrame, chain_dir: str, min_lift: float, target_build: str) -> pd.DataFrame:
-    """ Liftover genomic coordinates to a different genome build """
-    df = annotate_build(df, target_build)  # grab build from scoring file headers
+def liftover(df: pl.LazyFrame, chain_dir: str, min_lift: float, target_build: str) -> pl.LazyFrame:
+    """ Liftover genomic coordinates to a different genome build
 
-    mapped, unmapped = pd.DataFrame(), pd.DataFrame()
-    no_liftover: pd.DataFrame = df.query('target_build == genome_build')
-    to_liftover: pd.DataFrame = df.query('target_build != genome_build')
+    Liftover needs the scorefile in memory, so it's collected once here instead of re-reading it for each step.
+    """
+    collected: pl.DataFrame = annotate_build(df.collect(), target_build)  # grab build from scoring file headers
 
-    if no_liftover.empty:
-        logger.debug("Liftover required for all scorefile variants")
-    else:
-        logger.debug("Skipping liftover for scorefiles with same build as target genome")
-        no_liftover[['lifted_chr', 'lifted_pos']] = no_liftover[['chr_name', 'chr_position']]  # assume col structure
-        no_liftover.assign(liftover=None)
+    no_liftover: pl.DataFrame = (collected.filter(pl.col('target_build') == pl.col('genome_build'))
+                                 .with_columns([pl.col('chr_name').alias('lifted_chr'),
+                                                pl.col('chr_position').alias('lifted_pos')]))  # assume col structure
+    to_liftover: pl.DataFrame = collected.filter(pl.col('target_build') != pl.col('genome_build'))
 
-    if to_liftover.empty:
+    if to_liftover.is_empty():
         logger.debug("Liftover skipped because no variants required it")
-    else:
-        logger.debug("Lifting over scoring files")
-        lo: dict[str, pyliftover.LiftOver] = _create_liftover(chain_dir)
-        to_liftover[['lifted_chr', 'lifted_pos']] = to_liftover.apply(lambda x: _convert_coordinates(x, lo), axis=1)
-        logger.debug("Liftover complete")
+        return no_liftover.lazy()
 
-        mapped: pd.DataFrame = (to_liftover[~to_liftover[['lifted_chr', 'lifted_pos']].isnull().any(axis=1)]
-                                .assign(liftover=True))
-        unmapped: pd.DataFrame = (to_liftover[to_liftover[['lifted_chr', 'lifted_pos']].isnull().any(axis=1)]\
-                                  .assign(liftover=False))
-        _check_min_liftover(mapped, unmapped, min_lift)
+    logger.debug("Lifting over scoring files")
+    builds: list[str] = (to_liftover['genome_build'] + to_liftover['target_build']).unique().to_list()
+    lo: dict[str, ChainIndex] = _create_liftover(chain_dir, builds)
+    lifted: pl.DataFrame = (to_liftover.hstack(_convert_coordinates(to_liftover, lo))
+                            .with_column((pl.col('lifted_chr').is_not_null() & pl.col('lifted_pos').is_not_null())
+                                         .alias('liftover')))
+    logger.debug("Liftover complete")
+    _check_min_liftover(lifted, min_lift)
 
-    return pd.concat([mapped, unmapped, no_liftover])
+    return pl.concat([lifted.filter(pl.col('liftover')),
+                      lifted.filter(~pl.col('liftover')),
+                      no_liftover.with_column(pl.lit(None).cast(pl.Boolean).alias('liftover'))]).lazy()
 
 
-def _check_min_liftover(mapped: pd.DataFrame, unmapped: pd.DataFrame, min_lift: float) -> None:
+def _check_min_liftover(df: pl.DataFrame, min_lift: float) -> None:
     """ Check that liftover process met minimum parameters"""
-    df = pd.concat([mapped, unmapped])
-    n_variants: pd.DataFrame = (pd.DataFrame(df.groupby('accession')['liftover'].count())
-                                .reset_index()
-                                .rename({'liftover': 'n_var'}, axis=1))
-    lo_counts = (pd.DataFrame(df.groupby(['accession', 'liftover'])['liftover'].count())\
-                 .rename_axis(['accession', 'liftover_status'])
-                 .reset_index())
-    summary: pd.DataFrame = lo_counts.merge(n_variants, on='accession')
-    summary['proportion'] = summary['liftover'] / summary['n_var']
-
-    for row in summary.query('liftover_status == True')[['accession', 'proportion']].itertuples():
-        if row.proportion < min_lift:
-            logger.error(f'Liftover failed for scorefile {row.accession}')
-            logger.error(f'{row.proportion} of variants lifted over, less than min_lift parameter ({min_lift})')
+    summary: pl.DataFrame = (df.groupby('accession', maintain_order=True)
+                             .agg(pl.col('liftover').cast(pl.Float64).mean().alias('proportion')))
+
+    for accession, proportion in summary.rows():
+        if proportion < min_lift:
+            logger.error(f'Liftover failed for scorefile {accession}')
+            logger.error(f'{proportion} of variants lifted over, less than min_lift parameter ({min_lift})')
             raise Exception
         else:
-            logger.debug(f'Minimum liftover threshold passed for scorefile {row.accession}')
+            logger.debug(f'Minimum liftover threshold passed for scorefile {accession}')
 
 
-def _convert_coordinates(df: pd.Series, lo_dict: dict[str, pyliftover.LiftOver]) -> pd.Series:
-    """ Convert genomic coordinates to different build """
-    if df[['chr_name', 'chr_position']].isnull().values.any():
-        converted = None
-    else:
-        lo = lo_dict[df['genome_build'] + df['target_build']]  # extract lo object from dict
-        chrom: str = 'chr' + str(df['chr_name'])
-        pos: int = int(df['chr_position']) - 1  # liftOver is 0 indexed, VCF is 1 indexed
-        # converted example: [('chr22', 15460378, '+', 3320966530)] or None
-        converted: list[tuple[str, int, str, int] | None] = lo.convert_coordinate(chrom, pos)
+def _convert_coordinates(df: pl.DataFrame, lo_dict: dict[str, ChainIndex]) -> pl.DataFrame:
+    """ Convert genomic coordinates to different build
 
-    if converted:
-        lifted_chrom: str = _parse_lifted_chrom(converted[0][0][3:])  # return first matching liftover
-        lifted_pos: int = int(converted[0][1]) + 1  # reverse 0 indexing
-        return pd.Series([lifted_chrom, lifted_pos])
-    else:
-        return pd.Series([None, None])
+    Each pair of builds is converted at once. Variants that can't be lifted over have missing coordinates.
+    """
+    lifted_code: np.ndarray = np.full(df.shape[0], -1, dtype=np.int64)  # index of the lifted chromosome name
+    lifted_pos: np.ndarray = np.zeros(df.shape[0], dtype=np.uint64)
+
+    valid: pl.Series = df['chr_name'].is_not_null() & df['chr_position'].is_not_null()
+    # polars can't convert bool to numpy. Series must outlive their numpy views, which don't own their memory
+    valid_int: pl.Series = valid.cast(pl.UInt8)
+    has_coords: np.ndarray = valid_int.to_numpy().astype(bool)
+    build_codes, builds = _factorize(df['genome_build'] + df['target_build'])
+    chrom_codes, chroms = _factorize(df['chr_name'])
+    positions: pl.Series = df['chr_position'].fill_null(0).cast(pl.Int64)
+    chr_position: np.ndarray = positions.to_numpy()
+
+    lifted_names: list[str] = []
+    for code, build in enumerate(builds):
+        rows: np.ndarray = np.flatnonzero(has_coords & (build_codes == code))
+        if rows.size == 0:
+            continue
+        lo: ChainIndex = lo_dict[build]  # extract lo object from dict
+        pos: np.ndarray = chr_position[rows] - 1  # liftOver is 0 indexed
+        converted_chrom, converted_pos = convert_coordinates(lo, chrom_codes[rows], pos,
+                                                             names=['chr' + x for x in chroms])
+
+        ok: np.ndarray = converted_chrom >= 0
+        lifted_code[rows[ok]] = converted_chrom[ok] + len(lifted_names)
+        lifted_pos[rows[ok]] = converted_pos[ok] + 1  # reverse 0 indexing
+        # liftover returns weird chromosomes sometimes, so tidy each chromosome name once
+        lifted_names.extend(_parse_lifted_chrom(x[3:]) for x in lo.target_names)
+
+    names: pl.DataFrame = pl.DataFrame({'lifted_code': np.arange(len(lifted_names), dtype=np.int64),
+                                        'lifted_chr': pl.Series(lifted_names, dtype=pl.Utf8)})
+    return (pl.DataFrame({'lifted_code': lifted_code, 'lifted_pos': lifted_pos})
+            .join(names, on='lifted_code', how='left')
+            .select([pl.col('lifted_chr'), pl.when(pl.col('lifted_code') >= 0).then(pl.col('lifted_pos'))
+                     .otherwise(pl.lit(None)).alias('lifted_pos')]))
+
+
+def _factorize(s: pl.Series) -> tuple[np.ndarray, list[str]]:
+    """ Code each value of a Series by its index in a list of unique values (-1 if missing)
+
+    Only the unique values become python objects, instead of one per row.
+    """
+    levels: pl.DataFrame = s.drop_nulls().unique().sort().to_frame().with_row_count('code')
+    codes: pl.Series = (s.to_frame().join(levels, on=s.name, how='left')['code']
+                        .cast(pl.Int64).fill_null(-1))
+    return codes.to_numpy().copy(), levels[s.name].to_list()  # copy: the numpy view doesn't own its memory
 
 
 def _parse_lifted_chrom(i: str) -> str:
@@ -88,10 +114,15 @@ def _parse_lifted_chrom(i: str) -> str:
     return i.split('_')[0]
 
 
-def _create_liftover(chain_dir: str) -> dict['str': pyliftover.LiftOver]:
-    """ Create LiftOver objects that can remap genomic coordinates """
-    builds: list[str] = ["hg19hg38", "hg38hg19"]
-    chains: list[str] = [os.path.join(chain_dir, x) for x in ["hg19ToHg38.over.chain.gz",  "hg38ToHg19.over.chain.gz"]]
-    lo: list[pyliftover.LiftOver] = [pyliftover.LiftOver(x) for x in chains]
-    logger.debug("Chain files loaded for liftover")
-    return dict(zip(builds, lo))
+def _create_liftover(chain_dir: str, builds: list[str]) -> dict['str': ChainIndex]:
+    """ Load chain indexes that can remap genomic coordinates, only for the requested builds (e.g. hg19hg38) """
+    chains: dict[str, str] = {"hg19hg38": "hg19ToHg38.over.chain.gz", "hg38hg19": "hg38ToHg19.over.chain.gz"}
+    lo: dict[str, ChainIndex] = {x: _load_chain_index(os.path.join(chain_dir, chains[x])) for x in builds}
+    logger.debug(f"Chain files loaded for liftover: {builds}")
+    return lo
+
+
+@functools.cache
+def _load_chain_index(path: str) -> ChainIndex:
+    # streaming mode lifts over one scorefile at a time, so only load each chain index once
+    return load_chain_index(path)
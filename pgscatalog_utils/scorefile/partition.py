@@ -0,0 +1,59 @@
+import json
+import logging
+import os
+
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+_INDEX_VERSION: int = 1  # increment when the index layout changes
+
+
+def partition_scorefile(df: pl.DataFrame) -> pl.DataFrame:
+    """ Sort a combined scorefile by chromosome and position, so variants on the same chromosome are contiguous """
+    return df.sort(['chr_name', 'chr_position'])
+
+
+def write_chrom_index(df: pl.DataFrame, path: str) -> None:
+    """ Write the row offset and number of variants on each chromosome of a partitioned scorefile
+
+    The index is saved next to the scorefile, and records the size of the scorefile so a stale index is ignored
+    """
+    chroms: list[tuple[str, int, int]] = (df.with_row_count()
+                                          .groupby('chr_name')
+                                          .agg([pl.col('row_nr').min().alias('offset'), pl.count().alias('n')])
+                                          .drop_nulls()
+                                          .sort('offset')
+                                          .rows())
+    index: dict = {'version': _INDEX_VERSION, 'n_variants': df.shape[0], 'size': os.path.getsize(path),
+                   'chromosomes': {chrom: [offset, n] for chrom, offset, n in chroms}}
+
+    logger.debug(f"Writing chromosome index {chrom_index_path(path)}")
+    with open(chrom_index_path(path), 'w') as f:
+        json.dump(index, f)
+
+
+def read_chrom_index(path: str, n_variants: int) -> dict[str, tuple[int, int]] | None:
+    """ Read the index of a partitioned scorefile: {chromosome: (row offset, number of variants)}
+
+    Returns None if the scorefile isn't partitioned or the index doesn't match the scorefile
+    """
+    index_path: str = chrom_index_path(path)
+    if not os.path.exists(index_path):
+        logger.debug("Scorefile isn't partitioned by chromosome")
+        return None
+
+    with open(index_path) as f:
+        index: dict = json.load(f)
+
+    if (index.get('version') != _INDEX_VERSION or index['n_variants'] != n_variants or
+            index['size'] != os.path.getsize(path)):
+        logger.warning(f"Chromosome index {index_path} doesn't match scorefile, ignoring it")
+        return None
+
+    logger.debug(f"Scorefile is partitioned by chromosome ({len(index['chromosomes'])} chromosomes)")
+    return {chrom: (offset, n) for chrom, (offset, n) in index['chromosomes'].items()}
+
+
+def chrom_index_path(path: str) -> str:
+    return path + '.idx.json'
@@ -1,85 +1,116 @@
-import pandas as pd
+import functools
+import operator
+import polars as pl
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-def quality_control(df: pd.DataFrame, drop_missing: bool) -> pd.DataFrame:
-    """ Do quality control checks on a scorefile """
-    _check_shape(df)
+def quality_control(df: pl.LazyFrame, drop_missing: bool) -> pl.LazyFrame:
+    """ Do quality control checks on a scorefile
+
+    Every check is counted in one aggregated query (see _qc_stats), so the scorefile is only read once for quality
+    control. Bad variants are then dropped lazily.
+    """
+    assert len(df.columns) > 1, "ERROR: scorefile not formatted correctly (0 columns)"
     _check_columns(df)
     logger.debug("Quality control: checking for bad variants")
+    keep: pl.Expr = (_not_hla() & _not_missing()) if drop_missing else pl.lit(True)
+    stats: dict[str, int | bool] = _qc_stats(df, keep, drop_missing)
+
+    assert stats['n'] > 0, "ERROR: No variants detected in input file (0 rows)"
+    _check_weights(stats)
     if drop_missing is True:
-        return (df.pipe(_drop_hla)
-                .pipe(_drop_missing_variants)
-                .pipe(_check_duplicate_identifiers)
-                .pipe(_drop_multiple_oa))
-    else:
-        return (df.pipe(_check_duplicate_identifiers)
-                .pipe(_drop_multiple_oa))
+        if stats['n_hla'] > 0:
+            logger.debug("HLA alleles detected and dropped")
+        if stats['n_missing'] > 0:
+            logger.warning(f"{stats['n_missing']} variants with missing values detected and dropped from scoring file")
+        df = df.filter(keep)
 
+    _check_duplicate_identifiers(stats)
+    return df.pipe(_drop_multiple_oa)
 
-def _drop_multiple_oa(df: pd.DataFrame) -> pd.DataFrame:
-    """ Set alleles to None in hm_inferOtherAllele if they contain multiple alleles
 
-    e.g. A / C / T -> None; A -> A; A / C -> None
-    """
-    if 'other_allele' in df:
-        if df['other_allele'].str.contains('/').any():
-            logger.debug("Multiple inferred other alleles detected, dropping other alleles for ambiguous variants")
-            df['other_allele'] = df['other_allele'].replace(regex='.+\\/.+', value=None)
-            return df
-        else:
-            logger.debug("Only single other alleles detected.")
-            return df
-    else:
-        logger.warning("No other allele data detected, skipping QC of other allele")
-        return df
+def _qc_stats(df: pl.LazyFrame, keep: pl.Expr, drop_missing: bool) -> dict[str, int | bool]:
+    """ Count variants, bad variants, and duplicated variants that are kept, with one collect """
+    weight_cols: list[str] = [x for x in df.columns if x == 'effect_weight' or x.startswith('effect_weight_')]
+    has_other_allele: bool = 'other_allele' in df.columns
+    identifier: list[str] = ['chr_name', 'chr_position', 'effect_allele']
 
+    counts: list[pl.Expr] = [pl.count().alias('n'), _n_duplicated(keep, identifier).alias('n_duplicated')]
+    counts += [_n_bad_weights(x).alias(f'n_bad_{x}') for x in weight_cols]
+    if drop_missing:
+        counts += [(~_not_hla()).sum().alias('n_hla'), (_not_hla() & ~_not_missing()).sum().alias('n_missing')]
+    if has_other_allele:
+        counts += [_n_duplicated(keep, identifier + ['other_allele']).alias('n_duplicated_oa'),
+                   pl.col('other_allele').is_null().all().alias('other_allele_missing')]
 
-def _drop_missing_variants(df: pd.DataFrame) -> pd.DataFrame:
-    no_na: pd.DataFrame = df.dropna(subset=['chr_name', 'chr_position', 'effect_weight'])
-    n_dropped = df.shape[0] - no_na.shape[0]
+    stats: dict[str, int | bool] = df.select(counts).collect().to_dicts()[0]
+    stats['n_bad_weights'] = sum(stats[f'n_bad_{x}'] for x in weight_cols)
+    stats['has_other_allele'] = has_other_allele
+    return stats
 
-    if n_dropped > 0:
-        logger.warning(f"{n_dropped} variants with missing values detected and dropped from scoring file")
 
-    return no_na
+def _not_hla() -> pl.Expr:
+    """ HLA effect alleles with present / absent encoding """
+    return ((pl.col('effect_allele') != "P") | (pl.col('effect_allele') != "N")).fill_null(True)
 
 
-def _drop_hla(df: pd.DataFrame) -> pd.DataFrame:
-    """ Drop HLA effect alleles with present / absent encoding """
+def _not_missing() -> pl.Expr:
+    return _all_not_null(['chr_name', 'chr_position', 'effect_weight'])
 
-    no_hla: pd.DataFrame = df.query('effect_allele != "P" | effect_allele != "N"')
 
-    if df.shape[0] > no_hla.shape[0]:
-        logger.debug("HLA alleles detected and dropped")
+def _n_duplicated(keep: pl.Expr, identifier: list[str]) -> pl.Expr:
+    """ Count kept variants with the same identifier as another kept variant. Missing identifiers are unique """
+    identified: pl.Expr = keep & _all_not_null(identifier)
+    return (identified & (identified.cast(pl.UInt32).sum().over(identifier) > 1)).sum()
 
-    return no_hla
 
+def _all_not_null(cols: list[str]) -> pl.Expr:
+    # not pl.all: folds can't be used in window expressions
+    return functools.reduce(operator.and_, [pl.col(x).is_not_null() for x in cols])
 
-def _check_duplicate_identifiers(df: pd.DataFrame) -> pd.DataFrame:
-    if 'other_allele' in df:
-        logger.debug("Other allele column detected, including other_allele in variant identifier")
-        group_cols = ['chr_name', 'chr_position', 'effect_allele', 'other_allele']
-    else:
-        logger.warning("Other allele column not detected, dropping other_allele from variant identifier.")
-        group_cols = ['chr_name', 'chr_position', 'effect_allele']
 
-    unique: pd.Series = df.groupby(group_cols).size() == 1
+def _n_bad_weights(col: str) -> pl.Expr:
+    return (pl.col(col).is_not_null() & pl.col(col).cast(pl.Float64, strict=False).is_null()).sum()
 
-    if unique.all():
-        return df
+
+def _drop_multiple_oa(df: pl.LazyFrame) -> pl.LazyFrame:
+    """ Set alleles to None in hm_inferOtherAllele if they contain multiple alleles
+
+    e.g. A / C / T -> None; A -> A; A / C -> None
+    """
+    if 'other_allele' in df.columns:
+        logger.debug("Dropping other alleles for ambiguous variants (multiple inferred other alleles)")
+        return df.with_column(pl.when(pl.col('other_allele').str.contains('.+/.+'))
+                              .then(pl.lit(None))
+                              .otherwise(pl.col('other_allele'))
+                              .alias('other_allele'))
     else:
-        raise Exception("Duplicate variants in scoring file")
+        logger.warning("No other allele data detected, skipping QC of other allele")
+        return df
 
 
-def _check_shape(df: pd.DataFrame) -> None:
-    assert len(df.columns) > 1, "ERROR: scorefile not formatted correctly (0 columns)"
-    assert df.shape[0] > 0, "ERROR: No variants detected in input file (0 rows)"
+def _check_weights(stats: dict[str, int | bool]) -> None:
+    """ Effect weights are written out as they were read, so check they're numbers """
+    if stats['n_bad_weights'] > 0:
+        raise Exception(f"{stats['n_bad_weights']} effect weights in scoring file aren't numbers")
 
 
-def _check_columns(df: pd.DataFrame) -> None:
-    assert {'chr_name', 'chr_position'}.issubset(df.columns), "If you're using rsids did you request harmonised data?"
-    assert 'effect_allele' in df, "ERROR: Missing effect allele column"
+def _check_duplicate_identifiers(stats: dict[str, int | bool]) -> None:
+    # an other_allele column without any alleles (e.g. a harmonised file without hm_inferOtherAllele) can't identify
+    # variants, so it's treated like a missing column
+    if stats['has_other_allele'] and not stats['other_allele_missing']:
+        logger.debug("Other allele column detected, including other_allele in variant identifier")
+        n_duplicated: int = stats['n_duplicated_oa']
+    else:
+        logger.warning("Other allele column not detected, dropping other_allele from variant identifier.")
+        n_duplicated: int = stats['n_duplicated']
 
+    if n_duplicated > 0:
+        raise Exception("Duplicate variants in scoring file")
+
+
+def _check_columns(df: pl.LazyFrame) -> None:
+    assert {'chr_name', 'chr_position'}.issubset(df.columns), "If you're using rsids did you request harmonised data?"
+    assert 'effect_allele' in df.columns, "ERROR: Missing effect allele column"
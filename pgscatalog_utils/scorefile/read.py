@@ -1,5 +1,5 @@
 import os
-import pandas as pd
+import polars as pl
 import logging
 from .harmonised import remap_harmonised
 from .qc import quality_control
@@ -7,23 +7,51 @@ from .qc import quality_control
 logger = logging.getLogger(__name__)
 
 
-def load_scorefile(path: str, use_harmonised: bool = True, drop_missing: bool = False) -> pd.DataFrame:
+def load_scorefile(path: str, use_harmonised: bool = True, drop_missing: bool = False) -> pl.LazyFrame:
     logger.debug(f'Reading scorefile {path}')
-    return (pd.read_table(path, dtype=_scorefile_dtypes(), comment='#', na_values=['None'], low_memory=False)
+    return (_scan_text(path)
+            .pipe(_cast_dtypes)
             .pipe(remap_harmonised, use_harmonised=use_harmonised)
-            .assign(filename_prefix=_get_basename(path),
-                    filename=path)
+            .with_columns([pl.lit(_get_basename(path)).alias('filename_prefix'),
+                           pl.lit(path).alias('filename')])
             .pipe(quality_control, drop_missing=drop_missing))
 
 
+def _scan_text(path: str) -> pl.LazyFrame:
+    """ Read everything as strings (no schema inference)
+
+    Uncompressed scorefiles are scanned, so only the columns and rows that are used are parsed. polars can't scan
+    gzipped files, so they're read eagerly.
+    """
+    options: dict = {'sep': '\t', 'comment_char': '#', 'null_values': _null_values(), 'infer_schema_length': 0}
+    with open(path, 'rb') as f:
+        compressed: bool = f.read(2) == b'\x1f\x8b'  # gzip magic number
+
+    if compressed:
+        return pl.read_csv(path, **options).lazy()
+    else:
+        return pl.scan_csv(path, **options)
+
+
 def _scorefile_dtypes() -> dict[str]:
-    """ Data types for columns that might be found in a scorefile """
-    return {'rsID': str, 'chr_name': str, 'chr_position': pd.UInt64Dtype(), 'effect_allele': 'str',
-            'effect_weight': float, 'locus_name': str, 'OR': float, 'hm_source': str, 'hm_rsID': str,
-            'hm_chr': str, 'hm_pos': pd.UInt64Dtype(), 'hm_inferOtherAllele': str}
+    """ Data types for columns that might be found in a scorefile. Other columns are strings
+
+    Effect weights stay strings, so they're written out exactly as they were read (see qc._check_weights)
+    """
+    return {'chr_position': pl.UInt64, 'OR': pl.Float64, 'hm_pos': pl.UInt64}
+
+
+def _cast_dtypes(df: pl.LazyFrame) -> pl.LazyFrame:
+    dtypes: dict[str] = _scorefile_dtypes()
+    return df.with_columns([pl.col(x).cast(dtypes[x]) for x in df.columns if x in dtypes])
+
+
+def _null_values() -> list[str]:
+    """ Missing value markers (the same strings pandas treats as missing) """
+    return ['None', '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+            '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'n/a', 'nan', 'null']
 
 
 def _get_basename(path: str) -> str:
     """ Return the basename of a scoring file without extension """
     return os.path.basename(path).split('.')[0]
-
@@ -1,34 +1,84 @@
-import pandas as pd
+import gzip
+import os
+import polars as pl
 import logging
-import sqlite3
+from typing import BinaryIO
+from .partition import partition_scorefile, write_chrom_index, chrom_index_path
 
 logger = logging.getLogger(__name__)
 
 
-def write_scorefile(df: pd.DataFrame, path: str) -> None:
-    cols: list[str] = ['chr_name', 'chr_position', 'effect_allele', 'other_allele', 'effect_weight', 'effect_type',
-                       'accession']
+def write_scorefile(df: pl.LazyFrame, path: str, partition: bool = False) -> None:
+    out_df: pl.DataFrame = _format_output(df)
 
-    if df.empty:
+    if out_df.is_empty():
         logger.error("Empty scorefile output! Please check the input data")
         raise Exception
+
+    if partition:
+        logger.debug("Partitioning combined scorefile by chromosome")
+        out_df = partition_scorefile(out_df)
+
+    if os.path.exists(chrom_index_path(path)):
+        os.remove(chrom_index_path(path))  # an index of an old scorefile
+
+    match scorefile_format(path):
+        case 'parquet':
+            logger.debug("Writing out combined scorefile in Parquet format")
+            _typed_output(out_df).write_parquet(path)
+        case 'ipc':
+            logger.debug("Writing out combined scorefile in Arrow IPC format")
+            _typed_output(out_df).write_ipc(path)
+        case _:
+            logger.debug("Writing out combined scorefile")
+            with open_scorefile(path, compress=path.endswith('.gz')) as f:
+                out_df.write_csv(f, sep="\t")
+
+    if partition:
+        write_chrom_index(out_df, path)
+
+
+def append_scorefile(df: pl.LazyFrame, f: BinaryIO, header: bool) -> int:
+    """ Append variants to an open combined scorefile, returning the number of variants written """
+    out_df: pl.DataFrame = _format_output(df)
+    out_df.write_csv(f, sep="\t", has_header=header)
+    return out_df.shape[0]
+
+
+def scorefile_format(path: str) -> str:
+    """ Combined scorefiles are text (TSV) unless the path has a Parquet or Arrow IPC extension """
+    if path.endswith('.parquet'):
+        return 'parquet'
+    elif path.endswith(('.arrow', '.ipc')):
+        return 'ipc'
     else:
-        logger.debug("Writing out combined scorefile")
-        out_df: pd.DataFrame = (df.drop('accession', axis=1)
-                                .rename({'filename_prefix': 'accession'}, axis=1)
-                                .pipe(_filter_failed_liftover))
+        return 'text'
+
 
-        if 'other_allele' not in out_df:
-            logger.warning("No other allele information detected, writing out as missing data")
-            out_df['other_allele'] = None
+def open_scorefile(path: str, compress: bool) -> BinaryIO:
+    """ Open a combined scorefile for writing, optionally gzip compressed """
+    if compress:
+        return gzip.open(path, 'wb', compresslevel=6)
+    else:
+        return open(path, 'wb')
 
-        out_df[cols].to_csv(path, index=False, sep="\t")
 
+def _format_output(df: pl.LazyFrame) -> pl.DataFrame:
+    cols: list[str] = ['chr_name', 'chr_position', 'effect_allele', 'other_allele', 'effect_weight', 'effect_type',
+                       'accession']
+    return df.pipe(_filter_failed_liftover).select(cols).collect()
 
-def _filter_failed_liftover(df: pd.DataFrame) -> pd.DataFrame:
-    if 'liftover' in df:
+
+def _typed_output(df: pl.DataFrame) -> pl.DataFrame:
+    """ Columnar scorefiles store repetitive string columns as categoricals (dictionary encoded) """
+    return df.with_columns([pl.col('chr_position').cast(pl.UInt64), pl.col('effect_weight').cast(pl.Float64),
+                            pl.col(['effect_allele', 'other_allele', 'effect_type', 'accession']).cast(pl.Categorical)])
+
+
+def _filter_failed_liftover(df: pl.LazyFrame) -> pl.LazyFrame:
+    if 'liftover' in df.columns:
         logger.debug("Filtering variants that failed liftover")
-        return df.query('liftover == True')
+        # variants that were already in the target build have missing liftover status
+        return df.filter(pl.col('liftover').fill_null(True))
     else:
         return df
-
@@ -0,0 +1,100 @@
+import gzip
+import os
+
+import numpy as np
+import polars as pl
+import pyliftover
+import pytest
+
+from pgscatalog_utils.scorefile.chain import read_chain_file, convert_coordinates, load_chain_index
+from pgscatalog_utils.scorefile.liftover import _convert_coordinates
+
+
+def test_chain_index(chain_file):
+    # every position should map exactly like pyliftover (best scoring chain, strand, gaps, unknown chromosomes)
+    lo = pyliftover.LiftOver(chain_file)
+    index = read_chain_file(chain_file)
+
+    chrom = np.array(['chr1'] * 120 + ['chr2'] * 120 + ['chr3'] * 10)
+    pos = np.concatenate([np.arange(120), np.arange(120), np.arange(10)])
+    lifted_chrom, lifted_pos = convert_coordinates(index, chrom, pos)
+
+    for c, p, lc, lp in zip(chrom, pos, lifted_chrom, lifted_pos):
+        expected = lo.convert_coordinate(c, int(p))
+        if expected:
+            assert (index.target_names[lc], lp) == expected[0][:2]
+        else:
+            assert lc == -1
+
+
+
+def test_convert_coordinate_codes(chain_file):
+    # chromosomes coded by their index in a list of names convert like the names themselves
+    index = read_chain_file(chain_file)
+    names = ['chr2', 'chr1', 'chrX']
+    codes = np.array([1, 0, -1, 2, 1, 0])
+    pos = np.array([15, 20, 5, 5, 45, 99])
+
+    chrom = np.array([names[x] if x >= 0 else 'chrUn' for x in codes])
+    by_name = convert_coordinates(index, chrom, pos)
+    by_code = convert_coordinates(index, codes, pos, names=names)
+    assert all((x == y).all() for x, y in zip(by_name, by_code))
+
+
+def test_convert_scorefile_coordinates(chain_file):
+    lo = pyliftover.LiftOver(chain_file)
+    df = pl.DataFrame({'chr_name': ['1', '2', None, '1', '3', '1'], 'chr_position': [21, 16, 5, None, 5, 46],
+                       'genome_build': ['hg19'] * 6, 'target_build': ['hg38'] * 6})
+    lifted = _convert_coordinates(df, {'hg19hg38': read_chain_file(chain_file)})
+
+    for chrom, pos, lifted_chrom, lifted_pos in zip(df['chr_name'], df['chr_position'], lifted['lifted_chr'],
+                                                    lifted['lifted_pos']):
+        expected = lo.convert_coordinate(f"chr{chrom}", pos - 1) if chrom and pos else None
+        if expected:
+            assert (lifted_chrom, lifted_pos) == (expected[0][0][3:].split('_')[0], expected[0][1] + 1)
+        else:
+            assert lifted_chrom is None and lifted_pos is None
+
+def test_saved_chain_index(chain_file):
+    index = read_chain_file(chain_file)
+    built = load_chain_index(chain_file)
+    assert os.path.exists(chain_file + '.idx.npz')
+    loaded = load_chain_index(chain_file)
+
+    for x in [built, loaded]:
+        assert x.source_names == index.source_names and x.target_names == index.target_names
+        assert all((getattr(x, k) == getattr(index, k)).all() for k in ['breakpoints', 'shift', 'target', 'minus'])
+
+    # a changed chain file invalidates the saved index
+    with gzip.open(chain_file, 'wt') as f:
+        f.write('chain 1 chr9 100 + 0 10 chr9 100 + 0 10 1\n10\n')
+    assert load_chain_index(chain_file).source_names == ['chr9']
+
+
+def test_unreadable_chain_index(chain_file):
+    # e.g. a partial index, left by an interrupted job
+    with open(chain_file + '.idx.npz', 'wb') as f:
+        f.write(b'PK\x03\x04')
+    index = load_chain_index(chain_file)
+    assert index.source_names == read_chain_file(chain_file).source_names
+    assert load_chain_index(chain_file).source_names == index.source_names
+    assert [x for x in os.listdir(os.path.dirname(chain_file)) if x.endswith('.tmp')] == []
+
+
+@pytest.fixture
+def chain_file(tmp_path):
+    # chain 2 overlaps chain 1 but has a lower score, and maps to the negative strand of an alt contig
+    chains = '''chain 1000 chr1 1000 + 10 60 chr1 2000 + 100 160 1
+20 5 15
+25
+
+chain 500 chr1 1000 + 40 90 chr5_KI270879v1_alt 500 - 10 60 2
+50
+
+chain 2000 chr2 500 + 0 100 chr2 600 + 50 150 3
+100
+'''
+    path = tmp_path / "test.over.chain.gz"
+    with gzip.open(path, 'wt') as f:
+        f.write(chains)
+    return str(path.resolve())
@@ -1,8 +1,16 @@
+import gzip
+import os
+from unittest.mock import patch
+
 import pandas as pd
+import polars as pl
 import pytest
 import jq
 
 from pgscatalog_utils.download.score import query_score
+from pgscatalog_utils.scorefile.combine_scorefiles import combine_scorefiles, _read_and_melt, _read_scorefiles
+from pgscatalog_utils.scorefile.qc import quality_control
+from pgscatalog_utils.scorefile.read import load_scorefile
 
 
 def test_combine_scorefiles(combined_scorefile, _n_variants):
@@ -17,6 +25,123 @@ def test_liftover(lifted_scorefiles):
     assert df.shape[0] > 50000  # approx size
 
 
+def test_multiple_weights(multiple_weight_scorefile):
+    df: pl.DataFrame = _read_and_melt(multiple_weight_scorefile).collect()
+    assert df.shape[0] == 4
+    assert df['accession'].to_list() == ['PGS1', 'PGS1', 'PGS2', 'PGS2']
+    assert df['chr_position'].to_list() == [100, 200, 100, 200]
+    assert df['effect_weight'].to_list() == ['0.5', '-1', '2e-05', '1e16']  # written out as they were read
+
+
+def test_read_scorefiles(small_scorefiles, multiple_weight_scorefile, tmp_path, caplog):
+    paths: list[str] = small_scorefiles
+    serial: pl.DataFrame = _read_scorefiles(paths + [multiple_weight_scorefile]).collect()
+    parallel: pl.DataFrame = _read_scorefiles(paths + [multiple_weight_scorefile], workers=3).collect()
+    assert parallel.frame_equal(serial)
+    assert parallel['accession'].to_list() == ['PGS0', 'PGS1', 'PGS2', 'PGS3', 'PGS1', 'PGS1', 'PGS2', 'PGS2']
+
+    bad_paths: list[str] = [str(tmp_path / "missing.txt"), str(tmp_path / "empty.txt")]
+    open(bad_paths[1], 'w').close()
+    with pytest.raises(Exception, match="2 scorefile"):
+        _read_scorefiles(bad_paths + paths, workers=2)
+    assert all(x in caplog.text for x in bad_paths)
+
+
+def test_stream_combine(small_scorefiles, multiple_weight_scorefile, tmp_path):
+    paths: list[str] = small_scorefiles + [multiple_weight_scorefile]
+    out_path, stream_path = str(tmp_path / "combined.txt"), str(tmp_path / "streamed.txt.gz")
+
+    with patch('sys.argv', ['combine_scorefiles', '-s'] + paths + ['-o', out_path]):
+        combine_scorefiles()
+    with patch('sys.argv', ['combine_scorefiles', '-s'] + paths + ['--stream', '-o', stream_path]):
+        combine_scorefiles()
+
+    with gzip.open(stream_path, 'rt') as f, open(out_path) as g:
+        assert sorted(f.read().splitlines()) == sorted(g.read().splitlines())
+
+
+def test_stream_empty(tmp_path):
+    path = tmp_path / "PGS000001.txt"
+    with open(path, 'w') as f:
+        f.write('chr_name\tchr_position\teffect_allele\teffect_weight\n')
+        f.write('1\t\tA\t1\n')  # dropped because position is missing
+
+    out_path = tmp_path / "streamed.txt"
+    with patch('sys.argv', ['combine_scorefiles', '-s', str(path), '--drop_missing', '--stream', '-o', str(out_path)]):
+        with pytest.raises(Exception):
+            combine_scorefiles()
+    assert set(os.listdir(tmp_path)) == {path.name}
+
+
+def test_weights_verbatim(tmp_path):
+    path = tmp_path / "PGS000001.txt"
+    weights: list[str] = ['1e-07', '0.00001', '3', '-2.50', '1E10']
+    with open(path, 'w') as f:
+        f.write('chr_name\tchr_position\teffect_allele\teffect_weight\n')
+        f.writelines(f'1\t{i + 1}\tA\t{x}\n' for i, x in enumerate(weights))
+
+    out_path = tmp_path / "combined.txt"
+    with patch('sys.argv', ['combine_scorefiles', '-s', str(path), '-o', str(out_path)]):
+        combine_scorefiles()
+    assert pl.read_csv(out_path, sep='\t', infer_schema_length=0)['effect_weight'].to_list() == weights
+
+    with open(path, 'a') as f:
+        f.write('1\t100\tA\tbad\n')
+    with pytest.raises(Exception, match="1 effect weights"):
+        load_scorefile(str(path))
+
+
+def test_quality_control(tmp_path):
+    path = tmp_path / "PGS000001.txt"
+    with open(path, 'w') as f:
+        f.write('chr_name\tchr_position\teffect_allele\tother_allele\teffect_weight\n')
+        f.write('1\t1\tA\t\t1\n1\t\tA\t\t1\n1\t2\tA\t\t\n1\t3\tA\t\t1\n')
+    df: pl.LazyFrame = pl.scan_csv(path, sep='\t', infer_schema_length=0)
+
+    with patch.object(pl.LazyFrame, 'collect', autospec=True, side_effect=pl.LazyFrame.collect) as collect:
+        checked: pl.LazyFrame = quality_control(df, drop_missing=True)
+    assert collect.call_count == 1  # every check is counted in one query
+    assert checked.collect()['chr_position'].to_list() == ['1', '3']
+
+    with open(path, 'a') as f:
+        f.write('1\t3\tA\t\t2\n')  # an empty other_allele column doesn't identify variants
+    with pytest.raises(Exception, match="Duplicate variants"):
+        quality_control(pl.scan_csv(path, sep='\t', infer_schema_length=0), drop_missing=True)
+
+
+def test_load_compressed(multiple_weight_scorefile, tmp_path):
+    gz_path = tmp_path / "multiple.txt.gz"
+    with open(multiple_weight_scorefile, 'rb') as f, gzip.open(gz_path, 'wb') as g:
+        g.write(f.read())
+
+    plain: pl.DataFrame = load_scorefile(multiple_weight_scorefile).drop(['filename']).collect()
+    compressed: pl.DataFrame = load_scorefile(str(gz_path)).drop(['filename']).collect()
+    assert compressed.frame_equal(plain, null_equal=True)
+
+
+@pytest.fixture
+def small_scorefiles(tmp_path):
+    paths: list[str] = []
+    for i in range(4):
+        path = tmp_path / f"PGS{i}.txt"
+        with open(path, 'w') as f:
+            f.write('chr_name\tchr_position\teffect_allele\teffect_weight\n')
+            f.write(f'1\t{i + 1}\tA\t{i}\n')
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture
+def multiple_weight_scorefile(tmp_path):
+    path = tmp_path / "multiple.txt"
+    with open(path, 'w') as f:
+        f.write('#genome_build=GRCh37\n')
+        f.write('chr_name\tchr_position\teffect_allele\teffect_weight_PGS1\teffect_weight_PGS2\n')
+        f.write('1\t100\tA\t0.5\t2e-05\n')
+        f.write('1\t200\tC\t-1\t1e16\n')
+    return str(path)
+
+
 @pytest.fixture
 def _n_variants(pgs_accessions):
     json = query_score(pgs_accessions)
@@ -1,11 +1,16 @@
+import http.server
 import os
+import threading
 import pytest
 from unittest.mock import patch
+from urllib.error import HTTPError
 
 from pgscatalog_utils.download.trait import query_trait
 from pgscatalog_utils.download.publication import query_publication
 from pgscatalog_utils.download.score import get_url
 from pgscatalog_utils.download.download_scorefile import download_scorefile
+from pgscatalog_utils.download.transfer import download_file, download_files
+from pgscatalog_utils.download import api
 
 
 @pytest.fixture(params=[["PGS000001"], ["PGS000001", "PGS000802"]])
@@ -49,3 +54,202 @@ def test_query_publication():
 def test_query_trait():
     # new scores may be added to traits in the future
     assert {'PGS001901', 'PGS002115'}.issubset(set(query_trait("EFO_0004329")))
+
+
+def test_download_retry(file_server, tmp_path):
+    # the first response is cut short, so the download is retried and resumed from the partial file
+    url, requests = file_server
+    path = str(tmp_path / "flaky.txt.gz")
+    download_file(url + '/flaky', path, retries=2, backoff=0)
+
+    with open(path, 'rb') as f:
+        assert f.read() == _DATA
+    assert not os.path.exists(path + '.part')
+    assert requests[-1] == ('/flaky', f'bytes={len(_DATA) // 2}-')
+
+
+
+def test_download_not_found(file_server, tmp_path):
+    # a missing file fails immediately, instead of waiting to retry
+    url, requests = file_server
+    with pytest.raises(HTTPError):
+        download_file(url + '/missing', str(tmp_path / "missing.txt.gz"), retries=3, backoff=60)
+    assert requests == [('/missing', None)]
+
+def test_download_resume(file_server, tmp_path):
+    url, requests = file_server
+    path = str(tmp_path / "resume.txt.gz")
+    with open(path + '.part', 'wb') as f:
+        f.write(_DATA[:10])
+
+    download_file(url + '/ok', path, retries=0)
+    with open(path, 'rb') as f:
+        assert f.read() == _DATA
+    assert requests == [('/ok', 'bytes=10-')]
+
+
+def test_download_ftp_resume(ftp_server, tmp_path):
+    path = str(tmp_path / "resume.txt.gz")
+    with open(path + '.part', 'wb') as f:
+        f.write(_DATA[:10])
+
+    download_file('ftp://example.com/ok', path, retries=0)
+    with open(path, 'rb') as f:
+        assert f.read() == _DATA
+    assert ftp_server == [('/ok', 10)]
+
+
+def test_download_ftp_retry(ftp_server, tmp_path):
+    # the first transfer is cut short, so the download is retried and resumed with REST
+    path = str(tmp_path / "flaky.txt.gz")
+    download_file('ftp://example.com/flaky', path, retries=2, backoff=0)
+
+    with open(path, 'rb') as f:
+        assert f.read() == _DATA
+    assert not os.path.exists(path + '.part')
+    assert ftp_server == [('/flaky', None), ('/flaky', len(_DATA) // 2)]
+
+
+def test_download_ftp_restart(ftp_server, tmp_path):
+    # a partial download bigger than the remote file can't be resumed
+    path = str(tmp_path / "restart.txt.gz")
+    with open(path + '.part', 'wb') as f:
+        f.write(_DATA + b'extra')
+
+    download_file('ftp://example.com/ok', path, retries=0)
+    with open(path, 'rb') as f:
+        assert f.read() == _DATA
+    assert ftp_server == [('/ok', None)]
+
+
+def test_download_failures(file_server, tmp_path):
+    url, _ = file_server
+    urls = {str(tmp_path / "ok.txt.gz"): url + '/ok', str(tmp_path / "missing.txt.gz"): url + '/missing'}
+
+    with pytest.raises(Exception):
+        download_files(urls, workers=2, retries=1, backoff=0)
+    assert os.listdir(tmp_path) == ['ok.txt.gz']  # other downloads finish before failures are reported
+
+
+def test_api_cache(tmp_path):
+    class Response:
+        ok = True
+
+        def json(self):
+            return {'associated_pgs_ids': ['PGS000001']}
+
+    with patch.object(api, '_get_session') as session:
+        session.return_value.get.return_value = Response()
+        api.set_cache(str(tmp_path), ttl=3600)
+        try:
+            assert api.get_json('https://example.com/a') == api.get_json('https://example.com/a')
+            assert session.return_value.get.call_count == 1  # second response is cached
+
+            api.set_cache(str(tmp_path), ttl=-1)  # everything is expired
+            api.get_json('https://example.com/a')
+            assert session.return_value.get.call_count == 2
+        finally:
+            api.set_cache(None, ttl=0)
+
+
+
+def test_api_error(tmp_path):
+    class Response:
+        ok = False
+        status_code = 502
+
+        def json(self):
+            raise ValueError("an HTML error page isn't JSON")
+
+    with patch.object(api, '_get_session') as session:
+        session.return_value.get.return_value = Response()
+        api.set_cache(str(tmp_path), ttl=3600)
+        try:
+            with pytest.raises(Exception, match='^$'):  # the status is logged, not a JSON decoding error
+                api.get_json('https://example.com/a')
+            assert os.listdir(tmp_path) == []
+        finally:
+            api.set_cache(None, ttl=0)
+
+
+def test_api_cache_write_failure(tmp_path):
+    # a failed write doesn't leave a partial response (or temporary file) in the cache
+    api.set_cache(str(tmp_path), ttl=3600)
+    try:
+        with patch('json.dump', side_effect=OSError):
+            with pytest.raises(OSError):
+                api._write_cache('https://example.com/a', {'a': 1})
+        assert os.listdir(tmp_path) == []
+    finally:
+        api.set_cache(None, ttl=0)
+
+_DATA: bytes = bytes(range(256)) * 64
+
+
+@pytest.fixture
+def file_server():
+    """ A local HTTP server that supports range requests. The first request to /flaky is interrupted """
+    requests = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append((self.path, self.headers.get('Range')))
+            if self.path not in ['/ok', '/flaky']:
+                self.send_error(404)
+                return
+            start = int(self.headers['Range'][6:-1]) if self.headers.get('Range') else 0
+            self.send_response(206 if start else 200)
+            self.send_header('Content-Length', str(len(_DATA) - start))
+            self.end_headers()
+            if self.path == '/flaky' and len(requests) == 1:
+                self.wfile.write(_DATA[:len(_DATA) // 2])  # then close the connection early
+            else:
+                self.wfile.write(_DATA[start:])
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}', requests
+    server.shutdown()
+
+
+@pytest.fixture
+def ftp_server():
+    """ A fake ftplib.FTP that serves _DATA. The first transfer of /flaky is interrupted """
+    transfers = []
+
+    class FTP:
+        def __init__(self, timeout=None):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def connect(self, host, port):
+            assert (host, port) == ('example.com', 21)
+
+        def login(self, user, password):
+            pass
+
+        def voidcmd(self, cmd):
+            assert cmd == 'TYPE I'
+
+        def size(self, path):
+            return len(_DATA)
+
+        def retrbinary(self, cmd, callback, rest=None):
+            path = cmd.removeprefix('RETR ')
+            transfers.append((path, rest))
+            start = rest or 0
+            if path == '/flaky' and len(transfers) == 1:
+                callback(_DATA[start:len(_DATA) // 2])  # then close the connection early, without an error
+            else:
+                callback(_DATA[start:])
+
+    with patch('ftplib.FTP', FTP):
+        yield transfers
@@ -1,11 +1,25 @@
+import gzip
 import os
+from glob import glob
 from unittest.mock import patch
+import numpy as np
 import polars as pl
 import pytest
 
-from pgscatalog_utils.match.match import get_all_matches, _cast_categorical
-from pgscatalog_utils.match.match_variants import match_variants
+from pgscatalog_utils.match.match import get_all_matches, check_match_rate, _cast_categorical, _match_variants, \
+    _match_strategies
+from pgscatalog_utils.match.encode import using_string_cache, chrom_codes
+from pgscatalog_utils.match.cache import match_cache_keys
+from pgscatalog_utils.match.merge import merge_join, sort_scorefile
+from pgscatalog_utils.match.match_variants import match_variants, _match_scorefile
+from pgscatalog_utils.match.postprocess import _get_distinct_weights
+from pgscatalog_utils.match.sparse import read_sparse_weights, write_sparse_weights
+from pgscatalog_utils.match.write import _write_scorefile, sparse_weights_path
 from pgscatalog_utils.match.preprocess import complement_valid_alleles
+from pgscatalog_utils.match.read import read_target, read_target_batches, read_target_chroms, read_scorefile, \
+    _detect_target_format, _target_projection, _parse_target_batches
+from pgscatalog_utils.scorefile.partition import read_chrom_index
+from pgscatalog_utils.scorefile.write import write_scorefile
 
 
 def test_match_fail(combined_scorefile, target_path, tmp_path):
@@ -88,6 +102,387 @@ def test_flip_match(small_flipped_scorefile, small_target):
     assert not flip_ambig['match_type'].str.contains('flip').any()  # no flip matches for ambiguous
 
 
+def test_single_pass_strategies(small_scorefile, small_target):
+    scorefile, target = _cast_cat(small_scorefile, small_target)
+
+    # 2:2:T:A is ambiguous, so one candidate pair satisfies two strategies
+    df = _match_variants(scorefile, target, _match_strategies(skip_flip=False))
+    ambiguous = df.filter(pl.col('ID') == '2:2:T:A')
+    assert set(ambiguous['match_type'].to_list()) == {'altref', 'refalt_flip'}
+    assert ambiguous.filter(pl.col('match_type') == 'refalt_flip')['matched_effect_allele'].to_list() == ['T']
+
+    no_flip = _match_variants(scorefile, target, _match_strategies(skip_flip=True))
+    assert not no_flip['match_type'].str.contains('flip').any()
+
+
+def test_encoded_match(small_scorefile, small_target):
+    strategies: list[str] = _match_strategies(skip_flip=False)
+    with pl.StringCache():
+        assert using_string_cache()
+        scorefile, target = _cast_categorical(small_scorefile.with_column(pl.col('chr_name').cast(str)),
+                                              small_target.with_column(pl.col('#CHROM').cast(str)))
+        encoded = _match_variants(scorefile, target, strategies)
+        strings = _match_variants(scorefile.with_columns(pl.col(['effect_allele', 'other_allele']).cast(str)), target,
+                                  strategies)
+        assert encoded.select(['ID', 'match_type']).frame_equal(strings.select(['ID', 'match_type']))
+    assert not using_string_cache()
+
+
+def test_encoded_match_large_string_cache(small_scorefile, small_target):
+    # variant keys must be exact even if chromosome strings have big categorical codes
+    strategies: list[str] = _match_strategies(skip_flip=False)
+    scorefile = small_scorefile.with_columns([pl.col('chr_name').cast(str), pl.lit(100).alias('chr_position')])
+    target = small_target.with_columns([pl.col('#CHROM').cast(str), pl.lit(101).alias('POS'),
+                                        pl.col('REF').alias('ALT'), pl.col('ALT').alias('REF')])
+    with pl.StringCache():
+        pl.select(pl.lit('string_') + pl.arange(0, 2 ** 22).cast(str)).to_series().cast(pl.Categorical)
+        scorefile, target = _cast_categorical(scorefile, target)
+        assert _match_variants(scorefile, target, strategies).shape[0] == 0
+        assert _match_variants(scorefile, target, strategies, merge=True).shape[0] == 0
+
+
+def test_merge_join():
+    sorted_keys = np.array([1, 2, 2, 5])
+    sorted_idx, key_idx = merge_join(sorted_keys, np.array([2, 3, 5, 2]))
+    assert list(zip(sorted_idx, key_idx)) == [(1, 0), (2, 0), (3, 2), (1, 3), (2, 3)]
+
+
+def test_sort_scorefile(small_scorefile):
+    scorefile = sort_scorefile(small_scorefile.reverse())
+    assert scorefile['chr_position'].to_list() == [1, 2, 3]
+    # keys are checked, not trusted
+    assert sort_scorefile(scorefile.reverse())['chr_position'].to_list() == [1, 2, 3]
+
+
+def test_merge_match(small_scorefile, small_target):
+    strategies: list[str] = _match_strategies(skip_flip=False)
+    cols: list[str] = ['accession', 'ID', 'match_type']
+    with pl.StringCache():
+        scorefile, target = _cast_categorical(small_scorefile.with_column(pl.col('chr_name').cast(str)),
+                                              small_target.with_column(pl.col('#CHROM').cast(str)))
+        merged = _match_variants(scorefile, target, strategies, merge=True)
+        hashed = _match_variants(scorefile, target, strategies)
+        assert merged.shape[0] > 0
+        assert (merged.with_columns(pl.col(cols).cast(str)).sort(cols)
+                .frame_equal(hashed.with_columns(pl.col(cols).cast(str)).sort(cols), null_equal=True))
+
+
+def test_read_target_batches(small_bim):
+    target = read_target(small_bim, remove_multiallelic=False)
+    # tiny batches: one record per batch
+    batches = list(read_target_batches(small_bim, remove_multiallelic=False, batch_size=1))
+    assert len(batches) == target.shape[0]
+    assert pl.concat(batches).frame_equal(target)
+
+
+def test_target_projection(small_bim, small_pvar):
+    assert _target_projection(_detect_target_format(small_pvar)) == {'column_1': '#CHROM', 'column_2': 'POS',
+                                                                     'column_3': 'ID', 'column_4': 'REF',
+                                                                     'column_5': 'ALT'}
+    pvar = read_target(small_pvar, remove_multiallelic=False)
+    assert pvar.columns == ['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'is_multiallelic']
+    assert pvar.frame_equal(read_target(small_bim, remove_multiallelic=False))
+    assert read_target(small_pvar, remove_multiallelic=False, single_file=True, chrom='3')['ID'].to_list() == ['3:3:T:G']
+
+
+@pytest.mark.parametrize("target", ['small_bim', 'small_pvar'])
+@pytest.mark.parametrize("compression", ['gz', 'zst'])
+def test_compressed_target(target, compression, request):
+    path: str = request.getfixturevalue(target)
+    compressed_path: str = f"{path}.{compression}"
+    with open(path, 'rb') as f:
+        data: bytes = f.read()
+    if compression == 'gz':
+        with gzip.open(compressed_path, 'wb') as f:
+            f.write(data)
+    else:
+        zstandard = pytest.importorskip('zstandard')
+        with open(compressed_path, 'wb') as f:
+            f.write(zstandard.ZstdCompressor().compress(data))
+
+    target_df = read_target(path, remove_multiallelic=False)
+    with patch('pgscatalog_utils.match.read._detect_target_format', wraps=_detect_target_format) as detect:
+        assert read_target(compressed_path, remove_multiallelic=False).frame_equal(target_df)
+    assert detect.call_count == 1  # the header is only decompressed once
+    assert read_target(compressed_path, remove_multiallelic=False, single_file=True,
+                       chrom='2').frame_equal(target_df.filter(pl.col('#CHROM') == '2'))
+    batches = list(read_target_batches(compressed_path, remove_multiallelic=False, batch_size=1))
+    assert pl.concat(batches).frame_equal(target_df)
+
+    # single target mode decompresses the target once for all chromosomes
+    with patch('pgscatalog_utils.match.read._parse_target_batches', wraps=_parse_target_batches) as parse:
+        chroms = dict(read_target_chroms(compressed_path, remove_multiallelic=False, chroms=['3', '1', '4']))
+    assert parse.call_count == 1
+    assert list(chroms) == ['3', '1', '4'] and chroms['4'].is_empty()
+    assert all(chroms[x].frame_equal(target_df.filter(pl.col('#CHROM') == x)) for x in ['1', '3'])
+
+
+def test_target_cache(small_bim, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    target = read_target(small_bim, remove_multiallelic=False)
+
+    miss = read_target(small_bim, remove_multiallelic=False, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+    hit = read_target(small_bim, remove_multiallelic=False, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+    assert miss.frame_equal(target) and hit.frame_equal(target)
+
+    chrom = read_target(small_bim, remove_multiallelic=False, single_file=True, chrom='2', cache_dir=cache_dir)
+    assert chrom['ID'].to_list() == ['2:2:T:A']
+
+
+def test_fast_match_cache(small_scorefile_path, small_bim, split_bims, tmp_path, run_match):
+    # split targets are cached one file at a time
+    cache_dir = str(tmp_path / "cache")
+    expected = _read_output(run_match(small_scorefile_path, small_bim, out_dir='single'))
+    for i in range(2):  # cache miss, then hit
+        fast = _read_output(run_match(small_scorefile_path, split_bims, '--fast', '--cache_dir', cache_dir,
+                                      out_dir=f"fast_{i}"))
+        assert fast.sort('ID').frame_equal(expected.sort('ID'))
+    assert len(os.listdir(cache_dir)) == 3
+
+
+@pytest.mark.parametrize("extension", ['parquet', 'arrow'])
+def test_columnar_scorefile(small_scorefile_path, tmp_path, extension):
+    path = str(tmp_path / f"small_scorefile.{extension}")
+    write_scorefile(pl.read_csv(small_scorefile_path, sep='\t', dtype={'chr_name': str}).lazy(), path)
+
+    columnar: pl.DataFrame = pl.read_parquet(path) if extension == 'parquet' else pl.read_ipc(path)
+    assert columnar['chr_position'].dtype == pl.UInt64
+    assert columnar['effect_allele'].dtype == pl.Categorical
+
+    # categoricals aren't cast to strings and back: alleles are complemented through their categories
+    scorefile: pl.DataFrame = read_scorefile(path)
+    assert all(scorefile[x].dtype == pl.Categorical for x in ['effect_allele', 'other_allele', 'effect_allele_FLIP',
+                                                              'other_allele_FLIP', 'effect_type', 'accession'])
+    text: pl.DataFrame = read_scorefile(small_scorefile_path)
+    assert (scorefile.with_columns([pl.col(pl.Categorical).cast(str)])
+            .frame_equal(text.select(scorefile.columns), null_equal=True))
+
+
+@pytest.mark.parametrize("flags", [[], ['--merge'], ['--incremental']])
+def test_match_columnar_scorefile(small_scorefile_path, small_bim, tmp_path, run_match, flags):
+    path = str(tmp_path / "small_scorefile.parquet")
+    write_scorefile(pl.read_csv(small_scorefile_path, sep='\t', dtype={'chr_name': str}).lazy(), path)
+    if '--incremental' in flags:
+        flags = flags + ['--cache_dir', str(tmp_path / "cache")]
+
+    expected = _read_output(run_match(small_scorefile_path, small_bim, out_dir='text'))
+    assert _read_output(run_match(path, small_bim, *flags)).sort('ID').frame_equal(expected.sort('ID'))
+
+
+@pytest.mark.parametrize("target,flags", [('small_bim', ['--stream', '--batch_size', '1']),
+                                          ('split_bims', ['--stream', '--batch_size', '1']),
+                                          ('small_bim', ['--fast']),
+                                          ('split_bims', ['--fast']),
+                                          ('split_bims_gz', ['--fast']),
+                                          ('split_bims', ['--workers', '1']),
+                                          ('split_bims', ['--workers', '2']),
+                                          ('small_bim', ['--merge']),
+                                          ('small_bim', ['--merge', '--stream', '--batch_size', '1']),
+                                          ('small_bim', ['--merge', '--fast']),
+                                          ('split_bims', ['--merge', '--workers', '2'])])
+def test_match_modes(small_scorefile_path, small_bim, target, flags, run_match, request):
+    # every match mode gets the same matches as matching a single target
+    expected = _read_output(run_match(small_scorefile_path, small_bim, out_dir='single'))
+    scorefile = _read_output(run_match(small_scorefile_path, request.getfixturevalue(target), *flags))
+    assert scorefile.sort('ID').frame_equal(expected.sort('ID'))
+    assert set(scorefile['ID'].to_list()) == {'1:1:A:C', '3:3:T:G'}
+
+
+def test_stream_match(small_scorefile_path, split_bims, run_match):
+    with patch('pgscatalog_utils.match.match._cast_categorical', wraps=_cast_categorical) as cast:
+        run_match(small_scorefile_path, split_bims, '--stream', '--batch_size', '1')
+
+    # the scorefile is cast once before streaming, not again for every batch
+    assert cast.called and all(x.args[0]['effect_allele'].dtype == pl.Categorical for x in cast.call_args_list)
+
+
+
+@pytest.mark.parametrize("target,flags", [('small_bim', []),
+                                          ('split_bims', ['--workers', '1']),
+                                          ('split_bims', ['--stream', '--batch_size', '1'])])
+def test_merge_sorts_once(small_scorefile_path, target, flags, run_match, request):
+    # the scorefile is sorted once, not again for each chromosome, target or batch
+    with patch('pgscatalog_utils.match.merge.chrom_codes', wraps=chrom_codes) as sort_codes:
+        out_dir = run_match(small_scorefile_path, request.getfixturevalue(target), '--merge', *flags)
+    assert sort_codes.call_count == 1
+    assert set(_read_output(out_dir)['ID'].to_list()) == {'1:1:A:C', '3:3:T:G'}
+
+@pytest.mark.parametrize("target", ['small_bim', 'split_bims'])
+def test_partitioned_match(small_scorefile_path, target, tmp_path, run_match, request):
+    partitioned_path = str(tmp_path / "partitioned.txt")
+    (pl.read_csv(small_scorefile_path, sep='\t', dtype={'chr_name': str})
+     .sort('chr_name', reverse=True).lazy()
+     .pipe(write_scorefile, partitioned_path, partition=True))
+    assert read_chrom_index(partitioned_path, 3) == {'1': (0, 1), '2': (1, 1), '3': (2, 1)}
+
+    scorefiles = [_read_output(run_match(path, request.getfixturevalue(target), out_dir=f"out_{i}"))
+                  for i, path in enumerate([small_scorefile_path, partitioned_path])]
+    assert scorefiles[0].sort('ID').frame_equal(scorefiles[1].sort('ID'))
+    assert set(scorefiles[1]['ID'].to_list()) == {'1:1:A:C', '3:3:T:G'}
+
+
+def test_compressed_output(small_scorefile_path, small_bim, tmp_path, run_match):
+    scorefiles = [sorted(os.listdir(run_match(small_scorefile_path, small_bim, *flags, out_dir=f"out_{i}")))
+                  for i, flags in enumerate([[], ['--compress', '--workers', '2', '--split', '--sparse']])]
+
+    assert scorefiles[0] == ['test_ALL_additive_0.scorefile']
+    assert scorefiles[1] == ['test_1_additive_0.scorefile.gz', 'test_1_additive_0.weights.npz',
+                             'test_3_additive_0.scorefile.gz', 'test_3_additive_0.weights.npz']
+    with gzip.open(tmp_path / "out_1" / "test_3_additive_0.scorefile.gz", 'rt') as f:
+        assert f.read() == 'ID\teffect_allele\ttest\n3:3:T:G\tG\t3.0\n'
+
+
+def test_write_batches(tmp_path):
+    matches = pl.DataFrame({'ID': ['a', 'b', 'a', 'c'], 'matched_effect_allele': ['A', 'C', 'A', 'G'],
+                            'accession': ['x', 'y', 'y', 'x'], 'effect_weight': [1.0, 2.0, 3.0, 4.0]})
+    paths = [str(tmp_path / "all.txt"), str(tmp_path / "batched.txt")]
+    _write_scorefile(paths[0], matches, compress=False)
+    with patch('pgscatalog_utils.match.write._BATCH_CELLS', 1):  # one output row per batch
+        _write_scorefile(paths[1], matches, compress=False)
+
+    with open(paths[0]) as a, open(paths[1]) as b:
+        assert a.read() == b.read() == 'ID\teffect_allele\tx\ty\na\tA\t1.0\t3.0\nb\tC\t0.0\t2.0\nc\tG\t4.0\t0.0\n'
+
+
+def test_sparse_weights(tmp_path):
+    matches = pl.DataFrame({'ID': ['a', 'b', 'a', 'c', 'a'], 'matched_effect_allele': ['A', 'C', 'A', 'G', 'A'],
+                            'accession': ['x', 'y', 'y', 'x', 'x'], 'effect_weight': [1.0, 2.0, 3.0, 0.0, 5.0]})
+    scorefile_path = str(tmp_path / "test_ALL_additive_0.scorefile")
+    _write_scorefile(scorefile_path, matches, compress=False)
+    write_sparse_weights(matches, sparse_weights_path(scorefile_path))
+
+    dense = pl.read_csv(scorefile_path, sep='\t')
+    sparse = read_sparse_weights(str(tmp_path / "test_ALL_additive_0.weights.npz"))
+    assert sparse.shape == (3, 2) and sparse.data.tolist() == [1.0, 3.0, 2.0]  # zeros aren't stored
+    assert sparse.variants.frame_equal(dense.select(['ID', 'effect_allele']))
+    assert sparse.accessions == dense.columns[2:]
+    assert (sparse.to_dense() == dense.select(sparse.accessions).to_numpy()).all()
+
+
+
+def test_sparse_weights_cast(tmp_path):
+    matches = pl.DataFrame({'ID': ['a', 'b'], 'matched_effect_allele': ['A', 'C'], 'accession': ['x', 'x'],
+                            'effect_weight': pl.Series([0.5, 0.25], dtype=pl.Float32)})
+    path = str(tmp_path / "test.weights.npz")
+    write_sparse_weights(matches, path)
+
+    sparse = read_sparse_weights(path)
+    assert sparse.data.dtype == np.float64 and sparse.data.tolist() == [0.5, 0.25]
+
+def test_incremental_match(small_scorefile_path, small_bim, tmp_path, run_match):
+    cache_dir = str(tmp_path / "cache")
+    scorefile = pl.read_csv(small_scorefile_path, sep='\t')
+    new_path = str(tmp_path / "new_scorefile.txt")
+    pl.concat([scorefile, scorefile.with_columns([pl.lit('new').alias('accession'),
+                                                  pl.col('effect_weight') * 2])]).write_csv(new_path, sep='\t')
+
+    def run(path: str, out_dir: str, extra: list[str]) -> pl.DataFrame:
+        return _read_output(run_match(path, small_bim, *extra, out_dir=out_dir))
+
+    incremental: list[str] = ['--incremental', '--cache_dir', cache_dir]
+    run(small_scorefile_path, "first", incremental)
+    n_cached: int = len([x for x in os.listdir(cache_dir) if x.startswith('matches_')])
+
+    with patch('pgscatalog_utils.match.match_variants._match_scorefile', wraps=_match_scorefile) as matcher:
+        updated = run(new_path, "updated", incremental)
+        assert set(matcher.call_args.args[1]['accession'].to_list()) == {'new'}  # only the new accession is matched
+    assert len([x for x in os.listdir(cache_dir) if x.startswith('matches_')]) == n_cached + 1
+
+    with patch('pgscatalog_utils.match.match_variants._match_scorefile', wraps=_match_scorefile) as matcher:
+        assert run(new_path, "cached", incremental).frame_equal(updated)
+        matcher.assert_not_called()
+
+    full = run(new_path, "full", [])
+    assert updated.sort('ID').frame_equal(full.select(updated.columns).sort('ID'))
+    assert updated['new'].to_list() == [x * 2 for x in updated['test'].to_list()]
+
+
+
+def test_match_cache_keys(small_bim):
+    scorefile = pl.DataFrame({'chr_name': ['1', '2', '1', '3'], 'accession': ['b', 'a', 'b', 'c']})
+    keys = match_cache_keys(scorefile, [small_bim], {'skip_flip': False})
+    assert list(keys) == ['b', 'a', 'c']  # in scorefile order
+    assert keys == match_cache_keys(scorefile.sort('accession'), [small_bim], {'skip_flip': False})
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_empty_scorefile(small_scorefile_path, small_bim, tmp_path, run_match, caplog, incremental):
+    path = str(tmp_path / "empty.txt")
+    pl.read_csv(small_scorefile_path, sep='\t').head(0).write_csv(path, sep='\t')
+    flags = ['--incremental', '--cache_dir', str(tmp_path / "cache")] if incremental else []
+
+    with pytest.raises(Exception):
+        run_match(path, small_bim, *flags)
+    assert "No variants in scorefile" in caplog.text
+
+def test_check_match_rate(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # log is written to the working directory
+    scorefile = pl.DataFrame({'chr_name': ['1', '1', '1', '2'], 'chr_position': [1, 2, 3, 4],
+                              'effect_allele': ['A', 'A', 'A', 'A'], 'other_allele': ['C', 'C', 'C', 'C'],
+                              'effect_weight': [1.0, 1.0, 1.0, 1.0], 'effect_type': ['additive'] * 4,
+                              'accession': ['good', 'good', 'bad', 'bad']})
+
+    with pl.StringCache():
+        matches = (scorefile.head(3)
+                   .with_columns([pl.col(['effect_type', 'accession']).cast(pl.Categorical),
+                                  pl.lit('refalt').alias('match_type')]))
+        checked = check_match_rate(scorefile, matches, min_overlap=0.75, dataset='test')
+
+    assert checked['match_pass'].to_list() == [True, True, False]
+    assert checked['match_rate'].to_list() == [1, 1, 0.5]
+    log = pl.read_csv('test_log.csv')
+    assert log.shape[0] == 4
+    passed = log.groupby('accession').agg(pl.col('match_pass').first()).sort('accession')
+    assert passed.rows() == [('bad', False), ('good', True)]
+
+
+def test_distinct_weights():
+    df = pl.DataFrame({'accession': ['test'] * 6,
+                       'chr_name': ['1'] * 6,
+                       'chr_position': [1, 1, 2, 2, 2, 3],
+                       'effect_allele': ['A'] * 6,
+                       'other_allele': ['G', 'G', None, None, None, 'G'],
+                       'match_type': ['refalt_flip', 'altref', 'no_oa_alt', 'no_oa_ref', 'no_oa_ref', 'altref_flip'],
+                       'ID': ['1:1', '1:1b', '1:2', '1:2b', '1:2c', '1:3']})
+
+    # best match types are kept for duplicates, including ties. singletons are always kept
+    assert _get_distinct_weights(df)['ID'].to_list() == ['1:1b', '1:2b', '1:2c', '1:3']
+
+
+def test_complement_valid_alleles():
+    df = pl.DataFrame({'effect_allele': ['A', 'ACGT', 'AN', 'C', None],
+                       'other_allele': ['G', None, 'T', '-', 'A']})
+    flipped = complement_valid_alleles(df, ['effect_allele', 'other_allele'])
+    assert flipped['effect_allele_FLIP'].to_list() == ['T', 'TGCA', 'AN', 'G', None]
+    assert flipped['other_allele_FLIP'].to_list() == ['C', None, 'A', '-', 'T']
+
+
+def test_complement_categories():
+    df = pl.DataFrame({'effect_allele': ['A', 'ACGT', 'AN', 'C', None, 'A']})
+    with pl.StringCache():
+        flipped = complement_valid_alleles(df.with_column(pl.col('effect_allele').cast(pl.Categorical)),
+                                           ['effect_allele'])
+    assert flipped['effect_allele_FLIP'].dtype == pl.Categorical
+    assert flipped['effect_allele_FLIP'].cast(str).to_list() == ['T', 'TGCA', 'AN', 'G', None, 'T']
+
+
+def test_complement_no_alleles():
+    df = pl.DataFrame({'REF': pl.Series([], dtype=pl.Utf8)})
+    assert complement_valid_alleles(df, ['REF']).columns == ['REF', 'REF_FLIP']
+
+
+def test_no_matches(small_scorefile, small_target):
+    # e.g. a chromosome or split target without any matches
+    with pl.StringCache():
+        matches = get_all_matches(small_scorefile, small_target.with_column(pl.col('POS') + 100), False, False)
+    assert matches.shape[0] == 0
+
+
+def _read_output(out_dir: str) -> pl.DataFrame:
+    return pl.read_csv(os.path.join(out_dir, 'test_ALL_additive_0.scorefile'), sep='\t')
+
 @pytest.fixture
 def small_scorefile():
     df = pl.DataFrame({"accession": ["test", "test", "test"],
@@ -124,3 +519,52 @@ def small_target():
                          "ID": ["1:1:A:C", "2:2:T:A", "3:3:T:G"],
                          "is_multiallelic": [False, False, False]})
 
+
+
+@pytest.fixture
+def small_bim(small_target, tmp_path):
+    path = tmp_path / "small.bim"
+    (small_target.with_column(pl.lit(0).alias('CM'))
+     .select(['#CHROM', 'ID', 'CM', 'POS', 'REF', 'ALT'])
+     .write_csv(path, has_header=False, sep='\t'))
+    return str(path.resolve())
+
+
+@pytest.fixture
+def small_pvar(small_target, tmp_path):
+    path = tmp_path / "small.pvar"
+    with open(path, 'w') as f:
+        f.write('##fileformat=VCFv4.2\n')
+        f.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+        for chrom, pos, ref, alt, id in small_target.select(['#CHROM', 'POS', 'REF', 'ALT', 'ID']).rows():
+            f.write(f'{chrom}\t{pos}\t{id}\t{ref}\t{alt}\t.\tPASS\tAF=0.5\n')
+    return str(path.resolve())
+
+
+@pytest.fixture
+def small_scorefile_path(small_scorefile, tmp_path):
+    path = tmp_path / "small_scorefile.txt"
+    (small_scorefile.select(['chr_name', 'chr_position', 'effect_allele', 'other_allele', 'effect_weight',
+                             'effect_type', 'accession'])
+     .write_csv(path, sep='\t'))
+    return str(path.resolve())
+
+
+@pytest.fixture
+def split_bims(small_target, tmp_path):
+    for chrom in small_target['#CHROM'].to_list():
+        path = tmp_path / f"split_{chrom}.bim"
+        (small_target.filter(pl.col('#CHROM') == chrom)
+         .with_column(pl.lit(0).alias('CM'))
+         .select(['#CHROM', 'ID', 'CM', 'POS', 'REF', 'ALT'])
+         .write_csv(path, has_header=False, sep='\t'))
+    return str((tmp_path / "split_*.bim").resolve())
+
+
+@pytest.fixture
+def split_bims_gz(split_bims):
+    for path in glob(split_bims):
+        with open(path, 'rb') as f, gzip.open(f"{path}.gz", 'wb') as gz:
+            gz.write(f.read())
+        os.remove(path)
+    return f"{split_bims}.gz"
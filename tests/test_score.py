@@ -0,0 +1,161 @@
+import os
+
+import numpy as np
+import polars as pl
+import pytest
+
+from pgscatalog_utils.score.read import read_genotypes, read_dosages, read_matched_dosages, _BED_LOOKUP
+from pgscatalog_utils.score.score import score_genotypes
+
+# dosages of the first bim allele (A1): variants x samples, nan is missing
+DOSAGES = np.array([[0, 1, 2, 1, 0],
+                    [2, np.nan, 1, 0, 0],
+                    [1, 1, 1, 2, np.nan]])
+
+
+def test_read_bed(plink1_genotypes):
+    genotypes = read_genotypes(plink1_genotypes)
+    assert genotypes.samples['IID'].to_list() == [f"sample_{i}" for i in range(5)]
+    assert genotypes.variants['counted_allele'].to_list() == ['A', 'C', 'G']
+    dosages = read_dosages(genotypes, np.array([2, 0]))
+    assert dosages.dtype == np.float32  # half the memory of float64, and exact
+    np.testing.assert_array_equal(dosages, DOSAGES[[2, 0]])
+
+
+def test_read_matched_dosages(plink1_genotypes, matches):
+    variants, dosages = read_matched_dosages(read_genotypes(plink1_genotypes), matches.filter(pl.col('ID') != '1:2'))
+    assert variants['ID'].to_list() == ['1:1', '2:3']
+    np.testing.assert_array_equal(dosages, DOSAGES[[0, 2]])
+
+
+def test_bed_lookup():
+    # every byte decodes to the genotypes of four samples, lowest bits first
+    for byte in range(256):
+        codes = [(byte >> shift) & 0b11 for shift in [0, 2, 4, 6]]
+        np.testing.assert_array_equal(_BED_LOOKUP[byte], [[2, np.nan, 1, 0][x] for x in codes])
+
+
+@pytest.mark.parametrize("genotypes", ['plink1_genotypes', 'plink2_genotypes'])
+def test_score_genotypes(genotypes, matches, request):
+    scores = score_genotypes(matches, request.getfixturevalue(genotypes), block_size=2)
+    assert scores.columns[-2:] == ['PGS1_SUM', 'PGS2_SUM']
+    np.testing.assert_allclose(scores['PGS1_SUM'].to_numpy(), _expected(matches.filter(pl.col('accession') == 'PGS1')))
+    np.testing.assert_allclose(scores['PGS2_SUM'].to_numpy(), _expected(matches.filter(pl.col('accession') == 'PGS2')))
+
+
+def test_score_split_genotypes(matches, split_plink1_genotypes, plink1_genotypes):
+    split = score_genotypes(matches, split_plink1_genotypes, workers=2)
+    assert split.frame_equal(score_genotypes(matches, plink1_genotypes))
+
+
+def test_score_multiallelic(tmp_path, caplog):
+    pgenlib = pytest.importorskip('pgenlib')
+    prefix = tmp_path / "multiallelic"
+    with open(f"{prefix}.psam", 'w') as f:
+        f.write('#IID\n' + ''.join(f"sample_{i}\n" for i in range(3)))
+    with open(f"{prefix}.pvar", 'w') as f:
+        f.write('#CHROM\tPOS\tID\tREF\tALT\n1\t1\t1:1\tC\tA,G\n1\t2\t1:2\tT\tC\n')
+
+    writer = pgenlib.PgenWriter(f"{prefix}.pgen".encode(), 3, 2, False, allele_ct_limit=3)
+    writer.append_alleles(np.array([0, 1, 2, 2, 1, 2], dtype=np.int32), allele_ct=3)  # C/A, G/G, A/G
+    writer.append_biallelic(np.array([0, 1, 2], dtype=np.int8))
+    writer.close()
+
+    matches = pl.DataFrame({'ID': ['1:1', '1:1', '1:1', '1:2', '1:1'],
+                            'matched_effect_allele': ['G', 'A', 'C', 'C', 'T'],
+                            'effect_type': ['additive'] * 5,
+                            'accession': ['PGS1', 'PGS1', 'PGS1', 'PGS1', 'PGS2'],
+                            'effect_weight': [1.0, 0.5, 2.0, 1.0, 1.0]})
+    scores = score_genotypes(matches, f"{prefix}.pgen")
+    # the second ALT allele (G) is scored, T isn't an allele of 1:1
+    np.testing.assert_allclose(scores['PGS1_SUM'].to_numpy(), [0 + 0.5 + 2 + 0, 2 + 0 + 0 + 1, 1 + 0.5 + 0 + 2])
+    np.testing.assert_allclose(scores['PGS2_SUM'].to_numpy(), [0, 0, 0])
+    assert "1 weights of PGS2 dropped" in caplog.text
+
+
+def test_match_and_score(plink1_genotypes, tmp_path, run_match):
+    scorefile_path = str(tmp_path / "scorefile.txt")
+    pl.DataFrame({'chr_name': ['1', '1', '2'], 'chr_position': [1, 2, 3], 'effect_allele': ['C', 'T', 'G'],
+                  'other_allele': ['A', 'C', 'A'], 'effect_weight': [0.5, 1.0, 2.0], 'effect_type': ['additive'] * 3,
+                  'accession': ['PGS1'] * 3}).write_csv(scorefile_path, sep='\t')
+    out_dir = run_match(scorefile_path, plink1_genotypes.replace('.bed', '.bim'), '--genotypes', plink1_genotypes)
+
+    scores = pl.read_csv(os.path.join(out_dir, "test.sscore"), sep='\t', dtype={'IID': str})
+    assert scores.columns == ['FID', 'IID', 'PGS1_SUM']
+    expected = pl.DataFrame({'ID': ['1:1', '1:2', '2:3'], 'matched_effect_allele': ['C', 'T', 'G'],
+                             'effect_type': ['additive'] * 3, 'effect_weight': [0.5, 1.0, 2.0]})
+    np.testing.assert_allclose(scores['PGS1_SUM'].to_numpy(), _expected(expected))
+
+
+def _expected(matches: pl.DataFrame) -> np.ndarray:
+    """ Calculate scores one variant and sample at a time """
+    means = np.nanmean(DOSAGES, axis=1)
+    a1 = {'1:1': 'A', '1:2': 'C', '2:3': 'G'}
+    scores = np.zeros(DOSAGES.shape[1])
+    for variant_id, effect_allele, effect_type, weight in matches.select(['ID', 'matched_effect_allele',
+                                                                          'effect_type', 'effect_weight']).rows():
+        i = list(a1).index(variant_id)
+        for sample in range(DOSAGES.shape[1]):
+            dosage = means[i] if np.isnan(DOSAGES[i, sample]) else DOSAGES[i, sample]
+            dosage = dosage if effect_allele == a1[variant_id] else 2 - dosage
+            if effect_type == 'is_dominant':
+                dosage = min(dosage, 1)
+            elif effect_type == 'is_recessive':
+                dosage = max(dosage - 1, 0)
+            scores[sample] += dosage * weight
+    return scores
+
+
+@pytest.fixture
+def matches():
+    return pl.DataFrame({'ID': ['1:1', '1:2', '2:3', '1:1', '1:2', '2:3'],
+                         'matched_effect_allele': ['A', 'T', 'G', 'C', 'T', 'G'],
+                         'effect_type': ['additive', 'additive', 'is_dominant', 'additive', 'is_recessive',
+                                         'additive'],
+                         'accession': ['PGS1', 'PGS1', 'PGS1', 'PGS2', 'PGS2', 'PGS2'],
+                         'effect_weight': [0.5, -1.0, 2.0, 0.25, 1.5, 3.0]})
+
+
+@pytest.fixture
+def plink1_genotypes(tmp_path):
+    return _write_plink1(tmp_path / "test", [0, 1, 2])
+
+
+@pytest.fixture
+def split_plink1_genotypes(tmp_path):
+    _write_plink1(tmp_path / "split_1", [0, 1])
+    _write_plink1(tmp_path / "split_2", [2])
+    return str(tmp_path / "split_*.bed")
+
+
+@pytest.fixture
+def plink2_genotypes(tmp_path):
+    pgenlib = pytest.importorskip('pgenlib')
+    prefix = tmp_path / "test"
+    with open(f"{prefix}.psam", 'w') as f:
+        f.write('#IID\n' + ''.join(f"sample_{i}\n" for i in range(DOSAGES.shape[1])))
+    with open(f"{prefix}.pvar", 'w') as f:  # the counted (ALT) allele of a pvar is the first allele of a bim
+        f.write('#CHROM\tPOS\tID\tREF\tALT\n1\t1\t1:1\tC\tA\n1\t2\t1:2\tT\tC\n2\t3\t2:3\tA\tG\n')
+
+    writer = pgenlib.PgenWriter(f"{prefix}.pgen".encode(), DOSAGES.shape[1], DOSAGES.shape[0], False)
+    for dosages in DOSAGES:
+        writer.append_biallelic(np.nan_to_num(dosages, nan=-9).astype(np.int8))
+    writer.close()
+    return f"{prefix}.pgen"
+
+
+def _write_plink1(prefix, variants: list[int]) -> str:
+    bim = ['1\t1:1\t0\t1\tA\tC', '1\t1:2\t0\t2\tC\tT', '2\t2:3\t0\t3\tG\tA']
+    with open(f"{prefix}.bim", 'w') as f:
+        f.write(''.join(bim[i] + '\n' for i in variants))
+    with open(f"{prefix}.fam", 'w') as f:
+        f.write(''.join(f"family sample_{i} 0 0 0 -9\n" for i in range(DOSAGES.shape[1])))
+
+    code = {2: 0b00, 1: 0b10, 0: 0b11}  # missing is 0b01
+    with open(f"{prefix}.bed", 'wb') as f:
+        f.write(bytes([0x6c, 0x1b, 0x01]))
+        for i in variants:
+            codes = [0b01 if np.isnan(x) else code[int(x)] for x in DOSAGES[i]] + [0] * (-DOSAGES.shape[1] % 4)
+            f.write(bytes([codes[j] | codes[j + 1] << 2 | codes[j + 2] << 4 | codes[j + 3] << 6
+                           for j in range(0, len(codes), 4)]))
+    return f"{prefix}.bed"